@@ -0,0 +1,138 @@
+import logging
+import struct
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+# The serving artifact layout is defined once, next to the export run after training. The app image copies
+# modelling/common for it, the module only needs numpy
+from modelling.common.serving_artifact import SERVING_ARTIFACT_FORMAT_VERSION, pipeline_to_arrays
+
+logger = logging.getLogger(__name__)
+
+
+class CompiledPipeline:
+    """Champion Pipeline flattened into NumPy arrays, so rows can be scored without pandas or sklearn dispatch"""
+
+    def __init__(self, numeric_features, numeric_columns, scaler_mean, scaler_scale, categorical_features, category_index,
+                 n_features, feature, threshold, children_left, children_right, leaf_value, roots, max_depth):
+        self.numeric_features = list(numeric_features)
+        self.numeric_columns = np.asarray(numeric_columns, dtype=np.int64)
+        self.scaler_mean = np.asarray(scaler_mean, dtype=np.float64)
+        self.scaler_scale = np.asarray(scaler_scale, dtype=np.float64)
+        self.categorical_features = list(categorical_features)
+        self.category_index = category_index  # One {category: output column} dict per categorical feature
+        self.n_features = int(n_features)
+        self.feature = feature
+        self.threshold = threshold
+        self.children_left = children_left
+        self.children_right = children_right
+        self.leaf_value = leaf_value
+        self.roots = roots
+        self.max_depth = int(max_depth)
+
+    @classmethod
+    def from_pipeline(cls, pipeline):
+        """Compile a fitted Pipeline(preprocessor=ColumnTransformer, reg=forest regressor), flattened exactly as
+        the serving artifact is"""
+        return cls.from_arrays(pipeline_to_arrays(pipeline))
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        """Load a serving artifact (.npz) exported after training, no sklearn needed.
+
+        With mmap_mode the tree arrays are memory-mapped (see load_arrays), so every process serving the same
+        artifact shares one copy of them in the page cache.
+        """
+        return cls.from_arrays(load_arrays(path, mmap_mode))
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Build from the {name: array} layout of modelling/common/serving_artifact.py pipeline_to_arrays"""
+        if int(arrays["format_version"]) != SERVING_ARTIFACT_FORMAT_VERSION:
+            raise ValueError(f"Unsupported serving artifact format version: {int(arrays['format_version'])}")
+
+        category_index = []
+        for i, offset in enumerate(arrays["category_offsets"]):
+            categories = arrays[f"categories_{i}"].tolist()
+            category_index.append({category: int(offset) + j for j, category in enumerate(categories)})
+
+        return cls(arrays["numeric_features"].tolist(), arrays["numeric_columns"], arrays["scaler_mean"],
+                   arrays["scaler_scale"], arrays["categorical_features"].tolist(), category_index,
+                   arrays["n_features"], arrays["feature"], arrays["threshold"], arrays["children_left"],
+                   arrays["children_right"], arrays["leaf_value"], arrays["roots"], arrays["max_depth"])
+
+    def encode(self, records):
+        """Transform a list of raw input dicts into the float32 matrix the trees were fitted on"""
+        numeric = np.array([[record[name] for name in self.numeric_features] for record in records], dtype=np.float64)
+        X = np.zeros((len(records), self.n_features), dtype=np.float32)
+        X[:, self.numeric_columns] = (numeric - self.scaler_mean) / self.scaler_scale
+
+        # Unknown categories are left as all zeros, same as handle_unknown='ignore'
+        rows = np.arange(len(records))
+        for name, index in zip(self.categorical_features, self.category_index):
+            columns = np.array([index.get(record[name], -1) for record in records])
+            known = columns >= 0
+            X[rows[known], columns[known]] = 1.0
+
+        return X
+
+    def predict_matrix(self, X):
+        # Walk every tree for every row at once, leaves point to themselves so extra steps are no-ops
+        rows = np.arange(X.shape[0])[:, None]
+        nodes = np.broadcast_to(self.roots, (X.shape[0], len(self.roots)))
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.children_left[nodes], self.children_right[nodes])
+
+        return self.leaf_value[nodes].mean(axis=1, dtype=np.float64)
+
+    def predict_records(self, records):
+        return self.predict_matrix(self.encode(records))
+
+    def predict_one(self, record):
+        return self.predict_records([record])[0]
+
+    def predict(self, X):
+        """Drop-in replacement for Pipeline.predict on a DataFrame"""
+        if isinstance(X, pd.DataFrame):
+            X = X.to_dict(orient="records")
+        return self.predict_records(X)
+
+
+def load_arrays(path, mmap_mode=None):
+    """{name: array} of an .npz file.
+
+    np.load ignores mmap_mode for .npz files, so with mmap_mode the arrays stored uncompressed (np.savez) are
+    memory-mapped from their offset in the zip here. Members of a compressed .npz (np.savez_compressed) cannot be,
+    and are read into memory.
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as file:
+        compressed = [info.filename for info in archive.infolist() if info.compress_type != zipfile.ZIP_STORED]
+        if mmap_mode is not None and compressed:
+            logger.warning("%s is compressed, its arrays are read into memory instead of memory-mapped", path)
+
+        for info in archive.infolist():
+            name = info.filename.removesuffix(".npy")
+            if mmap_mode is None or info.filename in compressed:
+                with archive.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member, allow_pickle=False)
+                continue
+
+            # The member's data follows its local header, whose name and extra field lengths are at bytes 26-29
+            file.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack("<HH", file.read(4))
+            file.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(file)
+            read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+            shape, fortran_order, dtype = read_header(file)
+            if dtype.hasobject or len(shape) == 0 or 0 in shape:  # Nothing worth mapping
+                file.seek(info.header_offset + 30 + name_length + extra_length)
+                arrays[name] = np.lib.format.read_array(file, allow_pickle=False)
+            else:
+                arrays[name] = np.memmap(path, dtype=dtype, mode=mmap_mode, offset=file.tell(), shape=shape,
+                                         order="F" if fortran_order else "C")
+
+    return arrays
@@ -1,11 +1,72 @@
-import joblib
+import asyncio
+import json
+import logging
+import os
+import time
+
+import numpy as np
 import pandas as pd
-from fastapi import FastAPI
-from pydantic import BaseModel
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, model_validator
+
+from .metrics import PREDICTION_ERRORS, PRICE_LOOKUPS, RequestMetricsMiddleware, observe_stages, render_metrics
+from .micro_batching import MicroBatcher
+from .model_store import ModelStore
+from .prediction_cache import PredictionCache
+from .scoring_backend import make_backend
+
+logger = logging.getLogger(__name__)
 
 # Load model from local path. The model will be downloaded using the cicd_app_model.yml workflow
 # If using docker-compose up, have to use the cli to download the model first.
-loaded_model = joblib.load('./app/fastapi_app/champion_model/champion_model.joblib')
+# The serving artifact (.npz) is preferred when present since it loads faster and without sklearn,
+# and its arrays are memory-mapped (MODEL_MMAP_MODE, empty to read them) so scoring workers share them.
+# A new champion moved over MODEL_PATH is picked up by POST /admin/reload, or by the file watcher
+# when MODEL_WATCH_INTERVAL_SECONDS is set, without restarting the container.
+CHAMPION_MODEL_DIR = './app/fastapi_app/champion_model'
+SERVING_ARTIFACT_PATH = f'{CHAMPION_MODEL_DIR}/champion_model.npz'
+MODEL_PATH = os.getenv("MODEL_PATH") or (SERVING_ARTIFACT_PATH if os.path.exists(SERVING_ARTIFACT_PATH)
+                                         else f'{CHAMPION_MODEL_DIR}/champion_model.joblib')
+# Set PRICE_LOOKUP_PATH to a price_grid.npz built from the same champion to serve in-grid requests by interpolation
+# (a grid whose validation error is above PRICE_GRID_MAX_ERROR is not served)
+model_store = ModelStore(MODEL_PATH, mmap_mode=os.getenv("MODEL_MMAP_MODE", "r") or None,
+                         price_lookup_path=os.getenv("PRICE_LOOKUP_PATH") or None)
+model_store.start_watcher(float(os.getenv("MODEL_WATCH_INTERVAL_SECONDS", "0")))
+# POST /admin/reload is disabled unless ADMIN_TOKEN is set
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Model loaded at startup, kept for scripts and tests that score with it directly
+loaded_model = model_store.current.pipeline
+fast_model = model_store.current.fast_model
+
+# Batches larger than this are streamed back as newline-delimited JSON instead of a single response body
+PREDICT_BATCH_STREAM_THRESHOLD = int(os.getenv("PREDICT_BATCH_STREAM_THRESHOLD", "10000"))
+PREDICT_BATCH_STREAM_CHUNK_SIZE = int(os.getenv("PREDICT_BATCH_STREAM_CHUNK_SIZE", "1000"))
+
+# Scoring runs inline (one core) or in a pool of SCORING_WORKERS processes (defaults to all cores)
+scoring_backend = make_backend(os.getenv("SCORING_BACKEND", "inline"),
+                               int(os.getenv("SCORING_WORKERS", "0")) or None,
+                               on_stage_timings=observe_stages)
+
+def predict_records(records):
+    return scoring_backend.predict(model_store.current, records)
+
+# Concurrent /predict calls are coalesced into one predict call of up to PREDICT_BATCH_MAX_SIZE rows,
+# waiting at most PREDICT_BATCH_MAX_WAIT_MS for the batch to fill up
+micro_batcher = MicroBatcher(
+    predict_records,
+    max_batch_size=int(os.getenv("PREDICT_BATCH_MAX_SIZE", "64")),
+    max_wait_seconds=float(os.getenv("PREDICT_BATCH_MAX_WAIT_MS", "2")) / 1000,
+    max_in_flight=scoring_backend.n_workers,
+) if os.getenv("PREDICT_MICRO_BATCHING", "True") == "True" else None
+
+# Cache of single-row predictions, set PREDICTION_CACHE_SIZE=0 to disable
+prediction_cache = PredictionCache(
+    max_size=int(os.getenv("PREDICTION_CACHE_SIZE", "10000")),
+    ttl_seconds=float(os.getenv("PREDICTION_CACHE_TTL_SECONDS", "0")) or None,
+    eviction=os.getenv("PREDICTION_CACHE_EVICTION", "lru"),
+)
 
 # Define input data model
 class InputData(BaseModel):
@@ -16,24 +77,160 @@ class InputData(BaseModel):
     flat_model_revised: str
     town: str
     storey_range_grouped: str
-    
+
+# Columnar version of InputData for batch scoring, one list per feature
+class ColumnarInputData(BaseModel):
+    flat_age_years: list[int]
+    floor_area_sqm: list[float]
+    days_from_earliest_data: list[int]
+    flat_type: list[str]
+    flat_model_revised: list[str]
+    town: list[str]
+    storey_range_grouped: list[str]
+
+    @model_validator(mode="after")
+    def check_equal_lengths(self):
+        lengths = {len(values) for values in self.model_dump().values()}
+        if len(lengths) > 1:
+            raise ValueError("All feature columns must have the same length")
+        return self
+
 # Initialize FastAPI app
 app = FastAPI()
 
 @app.get("/")
 async def root():
-    return {"msg": "Hello World"} 
+    return {"msg": "Hello World"}
+
+def record_parse_time(request):
+    # Time from the request arriving to the handler starting covers body parsing and validation
+    request_start = getattr(request.state, "request_start", None)
+    if request_start is not None:
+        observe_stages({"parse": time.perf_counter() - request_start})
+
+def serialize(content):
+    start = time.perf_counter()
+    response = JSONResponse(content)
+    observe_stages({"serialize": time.perf_counter() - start})
+    return response
 
 @app.post("/predict")
-async def predict(input_data: InputData):
-    input_df = pd.DataFrame([input_data.model_dump()])
-    
+async def predict(input_data: InputData, request: Request):
+    record_parse_time(request)
+    record = input_data.model_dump()
+    model = model_store.current
+    cached_prediction = prediction_cache.get(record, model.version)
+    if cached_prediction is not None:
+        return serialize({"Prediction": cached_prediction})
+
+    # Requests inside the precomputed grid are answered by interpolation instead of walking the trees
+    if model.price_lookup is not None:
+        prices, found = model.price_lookup.lookup_records([record])
+        PRICE_LOOKUPS.labels("hit" if found[0] else "miss").inc()
+        if found[0]:
+            return serialize({"Prediction": prices[0]})
+
     # Prediction
     try:
-        prediction = loaded_model.predict(input_df)
-        print("Prediction:", prediction)
-        
+        if micro_batcher is not None:
+            prediction = [await micro_batcher.submit(record)]
+        else:
+            # In a worker thread, a process pool blocks on its result and would hold up every other request
+            prediction = await asyncio.to_thread(predict_records, [record])
+        logger.debug("Prediction: %s", prediction)
+        prediction_cache.put(record, prediction[0], model.version)
+
+    except Exception:
+        logger.exception("Error during prediction")
+        PREDICTION_ERRORS.labels("/predict").inc()
+        raise HTTPException(status_code=500, detail="Error during prediction")
+
+    return serialize({"Prediction": prediction[0]})
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return prediction_cache.stats()
+
+@app.get("/batching/stats")
+async def batching_stats():
+    return micro_batcher.stats() if micro_batcher is not None else {"enabled": False}
+
+def build_batch_frame(input_data):
+    # Build a single frame for the whole batch, column by column to avoid a dict per row
+    if isinstance(input_data, ColumnarInputData):
+        return pd.DataFrame(input_data.model_dump())
+
+    columns = {name: [getattr(row, name) for row in input_data] for name in InputData.model_fields}
+    return pd.DataFrame(columns)
+
+def stream_batch_predictions(predictions, n_rows, elapsed):
+    # One JSON line per chunk of predictions, followed by a summary line with the batch throughput
+    for start in range(0, n_rows, PREDICT_BATCH_STREAM_CHUNK_SIZE):
+        chunk = predictions[start:start + PREDICT_BATCH_STREAM_CHUNK_SIZE]
+        yield json.dumps({"Predictions": chunk.tolist()}) + "\n"
+
+    yield json.dumps(batch_throughput(n_rows, elapsed)) + "\n"
+
+def batch_throughput(n_rows, elapsed):
+    return {
+        "n_rows": n_rows,
+        "elapsed_seconds": elapsed,
+        "rows_per_second": n_rows / elapsed if elapsed > 0 else None,
+    }
+
+@app.post("/predict/batch")
+def predict_batch(input_data: list[InputData] | ColumnarInputData, request: Request, stream: bool = False):
+    record_parse_time(request)
+
+    # Score the whole batch with one frame, split across the scoring backend's workers
+    start = time.perf_counter()
+    input_df = build_batch_frame(input_data)
+    observe_stages({"dataframe": time.perf_counter() - start})
+    try:
+        predictions = (scoring_backend.predict_frame(model_store.current, input_df) if len(input_df) > 0
+                       else np.array([]))
+    except Exception:
+        logger.exception("Error during batch prediction")
+        PREDICTION_ERRORS.labels("/predict/batch").inc()
+        raise HTTPException(status_code=500, detail="Error during prediction")
+    elapsed = time.perf_counter() - start
+    n_rows = len(input_df)
+    logger.debug("Batch prediction: %d rows in %.4fs", n_rows, elapsed)
+
+    if stream or n_rows > PREDICT_BATCH_STREAM_THRESHOLD:
+        return StreamingResponse(stream_batch_predictions(predictions, n_rows, elapsed),
+                                 media_type="application/x-ndjson")
+
+    return serialize({"Predictions": predictions.tolist(), **batch_throughput(n_rows, elapsed)})
+
+@app.get("/backend/stats")
+async def backend_stats():
+    return scoring_backend.stats()
+
+@app.get("/metrics")
+async def metrics():
+    content, content_type = render_metrics(model_store.status())
+    return Response(content=content, media_type=content_type)
+
+@app.get("/admin/model")
+async def model_status():
+    return model_store.status()
+
+@app.post("/admin/reload")
+async def reload_model(x_admin_token: str | None = Header(default=None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Model reload is disabled, set ADMIN_TOKEN to enable it")
+    if x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+    # Load in a worker thread so the live model keeps serving requests until the swap
+    try:
+        await asyncio.to_thread(model_store.reload)
     except Exception as e:
-        print("Error during prediction:", e)
-        
-    return {"Prediction": prediction[0]}
\ No newline at end of file
+        model_store.reload_errors += 1
+        raise HTTPException(status_code=500, detail=f"Error reloading model: {e}")
+
+    return model_store.status()
+
+# Added last so it wraps every route, only the paths registered above are used as metric labels
+app.add_middleware(RequestMetricsMiddleware, paths={route.path for route in app.routes})
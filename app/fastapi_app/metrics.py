@@ -0,0 +1,70 @@
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+
+# Own registry so only the prediction service metrics are exported, not the default process collectors
+REGISTRY = CollectorRegistry()
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Stages of a prediction request: parse (body parsing and validation), dataframe (frame construction),
+# transform (preprocessor, or feature encoding on the fast path), predict (regressor), serialize (JSON response)
+STAGE_SECONDS = Histogram("hdb_prediction_stage_seconds", "Time spent in each stage of a prediction request",
+                          ["stage"], buckets=LATENCY_BUCKETS, registry=REGISTRY)
+REQUEST_SECONDS = Histogram("hdb_http_request_seconds", "End to end request latency",
+                            ["path"], buckets=LATENCY_BUCKETS, registry=REGISTRY)
+REQUESTS = Counter("hdb_http_requests", "HTTP requests served", ["path", "status"], registry=REGISTRY)
+PREDICTION_ERRORS = Counter("hdb_prediction_errors", "Requests that failed during prediction", ["endpoint"],
+                            registry=REGISTRY)
+PRICE_LOOKUPS = Counter("hdb_price_lookups", "Single-row requests answered from the price grid (hit) or not (miss)",
+                        ["result"], registry=REGISTRY)
+MODEL_INFO = Gauge("hdb_model_info", "Champion model currently served", ["version", "path"], registry=REGISTRY)
+MODEL_LOAD_SECONDS = Gauge("hdb_model_load_seconds", "Time taken to load the champion model", registry=REGISTRY)
+MODEL_LOADED_TIMESTAMP = Gauge("hdb_model_loaded_timestamp_seconds", "Unix time the champion model was loaded",
+                               registry=REGISTRY)
+
+
+def observe_stages(timings):
+    """Record a {stage: seconds} dict of stage timings"""
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+def render_metrics(model_status):
+    """Prometheus text exposition of all metrics, with the model gauges refreshed from the model store"""
+    MODEL_INFO.clear()
+    MODEL_INFO.labels(model_status["version"], model_status["path"]).set(1)
+    MODEL_LOAD_SECONDS.set(model_status["load_seconds"])
+    MODEL_LOADED_TIMESTAMP.set(model_status["loaded_at"])
+
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+class RequestMetricsMiddleware:
+    """Plain ASGI middleware counting requests and timing them, cheaper than a BaseHTTPMiddleware"""
+
+    def __init__(self, app, paths):
+        self.app = app
+        self.paths = paths  # Known route paths, anything else is recorded as "other" to bound label values
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        # Handlers read the start time from request.state to time body parsing and validation
+        start = time.perf_counter()
+        scope.setdefault("state", {})["request_start"] = start
+        path = scope["path"] if scope["path"] in self.paths else "other"
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUESTS.labels(path, str(status)).inc()
+            REQUEST_SECONDS.labels(path).observe(time.perf_counter() - start)
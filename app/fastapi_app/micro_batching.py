@@ -0,0 +1,89 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+class MicroBatcher:
+    """Coalesces concurrent single-row requests into one vectorised predict call, run off the event loop"""
+
+    def __init__(self, predict_fn, max_batch_size=64, max_wait_seconds=0.002, max_in_flight=1):
+        self.predict_fn = predict_fn  # Takes a list of records, returns one prediction per record
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self.max_in_flight = max_in_flight  # Batches scored at the same time, one per scoring worker
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="micro-batcher")
+        self.batches = 0
+        self.requests = 0
+        self.largest_batch = 0
+        self._loop = None
+        self._queue = None
+        self._worker = None
+        self._slots = None
+        self._in_flight = set()
+
+    async def submit(self, record):
+        """Queue one record and wait for its own prediction"""
+        loop = asyncio.get_running_loop()
+        self._ensure_worker(loop)
+        future = loop.create_future()
+        self._queue.put_nowait((record, future))
+        return await future
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "mean_batch_size": self.requests / self.batches if self.batches else None,
+            "largest_batch": self.largest_batch,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_seconds": self.max_wait_seconds,
+            "max_in_flight": self.max_in_flight,
+        }
+
+    def _ensure_worker(self, loop):
+        # The queue and worker task belong to one event loop, start them again if the loop changed (e.g. in tests)
+        if self._loop is not loop or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+            self._worker = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            # Wait for a free slot first, so the next batch keeps filling up while earlier ones are scored
+            await self._slots.acquire()
+            batch = [await self._queue.get()]
+            deadline = self._loop.time() + self.max_wait_seconds
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - self._loop.time()
+                try:
+                    batch.append(self._queue.get_nowait() if timeout <= 0 else
+                                 await asyncio.wait_for(self._queue.get(), timeout))
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+
+            task = self._loop.create_task(self._score(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _score(self, batch):
+        try:
+            await self._score_batch(batch)
+        finally:
+            self._slots.release()
+
+    async def _score_batch(self, batch):
+        records = [record for record, _ in batch]
+        self.batches += 1
+        self.requests += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+        try:
+            predictions = await self._loop.run_in_executor(self.executor, self.predict_fn, records)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), prediction in zip(batch, predictions):
+            if not future.done():
+                future.set_result(prediction)
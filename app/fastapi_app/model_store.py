@@ -0,0 +1,149 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+import joblib
+
+from .fast_inference import CompiledPipeline
+from .price_lookup import PriceLookupTable
+
+logger = logging.getLogger(__name__)
+
+# Artifacts are hashed a chunk at a time rather than read into memory whole
+HASH_CHUNK_BYTES = 1 << 20
+
+
+@dataclass(frozen=True)
+class LoadedModel:
+    """A fully loaded champion model, never modified after it is published to the store"""
+    pipeline: object
+    fast_model: object
+    price_lookup: object
+    version: str
+    path: str
+    loaded_at: float
+    load_seconds: float
+    mmap_mode: str | None = None
+
+
+def load_model(path, mmap_mode="r", price_lookup_path=None):
+    """Load a champion model artifact, either the serving artifact (.npz) or the joblib Pipeline.
+
+    The tree arrays of an uncompressed serving artifact are memory-mapped with mmap_mode, so worker processes
+    loading it share them. A joblib Pipeline is always read into memory: sklearn trees copy their node arrays
+    on load, so memory-mapping it would not share anything. The price lookup grid built from the same model is
+    loaded alongside when a path is given.
+    """
+    start = time.perf_counter()
+    if str(path).endswith(".npz"):
+        # Serving artifact exported after training, scored without importing sklearn
+        fast_model = CompiledPipeline.load(path, mmap_mode)
+        pipeline = fast_model
+    else:
+        pipeline = joblib.load(path)
+
+        # Compile the pipeline into flat arrays for the fast path, fall back to the pipeline if unsupported
+        try:
+            fast_model = CompiledPipeline.from_pipeline(pipeline)
+        except (AttributeError, KeyError, ValueError) as e:
+            logger.warning("Fast-path inference disabled: %s", e)
+            fast_model = None
+
+    price_lookup = None
+    if price_lookup_path:
+        try:
+            price_lookup = PriceLookupTable.load(price_lookup_path)
+        except ValueError as e:
+            logger.warning("Price lookup disabled, every request is scored by the model: %s", e)
+
+    # Version the model by its content so cached predictions are dropped whenever the champion changes
+    content_hash = hashlib.sha256()
+    for artifact_path in [path, price_lookup_path]:
+        if artifact_path:
+            with open(artifact_path, "rb") as artifact_file:
+                while chunk := artifact_file.read(HASH_CHUNK_BYTES):
+                    content_hash.update(chunk)
+    version = content_hash.hexdigest()[:12]
+
+    return LoadedModel(pipeline, fast_model, price_lookup, version, path, time.time(), time.perf_counter() - start,
+                       mmap_mode)
+
+
+class ModelStore:
+    """Holds the live champion model and swaps in new ones atomically.
+
+    Requests read `current` once and use that LoadedModel throughout, so a swap never exposes a half-loaded model.
+    New artifacts must be written next to the live one and renamed into place: a memory-mapped artifact that is
+    overwritten in place changes under the live model.
+    """
+
+    def __init__(self, path, mmap_mode="r", price_lookup_path=None):
+        self.path = path
+        self.mmap_mode = mmap_mode
+        self.price_lookup_path = price_lookup_path
+        self.current = load_model(path, mmap_mode, price_lookup_path)
+        self.reloads = 0
+        self.reload_errors = 0
+        self._reload_lock = threading.Lock()
+        self._watcher = None
+
+    def reload(self):
+        """Load the artifact at `path` and swap it in, the live model keeps serving while this runs"""
+        with self._reload_lock:
+            new_model = load_model(self.path, self.mmap_mode, self.price_lookup_path)
+            if new_model.version != self.current.version:
+                self.current = new_model
+                self.reloads += 1
+                logger.info("Swapped in champion model %s (%.2fs to load)", new_model.version, new_model.load_seconds)
+            return self.current
+
+    def start_watcher(self, interval_seconds):
+        """Poll the artifact and reload once it has changed and stopped changing"""
+        if self._watcher is not None or interval_seconds <= 0:
+            return
+        self._watcher = threading.Thread(target=self._watch, args=(interval_seconds,), daemon=True,
+                                         name="model-watcher")
+        self._watcher.start()
+
+    def status(self):
+        model = self.current
+        return {
+            "version": model.version,
+            "path": model.path,
+            "loaded_at": model.loaded_at,
+            "load_seconds": model.load_seconds,
+            "fast_path": model.fast_model is not None,
+            "price_lookup": model.price_lookup is not None,
+            "reloads": self.reloads,
+            "reload_errors": self.reload_errors,
+            "watching": self._watcher is not None,
+        }
+
+    def _watch(self, interval_seconds):
+        last_seen = self._file_signature()
+        while True:
+            time.sleep(interval_seconds)
+            signature = self._file_signature()
+            if signature is None or signature == last_seen:
+                continue
+
+            # Wait for one more interval without changes so a file still being copied is not loaded
+            time.sleep(interval_seconds)
+            if self._file_signature() != signature:
+                continue
+            last_seen = signature
+            try:
+                self.reload()
+            except Exception:
+                self.reload_errors += 1
+                logger.exception("Error reloading champion model, keeping the current one")
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
@@ -0,0 +1,92 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class PredictionCache:
+    """Bounded in-process cache of predictions keyed on the canonical feature tuple of a request"""
+
+    def __init__(self, max_size=10000, ttl_seconds=None, eviction="lru"):
+        if eviction not in ("lru", "fifo"):
+            raise ValueError(f"Unknown eviction policy: {eviction}")
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.eviction = eviction
+        self.model_version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(record):
+        # Fixed field order, and numbers as floats so 44 and 44.0 share an entry
+        return tuple((name, float(value) if isinstance(value, (int, float)) else value)
+                     for name, value in sorted(record.items()))
+
+    def get(self, record, model_version):
+        """Return the cached prediction, or None on a miss"""
+        key = self.make_key(record)
+        with self._lock:
+            self._check_model_version(model_version)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            if self.eviction == "lru":
+                self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, record, value, model_version):
+        if self.max_size <= 0:
+            return
+        key = self.make_key(record)
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else None
+        with self._lock:
+            self._check_model_version(model_version)
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "eviction": self.eviction,
+                "model_version": self.model_version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+    def _check_model_version(self, model_version):
+        # Drop every entry as soon as a different champion model is seen
+        if model_version != self.model_version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self.model_version = model_version
@@ -0,0 +1,29 @@
+import numpy as np
+
+# The grid is built, validated and interpolated by modelling/common/price_grid.py, the app serves from the same code
+from modelling.common.price_grid import CATEGORICAL_AXES, NUMERIC_AXES, PRICE_GRID_MAX_ERROR, lookup_prices
+
+
+class PriceLookupTable:
+    """Champion model precomputed over a grid, served by array indexing and multilinear interpolation"""
+
+    def __init__(self, grid):
+        self.grid = grid
+
+    @classmethod
+    def load(cls, path, max_error=PRICE_GRID_MAX_ERROR):
+        """Load a price_grid.npz, refusing grids whose interpolation error against the model is above max_error"""
+        with np.load(path, allow_pickle=False) as grid:
+            grid = {key: grid[key] for key in grid.files}
+
+        validation_error = float(grid.pop("validation_error", np.inf))
+        if not validation_error <= max_error:
+            raise ValueError(f"Price grid {path} has a validation error of {validation_error:.4f}, "
+                             f"above the {max_error:.4f} allowed")
+
+        return cls(grid)
+
+    def lookup_records(self, records):
+        """Interpolated prices for raw input dicts, and a mask of rows inside the grid (the rest need the model)"""
+        columns = {name: [record[name] for record in records] for name in CATEGORICAL_AXES + NUMERIC_AXES}
+        return lookup_prices(self.grid, columns)
@@ -0,0 +1,220 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .model_store import load_model
+
+logger = logging.getLogger(__name__)
+
+# Model used by pool workers, each loads it from the champion's path when it starts
+_worker_model = None
+
+
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # Not available on macOS
+        return os.cpu_count() or 1
+
+
+def score_records(model, records, timings=None):
+    """Score raw input dicts with a CompiledPipeline, or a Pipeline if the model could not be compiled.
+
+    Time spent in each stage is added to `timings` when a dict is given.
+    """
+    timings = {} if timings is None else timings
+    if hasattr(model, "predict_records"):
+        start = time.perf_counter()
+        X = model.encode(records)
+        timings["transform"] = time.perf_counter() - start
+    else:
+        start = time.perf_counter()
+        input_df = pd.DataFrame(records)
+        timings["dataframe"] = time.perf_counter() - start
+        start = time.perf_counter()
+        X = model[:-1].transform(input_df)
+        timings["transform"] = time.perf_counter() - start
+
+    return _predict_transformed(model, X, timings)
+
+
+def score_frame(model, input_df, timings=None):
+    """Score a DataFrame of raw inputs, with the same stage timings as score_records"""
+    timings = {} if timings is None else timings
+    start = time.perf_counter()
+    if hasattr(model, "predict_records"):
+        X = model.encode(input_df.to_dict(orient="records"))
+    else:
+        X = model[:-1].transform(input_df)
+    timings["transform"] = time.perf_counter() - start
+
+    return _predict_transformed(model, X, timings)
+
+
+def _predict_transformed(model, X, timings):
+    start = time.perf_counter()
+    predictions = model.predict_matrix(X) if hasattr(model, "predict_matrix") else model[-1].predict(X)
+    timings["predict"] = time.perf_counter() - start
+
+    return predictions
+
+
+def _init_worker(path, version, mmap_mode):
+    global _worker_model
+    model = load_model(path, mmap_mode)
+    # The artifact changed after the pool was started for it, the pool fails rather than score with another model
+    if model.version != version:
+        raise RuntimeError(f"Scoring worker loaded champion model {model.version} from {path}, expected {version}")
+    _worker_model = model.fast_model or model.pipeline
+
+
+def _score_in_worker(records):
+    timings = {}
+    predictions = score_records(_worker_model, records, timings)
+    return predictions, timings
+
+
+def _score_frame_in_worker(input_df):
+    timings = {}
+    predictions = score_frame(_worker_model, input_df, timings)
+    return predictions, timings
+
+
+class InlineBackend:
+    """Scores in the calling thread, one core per container"""
+
+    name = "inline"
+
+    def __init__(self, on_stage_timings=None):
+        self.n_workers = 1
+        self.on_stage_timings = on_stage_timings  # Called with the {stage: seconds} of every scoring call
+        self._lock = threading.Lock()
+        self._started_at = time.monotonic()
+        self._submitted = 0
+        self._completed = 0
+        self._busy_seconds = 0.0
+
+    def predict(self, model, records):
+        """Score records with the LoadedModel `model`, blocking until the predictions are back"""
+        self._task_started()
+        timings = {}
+        try:
+            return score_records(model.fast_model or model.pipeline, records, timings)
+        finally:
+            self._task_finished(timings)
+
+    def predict_frame(self, model, input_df):
+        """Score a DataFrame of raw inputs with the LoadedModel `model`, blocking until the predictions are back"""
+        self._task_started()
+        timings = {}
+        try:
+            return score_frame(model.fast_model or model.pipeline, input_df, timings)
+        finally:
+            self._task_finished(timings)
+
+    def stats(self):
+        with self._lock:
+            in_flight = self._submitted - self._completed
+            elapsed = time.monotonic() - self._started_at
+            return {
+                "backend": self.name,
+                "workers": self.n_workers,
+                "in_flight": in_flight,
+                "queue_depth": max(0, in_flight - self.n_workers),
+                "busy_workers": min(in_flight, self.n_workers),
+                "utilization": self._busy_seconds / (self.n_workers * elapsed) if elapsed > 0 else 0.0,
+                "tasks_completed": self._completed,
+            }
+
+    def shutdown(self):
+        pass
+
+    def _task_started(self):
+        with self._lock:
+            self._submitted += 1
+
+    def _task_finished(self, timings):
+        with self._lock:
+            self._completed += 1
+            self._busy_seconds += sum(timings.values())
+        if self.on_stage_timings is not None:
+            self.on_stage_timings(timings)
+
+
+class ProcessPoolBackend(InlineBackend):
+    """Scores in a pool of worker processes, each loading the champion from its artifact.
+
+    Workers are started by a fork server (or spawned) rather than forked from this process, whose watcher and
+    micro-batching threads may hold locks at fork time. A memory-mapped serving artifact is shared by all of them.
+    """
+
+    name = "process"
+
+    def __init__(self, n_workers=None, on_stage_timings=None):
+        super().__init__(on_stage_timings)
+        self.n_workers = n_workers or available_cores()
+        self._pool = None
+        self._pool_version = None
+        self._pool_lock = threading.Lock()
+
+    def predict(self, model, records):
+        self._task_started()
+        timings = {}
+        try:
+            predictions, timings = self._get_pool(model).submit(_score_in_worker, records).result()
+            return predictions
+        finally:
+            self._task_finished(timings)
+
+    def predict_frame(self, model, input_df):
+        # The batch is split across the workers, each scores its chunk of rows
+        self._task_started()
+        timings = {}
+        try:
+            pool = self._get_pool(model)
+            chunks = np.array_split(np.arange(len(input_df)), min(self.n_workers, len(input_df)) or 1)
+            futures = [pool.submit(_score_frame_in_worker, input_df.iloc[chunk]) for chunk in chunks]
+            predictions = []
+            for future in futures:
+                chunk_predictions, chunk_timings = future.result()
+                predictions.append(chunk_predictions)
+                for stage, seconds in chunk_timings.items():
+                    timings[stage] = timings.get(stage, 0.0) + seconds
+            return np.concatenate(predictions)
+        finally:
+            self._task_finished(timings)
+
+    def shutdown(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+                self._pool = None
+
+    def _get_pool(self, model):
+        # Workers are started lazily with the current model, and again whenever a new champion is swapped in
+        with self._pool_lock:
+            if self._pool is None or self._pool_version != model.version:
+                old_pool = self._pool
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+                self._pool = ProcessPoolExecutor(self.n_workers, mp_context=context, initializer=_init_worker,
+                                                 initargs=(os.path.abspath(model.path), model.version,
+                                                           model.mmap_mode))
+                self._pool_version = model.version
+                if old_pool is not None:
+                    old_pool.shutdown(wait=False)  # Batches already submitted to the old pool still finish
+            return self._pool
+
+
+def make_backend(name, n_workers=None, on_stage_timings=None):
+    if name == "inline":
+        return InlineBackend(on_stage_timings)
+    if name == "process":
+        return ProcessPoolBackend(n_workers, on_stage_timings)
+    raise ValueError(f"Unknown scoring backend: {name}")
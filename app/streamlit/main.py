@@ -2,15 +2,40 @@
 import streamlit as st
 import requests
 import yaml
+import pandas as pd
 from datetime import datetime, date
+from requests.adapters import HTTPAdapter
 import os
 
+# Sweep helpers, kept apart from the page so they can be tested without streamlit. streamlit run puts this
+# directory on the path
+from sweep import SWEEP_FEATURES, build_sweep
+
+# Cached across reruns, so changing an input does not re-read the file
+@st.cache_data
+def load_config():
+    with open("./app/config.yaml", "r") as file:
+        return yaml.safe_load(file)
+
+# One pooled session per app process, so requests reuse the connection to FastAPI
+@st.cache_resource
+def get_session():
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=10))
+    return session
+
+def fastapi_base_url():
+    # This is needed because when running in docker-compose, the service name must be used
+    # But on AWS ECS, need to use localhost instead as both containers are within the same task
+    if os.getenv("RUNNING_IN_DOCKER_COMPOSE") == "True":
+        return "http://fastapi:80"
+    return "http://localhost:80"
+
 st.title("HDB Resale Price Predictor")
 
 # Load preset data values
-with open("./app/config.yaml", "r") as file:
-    config = yaml.safe_load(file)
-    
+config = load_config()
+
 # Define days from earliest data point (1st March 2012) at the point of running the app
 days_from_earliest_data = (datetime.now().date() - date(2012, 3, 1)).days
 
@@ -22,25 +47,19 @@ storey_range_grouped = st.selectbox("Storey Range", config["data_storey_range"])
 flat_model_revised = st.selectbox("Flat Model (Revised)", config["data_flat_models"])
 town = st.selectbox("Town", config["data_towns"])
 
-if st.button("Submit"):
-    # This is needed because when running in docker-compose, the service name must be used
-    # But on AWS ECS, need to use localhost instead as both containers are within the same task
-    if os.getenv("RUNNING_IN_DOCKER_COMPOSE") == "True":
-        fastapi_url = "http://fastapi:80/predict" 
-    else:
-        fastapi_url = "http://localhost:80/predict"
-    payload = {
-        "flat_age_years": flat_age_years,
-        "floor_area_sqm": floor_area_sqm,
-        "days_from_earliest_data": days_from_earliest_data,
-        "flat_type": flat_type,
-        "flat_model_revised": flat_model_revised,
-        "town": town,
-        "storey_range_grouped": storey_range_grouped
-    }
+payload = {
+    "flat_age_years": flat_age_years,
+    "floor_area_sqm": floor_area_sqm,
+    "days_from_earliest_data": days_from_earliest_data,
+    "flat_type": flat_type,
+    "flat_model_revised": flat_model_revised,
+    "town": town,
+    "storey_range_grouped": storey_range_grouped
+}
 
+if st.button("Submit"):
     try:
-        response = requests.post(fastapi_url, json=payload)
+        response = get_session().post(f"{fastapi_base_url()}/predict", json=payload, timeout=10)
         
         if response.status_code == 200:
             st.error(f"FastAPI response: {response.json()}")
@@ -50,4 +69,32 @@ if st.button("Submit"):
     
     except requests.exceptions.ConnectionError:
         st.error("Could not connect to FastAPI backend. Ensure it is running.")
-        
+
+# Sensitivity sweep: how the price changes around the input, scored in a single batch request
+st.header("Sensitivity Sweep")
+sweep_features = st.multiselect("Features to vary", list(SWEEP_FEATURES),
+                                default=list(SWEEP_FEATURES), format_func=lambda name: SWEEP_FEATURES[name][0])
+n_points = st.slider("Points per curve", min_value=5, max_value=50, value=21)
+
+if st.button("Run Sweep") and sweep_features:
+    columns, curves = build_sweep(payload, sweep_features, n_points)
+
+    try:
+        response = get_session().post(f"{fastapi_base_url()}/predict/batch", json=columns, timeout=30)
+
+        if response.status_code == 200:
+            predictions = response.json()["Predictions"]
+            st.caption(f"{len(predictions)} predictions in one request")
+            start = 0
+            for feature, values in curves:
+                label = SWEEP_FEATURES[feature][0]
+                st.subheader(f"Predicted price by {label}")
+                st.line_chart(pd.DataFrame({"Predicted Price": predictions[start:start + len(values)]},
+                                           index=pd.Index(values, name=label)))
+                start += len(values)
+
+        else:
+            st.error(f"Error from FastAPI: {response.status_code} - {response.text}")
+
+    except requests.exceptions.ConnectionError:
+        st.error("Could not connect to FastAPI backend. Ensure it is running.")
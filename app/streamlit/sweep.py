@@ -0,0 +1,26 @@
+import numpy as np
+
+# Features that can be swept: (label, half width of the sweep around the input, lowest sensible value)
+SWEEP_FEATURES = {
+    "floor_area_sqm": ("Floor Area (sqm)", 30.0, 20.0),
+    "flat_age_years": ("Flat Age (Years)", 20, 0),
+}
+
+def sweep_values(feature, value, n_points):
+    _, half_width, lowest = SWEEP_FEATURES[feature]
+    start = max(lowest, value - half_width)
+    values = np.linspace(start, start + 2 * half_width, n_points)
+    if feature == "flat_age_years":
+        return np.unique(values.round().astype(int))
+    return values.round(1)
+
+def build_sweep(payload, features, n_points):
+    # Every variation of every swept feature in one columnar batch, the other features held at the input
+    columns = {name: [] for name in payload}
+    curves = []
+    for feature in features:
+        values = sweep_values(feature, payload[feature], n_points)
+        curves.append((feature, values))
+        for name in payload:
+            columns[name].extend(values.tolist() if name == feature else [payload[name]] * len(values))
+    return columns, curves
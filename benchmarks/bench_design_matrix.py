@@ -0,0 +1,59 @@
+# Encoding and fitting time of the training pipeline on processed rows against the cached design matrix: building the
+# store, updating it with a new month, and fitting the champion's forest on the stored rows
+# Usage (from the repo root): python -m benchmarks.bench_design_matrix --months 60 --month-rows 1000 --trees 10
+import argparse
+import tempfile
+import time
+
+from sklearn.base import clone
+
+from benchmarks.bench_incremental_retrain import synthetic_history
+from modelling.common.design_matrix import DesignMatrixStore
+from modelling.common.storage import LocalStorage
+from modelling.hyperparam_search.hyperparam_search import PARAM_DICT, define_pipeline
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--months", type=int, default=60)
+    parser.add_argument("--month-rows", type=int, default=1000)
+    parser.add_argument("--trees", type=int, default=10)
+    args = parser.parse_args()
+
+    df = synthetic_history(args.months + 1, args.month_rows)
+    # The history the store is built on, and the same with a new month
+    history, updated = df[df["days_from_earliest_data"] < args.months * 31], df
+    pipeline = define_pipeline(df)
+    pipeline.set_params(**{**{name: values[0] for name, values in PARAM_DICT.items()}, "reg__n_estimators": args.trees})
+    X, y = history.drop(columns=["resale_price"]), history["resale_price"]
+
+    encode_seconds, _ = timed(lambda: clone(pipeline.named_steps["preprocessor"]).fit_transform(X))
+    pipeline_seconds, _ = timed(lambda: clone(pipeline).fit(X, y))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = DesignMatrixStore(LocalStorage(tmp_dir))
+        build_seconds, _ = timed(lambda: store.update(history, pipeline.named_steps["preprocessor"]))
+        update_seconds, design = timed(lambda: store.update(updated, pipeline.named_steps["preprocessor"]))
+    regressor = pipeline.named_steps["reg"]
+    sparse_seconds, _ = timed(lambda: clone(regressor).fit(design.training_matrix(dense=False), design.y))
+    dense_seconds, _ = timed(lambda: clone(regressor).fit(design.training_matrix(dense=True), design.y))
+
+    print(f"{'step':<50}{'rows':>10}{'seconds':>10}")
+    for step, rows, seconds in [("encoding all history (ColumnTransformer)", len(history), encode_seconds),
+                                (f"pipeline fit, {args.trees} trees (encode + sparse fit)", len(history),
+                                 pipeline_seconds),
+                                ("building the design matrix store", len(history), build_seconds),
+                                ("updating the store with a new month", len(updated), update_seconds),
+                                ("fit on the stored rows, sparse", len(updated), sparse_seconds),
+                                ("fit on the stored rows, dense float32", len(updated), dense_seconds)]:
+        print(f"{step:<50}{rows:>10}{seconds:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
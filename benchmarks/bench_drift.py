@@ -0,0 +1,65 @@
+# Time of the drift check: profiling the training data (only when there is no saved profile), loading the saved
+# profile, folding a new month into it, and comparing a new month against it
+# Usage (from the repo root): python -m benchmarks.bench_drift --rows 1000000 --month-rows 2500
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from modelling.common.drift import build_reference, drift_report, fold_into_reference, save_reference
+
+
+def synthetic_processed(n_rows, seed):
+    # Dtypes as read back from the processed Parquet files
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({"town": pd.Categorical(rng.choice([f"Town {i}" for i in range(26)], n_rows)),
+                         "flat_type": pd.Categorical(rng.choice([f"{i} Room" for i in range(1, 6)], n_rows)),
+                         "flat_model_revised": pd.Categorical(rng.choice([f"Model {i}" for i in range(20)], n_rows)),
+                         "storey_range_grouped": pd.Categorical(rng.choice(["1-15", "16-30", "31+"], n_rows)),
+                         "flat_age_years": rng.integers(0, 55, n_rows).astype(np.int16),
+                         "floor_area_sqm": rng.normal(95, 25, n_rows).astype(np.float32),
+                         "days_from_earliest_data": np.full(n_rows, 4000 + seed * 31, dtype=np.int32)})
+
+
+def best_of(fn, repeats=5):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--month-rows", type=int, default=2500)
+    args = parser.parse_args()
+
+    train_df, month_df = synthetic_processed(args.rows, 0), synthetic_processed(args.month_rows, 1)
+    reference_seconds, reference = best_of(lambda: build_reference(train_df))
+    report_seconds, report = best_of(lambda: drift_report(reference, month_df))
+    fold_seconds, _ = best_of(lambda: fold_into_reference(reference, month_df))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "reference_profile.json")
+        save_reference(reference, path)
+        profile_kb = os.path.getsize(path) / 1024
+        with open(path, "rb") as file:
+            profile_bytes = file.read()
+        load_seconds, _ = best_of(lambda: json.loads(profile_bytes))
+
+    print(f"{'step':<40}{'rows':>10}{'ms':>10}")
+    print(f"{'reference profile of the training data':<40}{args.rows:>10}{reference_seconds * 1000:>10.1f}")
+    print(f"{f'loading the saved profile ({profile_kb:.1f} KB)':<40}{'':>10}{load_seconds * 1000:>10.2f}")
+    print(f"{'folding a month into the profile':<40}{args.month_rows:>10}{fold_seconds * 1000:>10.1f}")
+    print(f"{'drift report of a month':<40}{args.month_rows:>10}{report_seconds * 1000:>10.1f}")
+    print("Drifted features:", report["drifted"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# Time to score the champion and challengers on retrain_test: one predict per pipeline as the retraining Lambda did,
+# against the evaluation module scoring them together, first with an empty prediction cache and then on a rerun
+# Usage (from the repo root): python -m benchmarks.bench_evaluation --train-rows 20000 --test-rows 2000
+import argparse
+import tempfile
+import time
+
+import numpy as np
+from sklearn.base import clone
+from sklearn.metrics import root_mean_squared_error
+
+from benchmarks.bench_incremental_retrain import synthetic_history
+from modelling.common.evaluation import EvaluationCache, evaluate, model_hash
+from modelling.common.incremental_forest import grow_forest
+from modelling.common.storage import LocalStorage
+from modelling.hyperparam_search.hyperparam_search import PARAM_DICT, define_pipeline
+
+
+def fitted_pipeline(df, seed):
+    # The champion's pipeline and hyperparameters, its forest fit on the encoded rows to save time
+    pipeline = define_pipeline(df)
+    pipeline.set_params(**{**{name: values[0] for name, values in PARAM_DICT.items()}, "reg__random_state": seed})
+    X = pipeline.named_steps["preprocessor"].fit_transform(df.drop(columns=["resale_price"]))
+    pipeline.set_params(reg=clone(pipeline.named_steps["reg"]).fit(X.toarray(), df["resale_price"]))
+
+    return pipeline
+
+
+def best_of(fn, repeats=3):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--train-rows", type=int, default=20000)
+    parser.add_argument("--test-rows", type=int, default=2000)
+    args = parser.parse_args()
+
+    df = synthetic_history(args.train_rows // 1000 + 1, 1000)
+    train, retrain_test = df.iloc[:args.train_rows], df.iloc[-args.test_rows:]
+    champion = fitted_pipeline(train, seed=0)
+    models = {"champion": champion,
+              "grown": grow_forest(champion, train.tail(len(train) // 4)),
+              "refit": fitted_pipeline(train, seed=1)}
+    model_keys = {"champion": model_hash(b"champion_model.joblib")}
+
+    def predict_each(names):
+        # As the Lambda did: a frame without the target and a full pipeline predict per model
+        return {name: root_mean_squared_error(retrain_test["resale_price"],
+                                              models[name].predict(retrain_test.drop(columns=["resale_price"])))
+                for name in names}
+
+    print(f"{'scoring':<50}{'models':>8}{'ms':>10}")
+    for names in (["champion", "grown"], list(models)):
+        seconds, expected = best_of(lambda: predict_each(names))
+        print(f"{'one predict per pipeline':<50}{len(names):>8}{seconds * 1000:>10.1f}")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = EvaluationCache(LocalStorage(tmp_dir))
+            candidates = {name: models[name] for name in names}
+            cold_seconds, (report, _) = best_of(lambda: evaluate(candidates, retrain_test), repeats=1)
+            evaluate(candidates, retrain_test, cache=cache, model_keys=model_keys)
+            warm_seconds, _ = best_of(lambda: evaluate(candidates, retrain_test, cache=cache, model_keys=model_keys))
+        assert all(np.isclose(report[name]["rmse"], rmse) for name, rmse in expected.items())
+        print(f"{'evaluate, champion not cached (+ segment report)':<50}{len(names):>8}{cold_seconds * 1000:>10.1f}")
+        print(f"{'evaluate, champion cached (+ segment report)':<50}{len(names):>8}{warm_seconds * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# Wall time and retrain_test RMSE of the retraining Lambda's challenger: a full refit on all history against replacing
+# the champion's oldest trees with trees fit on the latest months, over several simulated monthly retrains. A
+# challenger is promoted as in the Lambda, when it beats the champion's RMSE by 5%
+# Usage (from the repo root): python -m benchmarks.bench_incremental_retrain --months 60 --month-rows 1000
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics import root_mean_squared_error
+
+from modelling.common.incremental_forest import retrain
+from modelling.hyperparam_search.hyperparam_search import PARAM_DICT, define_pipeline
+
+TOWNS = [f"Town {i}" for i in range(26)]
+FLAT_TYPES = [f"{i} Room" for i in range(1, 6)]
+FLAT_MODELS = [f"Model {i}" for i in range(20)]
+STOREYS = ["1-15", "16-30", "31+"]
+
+
+def synthetic_history(n_months, month_rows, seed=0):
+    # Processed rows whose prices follow the features, plus a market trend that changes slope over time and
+    # differs by town, so the latest months matter
+    rng = np.random.default_rng(seed)
+    n_rows = n_months * month_rows
+    month = np.repeat(np.arange(n_months), month_rows)
+    town = rng.integers(0, len(TOWNS), n_rows)
+    flat_type = rng.integers(0, len(FLAT_TYPES), n_rows)
+    storey = rng.integers(0, len(STOREYS), n_rows)
+    age = rng.integers(0, 55, n_rows)
+    area = rng.normal(60 + flat_type * 15, 10).clip(30, 200).round(1)
+    trend = np.cumsum(rng.normal(0.003, 0.01, n_months))[month] * (1 + town / len(TOWNS))
+    price = area * 4500 * (1 + 0.1 * storey) * (1 - 0.006 * age) * np.exp(trend) + rng.normal(0, 20000, n_rows)
+
+    return pd.DataFrame({"town": np.array(TOWNS)[town], "flat_type": np.array(FLAT_TYPES)[flat_type],
+                         "flat_model_revised": rng.choice(FLAT_MODELS, n_rows), "flat_age_years": age,
+                         "floor_area_sqm": area, "days_from_earliest_data": month * 31,
+                         "storey_range_grouped": np.array(STOREYS)[storey], "resale_price": price})
+
+
+def champion_pipeline(df):
+    # The champion's pipeline and hyperparameters from the search
+    pipeline = define_pipeline(df)
+    pipeline.set_params(**{name: values[0] for name, values in PARAM_DICT.items()})
+
+    return pipeline.fit(df.drop(columns=["resale_price"]), df["resale_price"])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--months", type=int, default=60)
+    parser.add_argument("--month-rows", type=int, default=1000)
+    parser.add_argument("--retrains", type=int, default=4)
+    # Months the champion has gone without being replaced before the first retrain
+    parser.add_argument("--champion-age", type=int, default=6)
+    args = parser.parse_args()
+
+    df = synthetic_history(args.months, args.month_rows)
+    months = df["days_from_earliest_data"] // 31
+    # As in the Lambda: train + test is everything before the retrain_test month
+    first_retrain = args.months - args.retrains
+    champion = champion_pipeline(df[months < first_retrain - args.champion_age])
+    champions = {"full": champion, "incremental": champion}
+
+    print(f"{'retrain':<10}{'mode':<14}{'rows':>10}{'trees':>8}{'seconds':>10}{'champion RMSE':>15}{'RMSE':>10}"
+          f"{'promoted':>10}")
+    for retrain_month in range(first_retrain, args.months):
+        combined, retrain_test = df[months < retrain_month], df[months == retrain_month]
+        X, y = retrain_test.drop(columns=["resale_price"]), retrain_test["resale_price"]
+        for mode, model in champions.items():
+            start = time.perf_counter()
+            challenger = retrain(model, combined, mode=mode)
+            seconds = time.perf_counter() - start
+            champion_rmse = root_mean_squared_error(y, model.predict(X))
+            rmse = root_mean_squared_error(y, challenger.predict(X))
+            promoted = rmse < champion_rmse * 0.95
+            print(f"{retrain_month:<10}{mode:<14}{len(combined):>10}"
+                  f"{len(challenger.named_steps['reg'].estimators_):>8}{seconds:>10.1f}{champion_rmse:>15.0f}"
+                  f"{rmse:>10.0f}{str(promoted):>10}")
+            if promoted:
+                champions[mode] = challenger
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# Size, load time and prediction drift of the saved champion before and after compaction (float32 trees, no node
+# statistics, optional pruning, compressed), and of its serving artifact with float32 leaves, compressed or not
+# Usage (from the repo root): python -m benchmarks.bench_model_compaction --prune-tolerance 0.002
+import argparse
+import os
+import tempfile
+import time
+
+import joblib
+import numpy as np
+
+from benchmarks.bench_incremental_retrain import synthetic_history
+from modelling.common.model_compaction import compact_pipeline, compaction_report, load_seconds, save_model
+from modelling.common.serving_artifact import export_serving_artifact
+
+
+def npz_load_seconds(path, repeats=3):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        with np.load(path) as artifact:
+            {name: artifact[name] for name in artifact.files}
+        timings.append(time.perf_counter() - start)
+
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model-path", default="app/fastapi_app/champion_model/champion_model.joblib")
+    parser.add_argument("--prune-tolerance", type=float, default=0)
+    parser.add_argument("--rows", type=int, default=5000)
+    args = parser.parse_args()
+
+    champion = joblib.load(args.model_path)
+    # Rows to compare predictions on; their prices are synthetic, so only the drift is meaningful
+    df = synthetic_history(args.rows // 1000 + 1, 1000).tail(args.rows)
+    compacted = compact_pipeline(champion, df, prune_tolerance=args.prune_tolerance)
+
+    print(f"{'artifact':<45}{'MB':>10}{'load ms':>10}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for compress in (0, ("zlib", 3), ("lzma", 3)):
+            path = save_model(compacted, os.path.join(tmp_dir, f"champion_model_{compress}.joblib"), compress=compress)
+            name = f"joblib, compacted, compress={compress}"
+            print(f"{name:<45}{os.path.getsize(path) / 1e6:>10.2f}{load_seconds(path) * 1000:>10.1f}")
+            report = compaction_report(champion, compacted, df, path)
+        print(f"{'joblib, original':<45}{report['original']['bytes'] / 1e6:>10.2f}"
+              f"{report['original']['load_seconds'] * 1000:>10.1f}")
+        for model, leaf_dtype, compress in [(champion, np.float64, False), (compacted, np.float32, False),
+                                            (compacted, np.float32, True)]:
+            path = export_serving_artifact(model, os.path.join(tmp_dir, f"champion_model_{compress}.npz"),
+                                           leaf_dtype=leaf_dtype, compress=compress)
+            name = f"npz, {np.dtype(leaf_dtype).name} leaves, compress={compress}"
+            print(f"{name:<45}{os.path.getsize(path) / 1e6:>10.2f}{npz_load_seconds(path) * 1000:>10.1f}")
+
+    print(f"trees: {report['original']['trees']} -> {report['compacted']['trees']}")
+    print(f"prediction drift on {report['prediction_drift']['rows']} rows: "
+          f"max abs {report['prediction_drift']['max_abs']:.4g}, "
+          f"max relative {report['prediction_drift']['max_relative']:.3g}, rms {report['prediction_drift']['rms']:.4g}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# Size, write and read time of the processed datasets as CSV and as typed Parquet
+# Usage (from the repo root): python -m benchmarks.bench_processed_formats --rows 300000
+import argparse
+import io
+import statistics
+import time
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from modelling.common.processed_data import processed_to_parquet, read_processed_parquet
+from modelling.data_validation.data_validation import VALIDATION_COLUMNS
+
+
+def synthetic_train_df(n_rows, seed=0):
+    # Same columns and value ranges as train.csv
+    with open("./config.yaml", "r") as file:
+        config = yaml.safe_load(file)
+    rng = np.random.default_rng(seed)
+
+    return pd.DataFrame({"town": rng.choice(config["data_towns"], n_rows),
+                         "flat_type": rng.choice(config["data_flat_types"], n_rows),
+                         "flat_model_revised": rng.choice(config["data_flat_models"], n_rows),
+                         "flat_age_years": rng.integers(0, 60, n_rows),
+                         "floor_area_sqm": rng.uniform(30, 200, n_rows).round(1),
+                         "days_from_earliest_data": rng.integers(0, 5000, n_rows),
+                         "storey_range_grouped": rng.choice(config["data_storey_range"], n_rows),
+                         "resale_price": rng.integers(150, 1500, n_rows) * 1000.0})
+
+
+def median_seconds(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+
+    return statistics.median(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=300000)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    df = synthetic_train_df(args.rows)
+    formats = {
+        "csv": (lambda: df.to_csv(index=False).encode(),
+                lambda data: pd.read_csv(io.BytesIO(data)),
+                lambda data: pd.read_csv(io.BytesIO(data), usecols=VALIDATION_COLUMNS)),
+        "parquet": (lambda: processed_to_parquet(df),
+                    lambda data: read_processed_parquet(data),
+                    lambda data: read_processed_parquet(data, VALIDATION_COLUMNS)),
+    }
+
+    print(f"{args.rows} rows")
+    print(f"{'format':<10}{'size (MB)':>12}{'write (s)':>12}{'read (s)':>12}{'read validation columns (s)':>30}"
+          f"{'in memory (MB)':>16}")
+    for name, (write, read, read_columns) in formats.items():
+        write_seconds, data = median_seconds(write, args.repeats)
+        read_seconds, read_df = median_seconds(lambda: read(data), args.repeats)
+        read_columns_seconds, _ = median_seconds(lambda: read_columns(data), args.repeats)
+        memory = read_df.memory_usage(deep=True).sum()
+        print(f"{name:<10}{len(data) / 1e6:>12.2f}{write_seconds:>12.3f}{read_seconds:>12.3f}"
+              f"{read_columns_seconds:>30.3f}{memory / 1e6:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# Wall time and peak memory of the processing engines on the same raw files: pandas reading whole files,
+# pandas streaming chunks of rows, and polars
+# Usage (from the repo root): python -m benchmarks.bench_processing_engines --raw-dir <directory of raw HDB CSVs>
+# Without --raw-dir, synthetic raw files of --rows rows are generated
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from benchmarks.local_s3 import LocalBucket
+from modelling.data_processing.data_processing import process_full
+
+
+def write_synthetic_raw(directory, n_rows, seed=0):
+    # Raw-like files split like the real bucket, older history in one file and recent months in another
+    with open("./config.yaml", "r") as file:
+        config = yaml.safe_load(file)
+    rng = np.random.default_rng(seed)
+    months = pd.date_range("2012-03-01", "2025-06-01", freq="MS").strftime("%Y-%m")
+    lease = rng.integers(1966, 2020, n_rows)
+    storey_low = rng.integers(0, 16, n_rows) * 3 + 1
+    df = pd.DataFrame({"month": np.sort(rng.choice(months, n_rows)),
+                       "town": rng.choice([town.upper() for town in config["data_towns"]], n_rows),
+                       "flat_type": rng.choice([flat_type.upper() for flat_type in config["data_flat_types"]], n_rows),
+                       "block": rng.integers(1, 999, n_rows).astype(str),
+                       "street_name": "ANG MO KIO AVE 3",
+                       "storey_range": [f"{low:02d} TO {low + 2:02d}" for low in storey_low],
+                       "flat_model": rng.choice(config["data_flat_models"] + ["Model A-Maisonette"], n_rows),
+                       "lease_commence_date": lease.astype(str),
+                       "floor_area_sqm": rng.uniform(30, 200, n_rows).round(0).astype(str),
+                       "remaining_lease": [f"{99 - (2025 - year)} years" for year in lease],
+                       "resale_price": (rng.integers(150, 1500, n_rows) * 1000).astype(str)})
+    split = df["month"] < "2017-01"
+    df[split].to_csv(os.path.join(directory, "2012to2016.csv"), index=False)
+    df[~split].to_csv(os.path.join(directory, "FromJan2017onwards.csv"), index=False)
+
+
+def peak_rss_mb():
+    # VmHWM starts afresh in every new process, unlike ru_maxrss which Linux carries over from the parent
+    try:
+        with open("/proc/self/status") as status:
+            return next(int(line.split()[1]) for line in status if line.startswith("VmHWM")) / 1024
+    except FileNotFoundError:  # macOS, where ru_maxrss is in bytes
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 ** 2
+
+
+def run_engine(engine, raw_dir, chunk_rows):
+    # Runs in its own interpreter, so peak RSS is this engine's alone
+    start_peak = peak_rss_mb()
+    start = time.perf_counter()
+    train, test, retrain_test = process_full(LocalBucket(raw_dir), engine, chunk_rows)
+    elapsed = time.perf_counter() - start
+    print("RESULT", elapsed, start_peak, peak_rss_mb(), len(train) + len(test) + len(retrain_test))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--raw-dir")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--chunk-rows", type=int, default=100000)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        return run_engine(args.worker, args.raw_dir, args.chunk_rows)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        raw_dir = args.raw_dir
+        if raw_dir is None:
+            raw_dir = tmp_dir
+            write_synthetic_raw(raw_dir, args.rows)
+        raw_mb = sum(os.path.getsize(os.path.join(raw_dir, name)) for name in os.listdir(raw_dir)) / 1e6
+
+        print(f"Raw files: {raw_mb:.1f} MB")
+        print(f"{'engine':<20}{'rows':>10}{'wall (s)':>12}{'peak RSS (MB)':>16}{'peak above imports (MB)':>26}")
+        for name, engine, chunk_rows in [("pandas whole files", "pandas", 0),
+                                         (f"pandas {args.chunk_rows} rows", "pandas", args.chunk_rows),
+                                         ("polars", "polars", 0)]:
+            output = subprocess.run([sys.executable, "-m", "benchmarks.bench_processing_engines", "--worker", engine,
+                                     "--raw-dir", raw_dir, "--chunk-rows", str(chunk_rows)],
+                                    capture_output=True, text=True, check=True).stdout
+            elapsed, start_peak, peak, rows = map(float, output.split("RESULT")[-1].split())
+            print(f"{name:<20}{int(rows):>10}{elapsed:>12.2f}{peak:>16.0f}{peak - start_peak:>26.0f}")
+
+
+if __name__ == "__main__":
+    main()
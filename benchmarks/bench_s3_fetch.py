@@ -0,0 +1,70 @@
+# Sequential against concurrent S3 fetching, on a local filesystem stand-in for S3 with simulated request latency
+# and per-connection bandwidth
+# Usage (from the repo root): python -m benchmarks.bench_s3_fetch --latency-ms 50 --bandwidth-mb-s 50
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.bench_processing_engines import write_synthetic_raw
+from benchmarks.local_s3 import LocalBucket
+from modelling.common import s3_fetch
+from modelling.common.processed_data import processed_to_parquet, read_processed
+from modelling.data_processing.data_processing import load_concat_df, load_partitions, partition_key, \
+    process_raw_df, split_dataset
+
+
+def prepare(directory, n_rows):
+    # Raw files, one processed partition per month, and train/test, as in the real buckets
+    raw_dir, processed_dir = os.path.join(directory, "raw"), os.path.join(directory, "processed")
+    os.makedirs(raw_dir)
+    write_synthetic_raw(raw_dir, n_rows)
+
+    processed_bucket = LocalBucket(processed_dir)
+    df_all = process_raw_df(load_concat_df(LocalBucket(raw_dir)))
+    months = {}
+    for month, rows in df_all.groupby(df_all['month'].dt.strftime('%Y-%m')):
+        processed_bucket.put_object(Key=partition_key(month), Body=processed_to_parquet(rows[
+            ['month', 'town', 'flat_type', 'flat_model_revised', 'flat_age_years', 'floor_area_sqm',
+             'days_from_earliest_data', 'storey_range_grouped', 'resale_price']]))
+        months[month] = {}
+    train, test, _ = split_dataset(df_all)
+    processed_bucket.put_object(Key="train.parquet", Body=processed_to_parquet(train))
+    processed_bucket.put_object(Key="test.parquet", Body=processed_to_parquet(test))
+
+    return raw_dir, processed_dir, {"months": months}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=400000)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--bandwidth-mb-s", type=float, default=50)
+    parser.add_argument("--concurrency", type=int, default=s3_fetch.FETCH_CONCURRENCY)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        raw_dir, processed_dir, manifest = prepare(tmp_dir, args.rows)
+        simulated = {"latency_seconds": args.latency_ms / 1000, "bandwidth_bytes_per_second": args.bandwidth_mb_s * 1e6}
+        raw_bucket, processed_bucket = LocalBucket(raw_dir, **simulated), LocalBucket(processed_dir, **simulated)
+        scenarios = [
+            (f"raw files ({len(raw_bucket.all())})", lambda: load_concat_df(raw_bucket)),
+            (f"month partitions ({len(manifest['months'])})", lambda: load_partitions(processed_bucket, manifest)),
+            ("train and test (2)",
+             lambda: s3_fetch.map_concurrently(lambda name: read_processed(processed_bucket, name), ["train", "test"])),
+        ]
+
+        print(f"{args.latency_ms:.0f} ms per request, {args.bandwidth_mb_s:.0f} MB/s per connection")
+        print(f"{'objects':<26}{'sequential (s)':>16}{f'concurrency {args.concurrency} (s)':>20}{'speedup':>10}")
+        for name, load in scenarios:
+            timings = []
+            for concurrency in [1, args.concurrency]:
+                s3_fetch.FETCH_CONCURRENCY = concurrency
+                start = time.perf_counter()
+                load()
+                timings.append(time.perf_counter() - start)
+            print(f"{name:<26}{timings[0]:>16.2f}{timings[1]:>20.2f}{timings[0] / timings[1]:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
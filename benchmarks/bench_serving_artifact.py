@@ -0,0 +1,63 @@
+# Cold-start benchmark of the joblib Pipeline against the .npz serving artifact
+# Usage (from the repo root): python -m benchmarks.bench_serving_artifact --model-path <champion_model.joblib>
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+import joblib
+
+from modelling.common.serving_artifact import export_serving_artifact
+
+SAMPLE_ROW = {"town": "Ang Mo Kio", "flat_type": "2 Room", "flat_model_revised": "Improved", "flat_age_years": 46,
+              "floor_area_sqm": 44.0, "days_from_earliest_data": 4323, "storey_range_grouped": "1-15"}
+
+# Each snippet runs in a fresh interpreter so import time is included, like a container or Lambda cold start
+JOBLIB_SNIPPET = """
+import time; start = time.perf_counter()
+import sys, joblib, pandas as pd
+model = joblib.load(sys.argv[1])
+model.predict(pd.DataFrame([{row}]))
+print(time.perf_counter() - start, 'sklearn' in sys.modules)
+"""
+
+ARTIFACT_SNIPPET = """
+import time; start = time.perf_counter()
+import sys
+from app.fastapi_app.fast_inference import CompiledPipeline
+model = CompiledPipeline.load(sys.argv[1])
+model.predict_one({row})
+print(time.perf_counter() - start, 'sklearn' in sys.modules)
+"""
+
+
+def time_cold_start(snippet, path, repeats):
+    timings = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", snippet.format(row=SAMPLE_ROW), path],
+                                capture_output=True, text=True, check=True).stdout.split()
+        timings.append(float(output[0]))
+
+    return statistics.median(timings), output[1] == "True"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model-path", default="./app/fastapi_app/champion_model/champion_model.joblib")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        artifact_path = export_serving_artifact(joblib.load(args.model_path), os.path.join(tmp_dir, "champion_model.npz"))
+
+        print(f"{'format':<10}{'size (MB)':>12}{'cold start (s)':>16}{'imports sklearn':>18}")
+        for name, snippet, path in [("joblib", JOBLIB_SNIPPET, args.model_path),
+                                    ("npz", ARTIFACT_SNIPPET, artifact_path)]:
+            seconds, imports_sklearn = time_cold_start(snippet, path, args.repeats)
+            print(f"{name:<10}{os.path.getsize(path) / 1e6:>12.2f}{seconds:>16.3f}{str(imports_sklearn):>18}")
+
+
+if __name__ == "__main__":
+    main()
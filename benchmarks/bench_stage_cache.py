@@ -0,0 +1,52 @@
+# Full mode wall time without the stage cache, on a first run that fills it, and on a rerun with unchanged raw files
+# Usage (from the repo root): python -m benchmarks.bench_stage_cache --raw-dir <directory of raw HDB CSVs>
+# Without --raw-dir, synthetic raw files of --rows rows are generated
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from benchmarks.bench_processing_engines import write_synthetic_raw
+from benchmarks.local_s3 import LocalBucket
+from modelling.data_processing.data_processing import process_full
+from modelling.data_processing.stage_cache import StageCache
+
+
+def timed_run(raw_dir, engine, chunk_rows, cache):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        process_full(LocalBucket(raw_dir), engine, chunk_rows, cache)
+
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--raw-dir")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--chunk-rows", type=int, default=100000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        raw_dir = args.raw_dir
+        if raw_dir is None:
+            raw_dir = os.path.join(tmp_dir, "raw")
+            os.makedirs(raw_dir)
+            write_synthetic_raw(raw_dir, args.rows)
+
+        print(f"{'engine':<20}{'no cache (s)':>14}{'filling (s)':>14}{'rerun (s)':>12}{'cache (MB)':>12}")
+        for name, engine, chunk_rows in [("pandas whole files", "pandas", 0),
+                                         (f"pandas {args.chunk_rows} rows", "pandas", args.chunk_rows),
+                                         ("polars", "polars", 0)]:
+            cache_dir = os.path.join(tmp_dir, f"cache-{engine}-{chunk_rows}")
+            os.makedirs(cache_dir)
+            cache = StageCache(LocalBucket(cache_dir))
+            timings = [timed_run(raw_dir, engine, chunk_rows, run_cache) for run_cache in [None, cache, cache]]
+            cache_mb = sum(obj.size for obj in cache.bucket.objects.all()) / 1e6
+            print(f"{name:<20}{timings[0]:>14.2f}{timings[1]:>14.2f}{timings[2]:>12.2f}{cache_mb:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# Filesystem stand-in for the parts of a boto3 S3 Bucket resource the pipeline uses, with optional simulated
+# request latency and per-connection bandwidth so S3-bound code can be benchmarked offline
+import hashlib
+import io
+import os
+import time
+from datetime import datetime, timezone
+
+
+class NoSuchKey(Exception):
+    pass
+
+
+class LocalObject:
+    def __init__(self, bucket, key):
+        self.bucket = bucket
+        self.key = key
+
+    @property
+    def size(self):
+        return os.path.getsize(self.bucket.path(self.key))
+
+    @property
+    def last_modified(self):
+        return datetime.fromtimestamp(os.path.getmtime(self.bucket.path(self.key)), timezone.utc)
+
+    @property
+    def e_tag(self):
+        with open(self.bucket.path(self.key), "rb") as file:
+            return '"' + hashlib.md5(file.read()).hexdigest() + '"'
+
+    def get(self):
+        return self.bucket.meta.client.get_object(Bucket=self.bucket.name, Key=self.key)
+
+    def delete(self):
+        if os.path.exists(self.bucket.path(self.key)):
+            os.remove(self.bucket.path(self.key))
+
+
+class LocalClient:
+    exceptions = type("exceptions", (), {"NoSuchKey": NoSuchKey})
+
+    def __init__(self, bucket, latency_seconds, bandwidth_bytes_per_second):
+        self.bucket = bucket
+        self.latency_seconds = latency_seconds
+        self.bandwidth_bytes_per_second = bandwidth_bytes_per_second
+
+    def _wait(self, n_bytes):
+        time.sleep(self.latency_seconds + (n_bytes / self.bandwidth_bytes_per_second
+                                           if self.bandwidth_bytes_per_second else 0))
+
+    def get_object(self, Bucket, Key):
+        try:
+            with open(self.bucket.path(Key), "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            raise NoSuchKey(Key)
+        self._wait(len(data))
+        return {"Body": io.BytesIO(data), "ETag": '"' + hashlib.md5(data).hexdigest() + '"'}
+
+    def put_object(self, Bucket, Key, Body):
+        data = Body.encode() if isinstance(Body, str) else Body
+        self._wait(len(data))
+        os.makedirs(os.path.dirname(self.bucket.path(Key)), exist_ok=True)
+        with open(self.bucket.path(Key), "wb") as file:
+            file.write(data)
+
+
+class LocalBucket:
+    """Directory of objects behind the Bucket interface: name, objects.all() and .filter(Prefix), Object(key),
+    put_object, meta.client"""
+
+    def __init__(self, directory, latency_seconds=0.0, bandwidth_bytes_per_second=None):
+        self.name = os.path.basename(os.path.normpath(directory))
+        self.directory = directory
+        self.meta = type("meta", (), {})()
+        self.meta.client = LocalClient(self, latency_seconds, bandwidth_bytes_per_second)
+        self.objects = self
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def all(self):
+        keys = sorted(os.path.relpath(os.path.join(root, name), self.directory)
+                      for root, _, names in os.walk(self.directory) for name in names)
+        return [LocalObject(self, key) for key in keys]
+
+    def filter(self, Prefix=""):
+        return [obj for obj in self.all() if obj.key.startswith(Prefix)]
+
+    def Object(self, key):
+        return LocalObject(self, key)
+
+    def put_object(self, Key, Body):
+        self.meta.client.put_object(Bucket=self.name, Key=Key, Body=Body)
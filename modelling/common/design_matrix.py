@@ -0,0 +1,239 @@
+import hashlib
+import io
+import json
+import os
+from copy import deepcopy
+
+import joblib
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.base import clone
+from sklearn.pipeline import Pipeline
+
+try:
+    from modelling.common.drift import TIME_COLUMN
+    from modelling.common.s3_fetch import map_concurrently
+    from modelling.common.storage import ObjectNotFound, as_storage, get_bytes
+except ModuleNotFoundError:  # Inside the Lambda package modelling/common is copied to ./common
+    from common.drift import TIME_COLUMN
+    from common.s3_fetch import map_concurrently
+    from common.storage import ObjectNotFound, as_storage, get_bytes
+
+# "on" to fit regressors on the encoded rows kept in the processed bucket under DESIGN_MATRIX_PREFIX, so each run only
+# encodes the months that are new or changed since the last one
+DESIGN_MATRIX_CACHE = os.getenv("DESIGN_MATRIX_CACHE", "on")
+DESIGN_MATRIX_PREFIX = os.getenv("DESIGN_MATRIX_PREFIX", "design-matrix/")
+# Forests fit several times faster on a dense matrix than on the preprocessor's sparse output, and convert either to
+# float32 first, so this loses nothing. 1M rows of ~60 encoded columns are about 240 MB dense, "off" keeps it sparse
+FIT_DENSE = os.getenv("DESIGN_MATRIX_DENSE", "on") == "on"
+
+# Bump when the stored layout changes, the store is then rebuilt
+STORE_VERSION = 1
+TARGET = "resale_price"
+# Fitted attributes of the preprocessor's steps that decide what a row is encoded to
+ENCODING_ATTRIBUTES = ("categories_", "drop_idx_", "mean_", "scale_")
+
+
+def leaf_steps(transformer):
+    return [step for _, step in transformer.steps] if hasattr(transformer, "steps") else [transformer]
+
+def configuration(preprocessor):
+    """Hash of the settings of an unfitted ColumnTransformer (columns, steps and their parameters)"""
+    parts = [[name, list(columns), [[type(step).__name__, step.get_params(deep=False)] for step in leaf_steps(transformer)]
+              if not isinstance(transformer, str) else transformer]
+             for name, transformer, columns in preprocessor.transformers] + [preprocessor.remainder]
+
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=repr).encode()).hexdigest()
+
+def fitted_encoding(preprocessor):
+    """Hash of what a fitted ColumnTransformer encodes rows to: its columns, vocabularies and scaling"""
+    parts = []
+    for name, transformer, columns in preprocessor.transformers_:
+        for step in leaf_steps(transformer) if not isinstance(transformer, str) else []:
+            learnt = {attribute: [np.asarray(value).tolist() for value in values] if isinstance(values, list)
+                      else np.asarray(values).tolist()
+                      for attribute in ENCODING_ATTRIBUTES if (values := getattr(step, attribute, None)) is not None}
+            parts.append([name, list(columns), type(step).__name__, learnt])
+
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+def vocabulary(preprocessor):
+    """{column: categories} of the one-hot encoders of a fitted ColumnTransformer"""
+    categories = {}
+    for _, transformer, columns in preprocessor.transformers_:
+        for step in leaf_steps(transformer) if not isinstance(transformer, str) else []:
+            if type(step).__name__ == "OneHotEncoder":
+                categories.update({column: [str(category) for category in column_categories]
+                                   for column, column_categories in zip(columns, step.categories_)})
+
+    return categories
+
+def unseen_categories(categories, df):
+    """{column: categories} of df missing from a vocabulary, which the encoders would have no column for"""
+    unseen = {}
+    for column, known in categories.items():
+        new = set(df[column].dropna().astype(str).unique()) - set(known)
+        if new:
+            unseen[column] = sorted(new)
+
+    return unseen
+
+def rows_hash(df):
+    # Hash of the rows of a frame in order, the same whether the string columns are object or categorical
+    df = df[sorted(df.columns)]
+    row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+    return hashlib.sha256(json.dumps(list(df.columns)).encode() + row_hashes.tobytes()).hexdigest()
+
+def encode_rows(preprocessor, df):
+    return sp.csr_matrix(preprocessor.transform(df.drop(columns=[TARGET])), dtype=np.float32)
+
+def block_to_bytes(X, y):
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, data=X.data, indices=X.indices, indptr=X.indptr, shape=np.array(X.shape), y=y)
+
+    return buffer.getvalue()
+
+def bytes_to_block(data):
+    with np.load(io.BytesIO(data)) as arrays:
+        return sp.csr_matrix((arrays["data"], arrays["indices"], arrays["indptr"]), shape=arrays["shape"]), arrays["y"]
+
+
+class DesignMatrix:
+    """Encoded rows of a processed dataset ordered by month, their targets and months, and the fitted preprocessor
+    that encodes them"""
+
+    def __init__(self, X, y, days, preprocessor, encoding):
+        self.X = X
+        self.y = y
+        self.days = days
+        self.preprocessor = preprocessor
+        self.encoding = encoding
+
+    def training_matrix(self, dense=FIT_DENSE):
+        return self.X.toarray() if dense else self.X
+
+    def latest(self, months):
+        """Design matrix of the latest `months` months"""
+        rows = self.days >= np.unique(self.days)[-months:][0]
+
+        return DesignMatrix(self.X[rows], self.y[rows], self.days[rows], self.preprocessor, self.encoding)
+
+    def encodes_like(self, pipeline):
+        """Whether the rows are encoded as a fitted pipeline's own preprocessor would encode them"""
+        return fitted_encoding(pipeline.named_steps["preprocessor"]) == self.encoding
+
+    def pipeline(self, regressor):
+        """Pipeline of the preprocessor and a regressor fitted on the matrix, which predicts from processed rows"""
+        return Pipeline(steps=[("preprocessor", deepcopy(self.preprocessor)), ("reg", regressor)])
+
+
+class DesignMatrixStore:
+    """Append-only store of encoded months in a storage (see storage.py) or an S3 bucket resource.
+
+    A manifest lists the fitted preprocessor, its vocabularies and the content hash of every stored month. Each month
+    is a compressed CSR block, encoded once and read back on later runs while its rows stay the same.
+    """
+
+    def __init__(self, storage, prefix=DESIGN_MATRIX_PREFIX):
+        self.storage = as_storage(storage)
+        self.prefix = prefix
+
+    def block_key(self, encoding, day):
+        # Under the encoding, so a rebuild never overwrites the blocks a running job is reading
+        return f"{self.prefix}{encoding[:16]}/day={day}.npz"
+
+    def load_manifest(self):
+        try:
+            return json.loads(get_bytes(self.storage, self.prefix + "manifest.json"))
+        except ObjectNotFound:
+            return None
+
+    def staleness(self, manifest, df, preprocessor):
+        # Why the stored months cannot be reused for df and this preprocessor, or None if they can
+        if manifest is None:
+            return "no stored design matrix"
+        if manifest["version"] != STORE_VERSION:
+            return f"store version {manifest['version']}, expected {STORE_VERSION}"
+        if manifest["configuration"] != configuration(preprocessor):
+            return "different preprocessor settings"
+        if manifest["columns"] != sorted(df.columns):
+            return f"different columns {sorted(df.columns)}"
+        unseen = unseen_categories(manifest["vocabulary"], df)
+        if unseen:
+            return f"categories missing from the stored vocabularies {unseen}"
+
+        return None
+
+    def encodes_like(self, pipeline, df):
+        """Whether the stored months can be read for df without a rebuild and are encoded as a fitted pipeline's own
+        preprocessor would encode them. Only the manifest is read"""
+        preprocessor = pipeline.named_steps["preprocessor"]
+        manifest = self.load_manifest()
+
+        return (self.staleness(manifest, df, preprocessor) is None
+                and manifest["encoding"] == fitted_encoding(preprocessor))
+
+    def update(self, df, preprocessor):
+        """Design matrix of a processed dataset, encoding and storing only the months not stored yet or changed.
+
+        preprocessor is the unfitted (or a fitted, it is cloned) ColumnTransformer to encode with. It is only fit
+        when the store is rebuilt: when there is none, the stored one was set up differently, or df has
+        categories its vocabularies lack. Months stored but not in df are kept for other datasets.
+        """
+        manifest = self.load_manifest()
+        stale = self.staleness(manifest, df, preprocessor)
+        previous = manifest
+        if stale:
+            print(f"Rebuilding the design matrix store: {stale}")
+            fitted = clone(preprocessor).fit(df.drop(columns=[TARGET]))
+            encoding = fitted_encoding(fitted)
+            manifest = {"version": STORE_VERSION, "configuration": configuration(preprocessor),
+                        "columns": sorted(df.columns), "encoding": encoding, "vocabulary": vocabulary(fitted),
+                        "preprocessor": f"{self.prefix}{encoding[:16]}/preprocessor.joblib", "months": {}}
+            buffer = io.BytesIO()
+            joblib.dump(fitted, buffer)
+            self.storage.put(manifest["preprocessor"], buffer.getvalue())
+        else:
+            fitted = joblib.load(io.BytesIO(get_bytes(self.storage, manifest["preprocessor"])))
+            encoding = manifest["encoding"]
+
+        months = {str(day): month_df for day, month_df in df.groupby(TIME_COLUMN, sort=True)}
+        hashes = {day: rows_hash(month_df) for day, month_df in months.items()}
+        changed = [day for day in months if manifest["months"].get(day, {}).get("hash") != hashes[day]]
+
+        blocks = {}
+        if changed:
+            # One transform for all the months to encode, split back into months
+            changed_df = pd.concat([months[day] for day in changed])
+            X, y = encode_rows(fitted, changed_df), changed_df[TARGET].to_numpy()
+            bounds = np.cumsum([0] + [len(months[day]) for day in changed])
+            for day, start, stop in zip(changed, bounds[:-1], bounds[1:]):
+                blocks[day] = X[start:stop], y[start:stop]
+            map_concurrently(lambda day: self.storage.put(self.block_key(encoding, day), block_to_bytes(*blocks[day])),
+                             changed)
+            manifest["months"].update({day: {"hash": hashes[day], "rows": len(months[day])} for day in changed})
+            # The manifest goes last, so it never lists a month that is not written yet
+            self.storage.put(self.prefix + "manifest.json", json.dumps(manifest))
+
+        if stale and previous is not None:
+            self.delete_replaced(previous, manifest)
+
+        stored = [day for day in months if day not in blocks]
+        blocks.update(zip(stored, map_concurrently(
+            lambda day: bytes_to_block(get_bytes(self.storage, self.block_key(encoding, day))), stored)))
+        print(f"Design matrix: {len(changed)} months encoded, {len(stored)} read from the store")
+
+        X = sp.vstack([blocks[day][0] for day in months], format="csr")
+        y = np.concatenate([blocks[day][1] for day in months])
+        days = np.repeat([int(day) for day in months], [len(months[day]) for day in months])
+
+        return DesignMatrix(X, y, days, fitted, encoding)
+
+    def stored_keys(self, manifest):
+        return {self.block_key(manifest["encoding"], day) for day in manifest["months"]} | {manifest["preprocessor"]}
+
+    def delete_replaced(self, previous, manifest):
+        # Blocks and preprocessor of a rebuilt store that the new one does not reuse
+        map_concurrently(self.storage.delete, sorted(self.stored_keys(previous) - self.stored_keys(manifest)))
@@ -0,0 +1,150 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+# Features compared between the training data and a new month. days_from_earliest_data is left out: it is a time
+# index, so a new month is always outside the training range and its PSI says nothing about drift
+NUMERIC_FEATURES = ["flat_age_years", "floor_area_sqm"]
+CATEGORICAL_FEATURES = ["town", "flat_type", "flat_model_revised", "storey_range_grouped"]
+
+N_BINS = 10
+PSI_THRESHOLD = 0.2
+# Saved by training next to the champion model in the model bucket, read by data validation
+REFERENCE_PROFILE_KEY = "reference_profile.json"
+# Column identifying the month of a row in the processed data, so a reference knows which months it covers
+TIME_COLUMN = "days_from_earliest_data"
+# Floor on bin proportions, so empty bins neither divide by zero nor take log(0)
+EPSILON = 1e-4
+
+
+def bin_edges(values, n_bins=N_BINS):
+    """(n_bins + 1, n_features) quantile edges of every column of a 2D array, in one call"""
+    return np.nanquantile(values, np.linspace(0, 1, n_bins + 1), axis=0)
+
+def bin_counts(values, edges):
+    """(n_features, n_bins) counts of every column of a 2D array in the bins given by edges. Values outside the edges
+    go to the first or last bin, missing values to none"""
+    n_bins, n_features = edges.shape[0] - 1, edges.shape[1]
+    codes = np.stack([np.searchsorted(edges[1:-1, j], values[:, j], side="right") for j in range(n_features)], axis=1)
+    codes += np.arange(n_features) * n_bins  # One bincount over all columns
+
+    return np.bincount(codes[~np.isnan(values)], minlength=n_features * n_bins).reshape(n_features, n_bins)
+
+def proportions(counts):
+    # Smoothed bin proportions along the last axis
+    shares = np.maximum(counts / np.maximum(counts.sum(axis=-1, keepdims=True), 1), EPSILON)
+
+    return shares / shares.sum(axis=-1, keepdims=True)
+
+def psi(expected_counts, actual_counts):
+    """Population stability index per row of two count arrays of the same shape"""
+    expected, actual = proportions(expected_counts), proportions(actual_counts)
+
+    return ((actual - expected) * np.log(actual / expected)).sum(axis=-1)
+
+def chi_square(expected_counts, actual_counts):
+    # Chi-square statistic of the 2 x categories contingency table, its degrees of freedom and Cramer's V
+    table = np.vstack([expected_counts, actual_counts]).astype(np.float64)
+    table = table[:, table.sum(axis=0) > 0]
+    total = table.sum()
+    expected = table.sum(axis=1, keepdims=True) * table.sum(axis=0, keepdims=True) / total
+    statistic = float(((table - expected) ** 2 / expected).sum())
+
+    return statistic, table.shape[1] - 1, float(np.sqrt(statistic / total))
+
+def category_counts(series):
+    # Counts of the categories present (a categorical's value_counts also lists unused categories), missing excluded
+    counts = series.value_counts(sort=False)
+    counts.index = counts.index.astype(str)
+
+    return counts[counts > 0]
+
+def build_reference(df, numeric=NUMERIC_FEATURES, categorical=CATEGORICAL_FEATURES, n_bins=N_BINS, edges=None):
+    """Distribution of the reference (training) data: bin edges and counts of the numeric features, and category
+    counts of the categorical ones. The edges are df's quantiles unless given as {column: edges}, e.g. those of
+    another reference to merge with. Small and JSON-serialisable, so it can be saved next to the model."""
+    values = df[numeric].to_numpy(dtype=np.float64)
+    edges = bin_edges(values, n_bins) if edges is None else np.array([edges[column] for column in numeric]).T
+    counts = bin_counts(values, edges)
+    reference = {"rows": len(df), "numeric": {}, "categorical": {}}
+    if TIME_COLUMN in df and len(df):
+        reference["through_day"] = int(df[TIME_COLUMN].max())
+    for j, column in enumerate(numeric):
+        reference["numeric"][column] = {"edges": edges[:, j].tolist(), "counts": counts[j].tolist()}
+    for column in categorical:
+        counts = category_counts(df[column]).sort_index()
+        reference["categorical"][column] = {"categories": counts.index.tolist(), "counts": counts.tolist()}
+
+    return reference
+
+def merge_references(reference, other):
+    """Reference of the data of both, which must share the numeric bin edges (build other with edges=...)"""
+    merged = {"rows": reference["rows"] + other["rows"], "numeric": {}, "categorical": {}}
+    if "through_day" in reference or "through_day" in other:
+        merged["through_day"] = max(reference.get("through_day", -1), other.get("through_day", -1))
+    for column, profile in reference["numeric"].items():
+        assert profile["edges"] == other["numeric"][column]["edges"], f"Different bin edges for {column}"
+        merged["numeric"][column] = {"edges": profile["edges"],
+                                     "counts": (np.array(profile["counts"]) +
+                                                np.array(other["numeric"][column]["counts"])).tolist()}
+    for column, profile in reference["categorical"].items():
+        counts = pd.Series(profile["counts"], index=profile["categories"], dtype=np.int64).add(
+            pd.Series(other["categorical"][column]["counts"], index=other["categorical"][column]["categories"],
+                      dtype=np.int64), fill_value=0).astype(np.int64).sort_index()
+        merged["categorical"][column] = {"categories": counts.index.tolist(), "counts": counts.tolist()}
+
+    return merged
+
+def fold_into_reference(reference, df):
+    """Reference updated with the rows of df from months after the ones it covers (all of df if it does not know),
+    binned on its existing edges"""
+    if "through_day" in reference and TIME_COLUMN in df:
+        df = df[df[TIME_COLUMN] > reference["through_day"]]
+    if len(df) == 0:
+        return reference
+    edges = {column: profile["edges"] for column, profile in reference["numeric"].items()}
+
+    return merge_references(reference, build_reference(df, list(reference["numeric"]), list(reference["categorical"]),
+                                                       edges=edges))
+
+def save_reference(reference, path):
+    with open(path, "w") as file:
+        json.dump(reference, file)
+
+def drift_report(reference, df, psi_threshold=PSI_THRESHOLD):
+    """Drift of df against a reference from build_reference, as a JSON-serialisable dict.
+
+    A numeric feature drifts when its PSI is above psi_threshold, as the per-column check before it did. A
+    categorical one drifts only when df has categories the reference never saw, as the model cannot have learnt
+    anything about them. A categorical PSI above psi_threshold is reported (psi_shift) but does not count as drift.
+    """
+    if len(df) == 0:
+        raise ValueError("No rows to check for drift")
+
+    report = {"reference_rows": reference["rows"], "rows": len(df), "psi_threshold": psi_threshold, "features": {}}
+
+    numeric = list(reference["numeric"])
+    if numeric:
+        edges = np.array([reference["numeric"][column]["edges"] for column in numeric]).T
+        expected = np.array([reference["numeric"][column]["counts"] for column in numeric])
+        actual = bin_counts(df[numeric].to_numpy(dtype=np.float64), edges)
+        for column, column_psi, column_counts in zip(numeric, psi(expected, actual), actual):
+            report["features"][column] = {"type": "numeric", "psi": float(column_psi),
+                                          "counts": column_counts.tolist(),
+                                          "drift": bool(column_psi > psi_threshold)}
+
+    for column, profile in reference["categorical"].items():
+        actual_counts = category_counts(df[column])
+        unseen = sorted(set(actual_counts.index) - set(profile["categories"]))
+        categories = profile["categories"] + unseen
+        expected = np.array(profile["counts"] + [0] * len(unseen))
+        actual = actual_counts.reindex(categories, fill_value=0).to_numpy()
+        column_psi = float(psi(expected, actual))
+        statistic, dof, cramers_v = chi_square(expected, actual)
+        report["features"][column] = {"type": "categorical", "psi": column_psi, "chi2": statistic, "dof": dof,
+                                      "cramers_v": cramers_v, "unseen": unseen,
+                                      "psi_shift": bool(column_psi > psi_threshold), "drift": bool(unseen)}
+
+    report["drifted"] = [column for column, feature in report["features"].items() if feature["drift"]]
+    return report
@@ -0,0 +1,140 @@
+import hashlib
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+    from modelling.common.design_matrix import TARGET, fitted_encoding, rows_hash
+    from modelling.common.s3_fetch import map_concurrently
+    from modelling.common.storage import ObjectNotFound, as_storage, get_bytes
+except ModuleNotFoundError:  # Inside the Lambda package modelling/common is copied to ./common
+    from common.design_matrix import TARGET, fitted_encoding, rows_hash
+    from common.s3_fetch import map_concurrently
+    from common.storage import ObjectNotFound, as_storage, get_bytes
+
+# Errors are also broken down by the values of these columns
+SEGMENT_COLUMNS = ["town", "flat_type"]
+# Predictions of a saved model on a dataset are kept in the model bucket under this prefix, keyed on the hashes of
+# both, so the champion is not scored again on a retrain_test it has already been scored on. Only the latest entry
+# is kept
+EVALUATION_CACHE_PREFIX = os.getenv("EVALUATION_CACHE_PREFIX", "prediction-cache/")
+EVALUATION_REPORT_KEY = "evaluation_report.json"
+
+
+def model_hash(model_bytes):
+    """Hash of a saved (joblib) model"""
+    return hashlib.sha256(model_bytes).hexdigest()
+
+
+class EvaluationCache:
+    """Predictions of a model on a dataset, as an .npy object in a storage (see storage.py) or an S3 bucket resource.
+
+    Each put replaces every other entry: the cache only ever serves the current champion on the latest rows, and
+    models and datasets change every month.
+    """
+
+    def __init__(self, storage, prefix=EVALUATION_CACHE_PREFIX):
+        self.storage = as_storage(storage)
+        self.prefix = prefix
+
+    def key(self, model_key, data_key):
+        return f"{self.prefix}{model_key[:16]}/{data_key[:16]}.npy"
+
+    def get(self, model_key, data_key):
+        try:
+            return np.load(io.BytesIO(get_bytes(self.storage, self.key(model_key, data_key))))
+        except ObjectNotFound:
+            return None
+
+    def put(self, model_key, data_key, predictions):
+        buffer = io.BytesIO()
+        np.save(buffer, predictions)
+        key = self.key(model_key, data_key)
+        self.storage.put(key, buffer.getvalue())
+        map_concurrently(self.storage.delete, [stale for stale in self.storage.list(self.prefix) if stale != key])
+
+
+def predict_all(models, X):
+    """{name: predictions} of several fitted models on the same rows, the models predicting at the same time.
+
+    Pipelines whose preprocessors encode alike (e.g. a champion and the challenger grown from it) share one
+    transform, and their regressors predict from it as a dense float32 matrix, which is what forests convert it to.
+    """
+    encoded, jobs = {}, []
+    for name, model in models.items():
+        steps = getattr(model, "named_steps", {})
+        if "preprocessor" in steps and "reg" in steps:
+            encoding = fitted_encoding(steps["preprocessor"])
+            if encoding not in encoded:
+                transformed = steps["preprocessor"].transform(X)
+                encoded[encoding] = np.asarray(transformed.toarray() if hasattr(transformed, "toarray") else transformed,
+                                               dtype=np.float32)
+            jobs.append((name, steps["reg"], encoded[encoding]))
+        else:
+            jobs.append((name, model, X))
+
+    predictions = map_concurrently(lambda job: np.asarray(job[1].predict(job[2]), dtype=np.float64), jobs)
+
+    return {name: prediction for (name, _, _), prediction in zip(jobs, predictions)}
+
+
+def error_report(df, predictions, segments=SEGMENT_COLUMNS):
+    """RMSE and MAE of every model's predictions on df, overall and per value of each segment column.
+
+    All models are scored together: their errors are one (models, rows) array, and the sums per segment of all
+    models come from one bincount per column.
+    """
+    names = list(predictions)
+    errors = np.vstack([predictions[name] for name in names]) - df[TARGET].to_numpy(dtype=np.float64)
+    squared, absolute = errors ** 2, np.abs(errors)
+    report = {name: {"rows": len(df), "rmse": float(np.sqrt(squared[i].mean())), "mae": float(absolute[i].mean()),
+                     "segments": {}}
+              for i, name in enumerate(names)}
+
+    for column in segments:
+        codes, values = pd.factorize(df[column], sort=True)
+        present = codes >= 0  # Missing values are in no segment
+        n_values = len(values)
+        flat = (codes[present] + np.arange(len(names))[:, None] * n_values).ravel()
+        sums = [np.bincount(flat, weights=errors_of[:, present].ravel(), minlength=len(names) * n_values)
+                .reshape(len(names), n_values) for errors_of in (squared, absolute)]
+        counts = np.bincount(codes[present], minlength=n_values)
+        for i, name in enumerate(names):
+            report[name]["segments"][column] = {
+                str(value): {"rows": int(count), "rmse": float(np.sqrt(squared_sum / count)),
+                             "mae": float(absolute_sum / count)}
+                for value, count, squared_sum, absolute_sum in zip(values, counts, sums[0][i], sums[1][i]) if count
+            }
+
+    return report
+
+
+def evaluate(models, df, cache=None, model_keys=None, segments=SEGMENT_COLUMNS):
+    """Error report (see error_report) of several fitted models on a processed dataset with targets, and their
+    {name: predictions}.
+
+    Models with a key in model_keys (e.g. the champion, by model_hash of its saved bytes) have their predictions
+    read from the cache when they were already scored on the same rows, and stored in it otherwise.
+    """
+    X = df.drop(columns=[TARGET])
+    model_keys = model_keys or {}
+    data_key = rows_hash(X) if cache is not None else None
+
+    predictions, to_predict = {}, {}
+    for name, model in models.items():
+        cached = cache.get(model_keys[name], data_key) if cache is not None and name in model_keys else None
+        if cached is not None and len(cached) == len(df):
+            print(f"Predictions of {name} read from the cache")
+            predictions[name] = cached
+        else:
+            to_predict[name] = model
+
+    predictions.update(predict_all(to_predict, X))
+    for name in to_predict:
+        if cache is not None and name in model_keys:
+            cache.put(model_keys[name], data_key, predictions[name])
+
+    predictions = {name: predictions[name] for name in models}
+    return error_report(df, predictions, segments), predictions
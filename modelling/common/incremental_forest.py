@@ -0,0 +1,96 @@
+import os
+from copy import deepcopy
+
+import numpy as np
+from sklearn.base import clone
+
+try:
+    from modelling.common.design_matrix import unseen_categories, vocabulary
+    from modelling.common.drift import TIME_COLUMN
+except ModuleNotFoundError:  # Inside the Lambda package modelling/common is copied to ./common
+    from common.design_matrix import unseen_categories, vocabulary
+    from common.drift import TIME_COLUMN
+
+# "full" refits the whole pipeline on all history, "incremental" replaces the champion's NEW_TREES oldest trees with
+# as many fit on the latest months. Full stays the default, incremental is opt-in
+RETRAIN_MODE = os.getenv("RETRAIN_MODE", "full")
+NEW_TREES = int(os.getenv("INCREMENTAL_NEW_TREES", "25"))
+# New trees are fit on this many of the latest months: the new ones and enough before them for a few tens of
+# thousands of rows, a single month is too few for trees as deep as the champion's
+WINDOW_MONTHS = int(os.getenv("INCREMENTAL_WINDOW_MONTHS", "12"))
+
+
+def latest_months(df, months=WINDOW_MONTHS):
+    """Rows of the latest `months` months of a processed frame (one TIME_COLUMN value per month)"""
+    month_days = np.unique(df[TIME_COLUMN].to_numpy())
+
+    return df[df[TIME_COLUMN] >= month_days[-months:][0]]
+
+
+def can_grow(pipeline, df):
+    """Whether the pipeline's forest can be grown on df: it is a fitted forest with warm_start, and its frozen
+    encoders know every category in df (an unseen one would be ignored by every new tree)"""
+    regressor = pipeline.named_steps["reg"]
+    if not hasattr(regressor, "estimators_") or "warm_start" not in regressor.get_params():
+        print(f"Cannot grow a {type(regressor).__name__}")
+        return False
+
+    unseen = unseen_categories(vocabulary(pipeline.named_steps["preprocessor"]), df)
+    if unseen:
+        print("Categories unknown to the model's encoders:", unseen)
+    return not unseen
+
+
+def grow_forest(pipeline, df, new_trees=NEW_TREES, design=None):
+    """Copy of a fitted Pipeline(preprocessor, reg=forest) whose new_trees oldest trees are replaced by as many fit
+    on df, so the forest keeps its size and its trees fit on months long gone give way to ones that know the
+    recent market.
+
+    The preprocessor is reused as fitted. Trees only compare features against thresholds, so keeping the old
+    scaling is harmless, and it keeps the existing trees valid. df's rows are taken from design (a DesignMatrix of
+    exactly df) rather than encoded again when given.
+    """
+    grown = deepcopy(pipeline)
+    forest = grown.named_steps["reg"]
+    if design is None:
+        X, y = grown.named_steps["preprocessor"].transform(df.drop(columns=["resale_price"])), df["resale_price"]
+    else:
+        X, y = design.training_matrix(), design.y
+
+    # warm_start fits only the trees beyond the ones the forest has, and appends them, so estimators_ is oldest first
+    n_trees = len(forest.estimators_)
+    forest.set_params(warm_start=True, n_estimators=n_trees + new_trees)
+    forest.fit(X, y)
+    del forest.estimators_[:len(forest.estimators_) - n_trees]
+    # Back to a plain forest, so a later full refit of the pipeline starts from scratch as usual
+    forest.set_params(warm_start=False, n_estimators=n_trees)
+
+    return grown
+
+
+def retrain(champion, df, mode=RETRAIN_MODE, store=None):
+    """Challenger for a champion pipeline: its oldest trees replaced by ones fit on the latest months of df in
+    incremental mode when possible, else refit on all of df. With store, a DesignMatrixStore, the regressor is fit
+    on the cached encoded rows of the months it trains on, and only those months are encoded or read"""
+    if mode not in ("incremental", "full"):
+        raise ValueError(f"Unknown retrain mode: {mode}")
+
+    recent = latest_months(df)
+    if mode == "incremental" and can_grow(champion, recent):
+        print(f"Replacing the {NEW_TREES} oldest trees with trees fit on the latest {WINDOW_MONTHS} months "
+              f"({len(recent)} rows)")
+        # The cached rows are only usable if they were encoded by the champion's own preprocessor, which is checked
+        # against the manifest before any month is read
+        design = None
+        if store is not None and store.encodes_like(champion, df):
+            design = store.update(recent, champion.named_steps["preprocessor"])
+        return grow_forest(champion, recent, design=design)
+
+    print(f"Refitting on all {len(df)} rows")
+    if store is not None:
+        design = store.update(df, champion.named_steps["preprocessor"])
+        regressor = clone(champion.named_steps["reg"])
+        return design.pipeline(regressor.fit(design.training_matrix(), design.y))
+
+    challenger = deepcopy(champion)
+    return challenger.fit(df.drop(columns=["resale_price"]), df["resale_price"])
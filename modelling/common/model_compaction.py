@@ -0,0 +1,141 @@
+import os
+import statistics
+import tempfile
+import time
+from copy import deepcopy
+
+import joblib
+import numpy as np
+
+try:
+    from modelling.common.serving_artifact import round_down_to_float32
+except ModuleNotFoundError:  # Inside the Lambda package modelling/common is copied to ./common
+    from common.serving_artifact import round_down_to_float32
+
+# Compression of the saved champion_model.joblib: zlib 3 shrinks a compacted forest ~8x for ~30 ms more load time,
+# lzma another ~40% at twice the load time, "none" saves it as is. The app reads a joblib model into memory either
+# way (sklearn trees copy their node arrays on load), only the serving artifact (.npz) is memory-mapped, and that is
+# exported uncompressed
+MODEL_COMPRESSION = ((os.getenv("MODEL_COMPRESSION", "zlib"), int(os.getenv("MODEL_COMPRESSION_LEVEL", "3")))
+                     if os.getenv("MODEL_COMPRESSION", "zlib") != "none" else 0)
+# "on" to also report the size, load time and prediction drift of a saved model against the uncompacted one. It
+# saves and loads both models several times, so it is for comparing settings rather than every run
+MODEL_COMPACTION_REPORT = os.getenv("MODEL_COMPACTION_REPORT", "off") == "on"
+# Trees are pruned while the forest's predictions move by at most this RMS, relative to their own RMS. 0 keeps all
+PRUNE_TOLERANCE = float(os.getenv("MODEL_PRUNE_TOLERANCE", "0"))
+PRUNE_SAMPLE_ROWS = 5000
+MODEL_COMPACTION_REPORT_KEY = "model_compaction_report.json"
+
+# Training statistics of every node, which only feature_importances_ and partial dependence plots read. Zeroed, so
+# they compress to nothing
+STRIPPED_NODE_FIELDS = ("impurity", "n_node_samples", "weighted_n_node_samples")
+
+
+def compact_tree(tree):
+    """Copy of a fitted sklearn Tree with float32 thresholds and leaf values and without node statistics.
+
+    sklearn keeps them as float64, so they stay float64 in memory but become float32 values, whose low mantissa
+    bytes are zeros that compress away. Thresholds are rounded down, which keeps every split of a float32 input
+    (what forests predict from) exactly the same. Internal nodes' values are never predicted and are zeroed.
+    """
+    cls, args, state = tree.__reduce__()
+    nodes, values = state["nodes"].copy(), state["values"].copy()
+    is_leaf = nodes["left_child"] == -1
+
+    nodes["threshold"] = np.where(is_leaf, nodes["threshold"], round_down_to_float32(nodes["threshold"]))
+    for field in STRIPPED_NODE_FIELDS:
+        nodes[field] = 0
+    values[~is_leaf] = 0
+    values = values.astype(np.float32).astype(np.float64)
+
+    compacted = cls(*args)
+    compacted.__setstate__({**state, "nodes": nodes, "values": values})
+
+    return compacted
+
+
+def select_trees(tree_predictions, tolerance):
+    """Indices (in order) of the fewest trees whose mean prediction is within tolerance of all trees', picked
+    greedily: each step adds the tree that brings the running mean closest to the full forest's"""
+    target = tree_predictions.mean(axis=0)
+    scale = np.sqrt(np.mean(target ** 2))
+    remaining, selected = list(range(len(tree_predictions))), []
+    total = np.zeros_like(target)
+    while remaining:
+        drift = np.sqrt((((total + tree_predictions[remaining]) / (len(selected) + 1) - target) ** 2).mean(axis=1))
+        best = int(np.argmin(drift))
+        total += tree_predictions[remaining[best]]
+        selected.append(remaining.pop(best))
+        if drift[best] <= tolerance * scale:
+            break
+
+    return sorted(selected)
+
+
+def prune_forest(forest, X, tolerance):
+    """Keep the trees of a fitted forest that select_trees picks on encoded rows X, in their original order (oldest
+    first, as the incremental retrain's replacement policy expects)"""
+    X = np.asarray(X.toarray() if hasattr(X, "toarray") else X, dtype=np.float32)
+    tree_predictions = np.vstack([tree.predict(X) for tree in forest.estimators_])
+    kept = select_trees(tree_predictions, tolerance)
+    print(f"Pruning kept {len(kept)} of {len(forest.estimators_)} trees")
+    forest.estimators_ = [forest.estimators_[i] for i in kept]
+    forest.n_estimators = len(kept)
+
+
+def compact_pipeline(pipeline, df=None, prune_tolerance=PRUNE_TOLERANCE):
+    """Copy of a fitted Pipeline(preprocessor, reg=forest) with compacted trees (see compact_tree), and with the
+    trees that barely move its predictions on processed rows df pruned when prune_tolerance > 0"""
+    compacted = deepcopy(pipeline)
+    forest = compacted.named_steps["reg"]
+    if prune_tolerance > 0:
+        if df is None:
+            raise ValueError("Pruning needs rows to compare predictions on")
+        sample = df.sample(min(len(df), PRUNE_SAMPLE_ROWS), random_state=0).drop(columns=["resale_price"],
+                                                                                  errors="ignore")
+        prune_forest(forest, compacted.named_steps["preprocessor"].transform(sample), prune_tolerance)
+
+    for estimator in forest.estimators_:
+        estimator.tree_ = compact_tree(estimator.tree_)
+
+    return compacted
+
+
+def save_model(pipeline, path, compress=MODEL_COMPRESSION):
+    joblib.dump(pipeline, path, compress=compress)
+
+    return path
+
+
+def load_seconds(path, repeats=3):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        joblib.load(path)
+        timings.append(time.perf_counter() - start)
+
+    return statistics.median(timings)
+
+
+def compaction_report(original, compacted, df, compacted_path):
+    """Size, load time and tree count of a model saved by save_model against the original saved uncompressed, and
+    how far its predictions on processed rows df are from the original's (and their RMSEs, if df has prices)"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        original_path = joblib.dump(original, os.path.join(tmp_dir, "original.joblib"))[0]
+        report = {"original": {"bytes": os.path.getsize(original_path), "load_seconds": load_seconds(original_path)},
+                  "compacted": {"bytes": os.path.getsize(compacted_path), "load_seconds": load_seconds(compacted_path)}}
+
+    X = df.drop(columns=["resale_price"], errors="ignore")
+    predictions = {"original": original.predict(X), "compacted": compacted.predict(X)}
+    for name, model in [("original", original), ("compacted", compacted)]:
+        report[name]["trees"] = len(model.named_steps["reg"].estimators_)
+        if "resale_price" in df:
+            report[name]["rmse"] = float(np.sqrt(np.mean((predictions[name] - df["resale_price"].to_numpy()) ** 2)))
+
+    drift = predictions["compacted"] - predictions["original"]
+    report["prediction_drift"] = {"rows": len(df), "max_abs": float(np.abs(drift).max()),
+                                  "max_relative": float(np.abs(drift / predictions["original"]).max()),
+                                  "rms": float(np.sqrt(np.mean(drift ** 2)))}
+    report["size_ratio"] = report["compacted"]["bytes"] / report["original"]["bytes"]
+
+    return report
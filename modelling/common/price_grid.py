@@ -0,0 +1,164 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+NUMERIC_AXES = ["floor_area_sqm", "flat_age_years", "days_from_earliest_data"]
+CATEGORICAL_AXES = ["town", "flat_type", "flat_model_revised", "storey_range_grouped"]
+# Axes ending at the last value the model was trained on (see default_axes). A forest's output is constant past its
+# last split, so later values, such as today's date in every app request, are priced as the axis end
+OPEN_ENDED_AXES = ["days_from_earliest_data"]
+# Largest p99 relative error of the interpolated prices against the model (on random in-grid points and on holdout
+# rows) for a grid to be shipped after training, or served by the app
+PRICE_GRID_MAX_ERROR = float(os.getenv("PRICE_GRID_MAX_ERROR", "0.02"))
+
+
+def default_axes(train_df, n_floor_area=16, flat_age_step=5, days_window=730, n_days=3):
+    """Numeric grid points covering the bulk of the training data, and the most recent couple of years of days"""
+    floor_area = train_df["floor_area_sqm"].quantile([0.005, 0.995]).to_numpy()
+    max_flat_age = int(np.ceil(train_df["flat_age_years"].max() / flat_age_step) * flat_age_step)
+    max_days = int(train_df["days_from_earliest_data"].max())
+
+    return {
+        "floor_area_sqm": np.linspace(np.floor(floor_area[0]), np.ceil(floor_area[1]), n_floor_area),
+        "flat_age_years": np.arange(0, max_flat_age + 1, flat_age_step, dtype=np.float64),
+        "days_from_earliest_data": np.linspace(max_days - days_window, max_days, n_days),
+    }
+
+
+def build_price_grid(pipeline, train_df, axes=None):
+    """Evaluate the model over every category combination seen in training, at every numeric grid point.
+
+    Returns a dict of arrays: the vocabulary and numeric axes, a (town, flat_type, flat_model_revised,
+    storey_range_grouped) -> combination index tensor (-1 if never seen), and the float32 price tensor
+    of shape (n_combinations, n_floor_area, n_flat_age, n_days).
+    """
+    axes = axes or default_axes(train_df)
+    vocab = {name: np.sort(train_df[name].astype(str).unique()).astype(str) for name in CATEGORICAL_AXES}
+    combinations = train_df[CATEGORICAL_AXES].astype(str).drop_duplicates().reset_index(drop=True)
+
+    combination_index = np.full([len(vocab[name]) for name in CATEGORICAL_AXES], -1, dtype=np.int32)
+    codes = [np.searchsorted(vocab[name], combinations[name]) for name in CATEGORICAL_AXES]
+    combination_index[tuple(codes)] = np.arange(len(combinations))
+
+    # Cartesian product of the numeric axes, scored one category combination chunk at a time to bound memory
+    mesh = np.meshgrid(*[axes[name] for name in NUMERIC_AXES], indexing="ij")
+    numeric_points = pd.DataFrame({name: values.ravel() for name, values in zip(NUMERIC_AXES, mesh)})
+    grid_shape = mesh[0].shape
+    prices = np.empty((len(combinations), *grid_shape), dtype=np.float32)
+    chunk_size = max(1, 250000 // len(numeric_points))
+    for start in range(0, len(combinations), chunk_size):
+        chunk = combinations.iloc[start:start + chunk_size]
+        points = chunk.loc[chunk.index.repeat(len(numeric_points))].reset_index(drop=True)
+        points[NUMERIC_AXES] = np.tile(numeric_points.to_numpy(), (len(chunk), 1))
+        prices[start:start + len(chunk)] = pipeline.predict(points).reshape(len(chunk), *grid_shape)
+
+    grid = {f"vocab_{name}": vocab[name] for name in CATEGORICAL_AXES}
+    grid.update({f"axis_{name}": np.asarray(axes[name], dtype=np.float64) for name in NUMERIC_AXES})
+    grid.update({"combination_index": combination_index, "prices": prices})
+
+    return grid
+
+
+def lookup_prices(grid, columns):
+    """Multilinear interpolation of the price grid. Returns (prices, found), found is False outside the grid.
+
+    columns maps every axis name to its values, a DataFrame or a dict of lists. The app serves from this too.
+    """
+    n_rows = len(columns[CATEGORICAL_AXES[0]])
+    found = np.ones(n_rows, dtype=bool)
+
+    codes = []
+    for name in CATEGORICAL_AXES:
+        vocab = grid[f"vocab_{name}"]
+        values = np.asarray(columns[name]).astype(str)
+        code = np.clip(np.searchsorted(vocab, values), 0, len(vocab) - 1)
+        found &= vocab[code] == values
+        codes.append(code)
+    combination = grid["combination_index"][tuple(codes)].astype(np.int64)
+    found &= combination >= 0
+
+    # Lower grid index and interpolation weight along each numeric axis
+    lower, weight = [], []
+    for name in NUMERIC_AXES:
+        axis = grid[f"axis_{name}"]
+        values = np.asarray(columns[name], dtype=np.float64)
+        if name in OPEN_ENDED_AXES:
+            values = np.minimum(values, axis[-1])
+        found &= (values >= axis[0]) & (values <= axis[-1])
+        index = np.clip(np.searchsorted(axis, values, side="right") - 1, 0, max(len(axis) - 2, 0))
+        span = axis[np.minimum(index + 1, len(axis) - 1)] - axis[index]
+        lower.append(index)
+        weight.append(np.divide(values - axis[index], span, out=np.zeros(n_rows), where=span > 0).clip(0, 1))
+
+    # Weighted sum over the 8 surrounding grid points
+    combination = np.where(found, combination, 0)
+    prices = np.zeros(n_rows)
+    for corner in np.ndindex(2, 2, 2):
+        corner_weight = np.ones(n_rows)
+        corner_index = [combination]
+        for axis_number, step in enumerate(corner):
+            axis_length = len(grid[f"axis_{NUMERIC_AXES[axis_number]}"])
+            corner_index.append(np.minimum(lower[axis_number] + step, axis_length - 1))
+            corner_weight *= weight[axis_number] if step else 1 - weight[axis_number]
+        prices += corner_weight * grid["prices"][tuple(corner_index)]
+
+    return prices, found
+
+
+def grid_error(report):
+    """Worst p99 relative error of a validate_price_grid report, what PRICE_GRID_MAX_ERROR bounds"""
+    errors = [report.get("random_points", {}).get("p99_relative_error", np.inf)]
+    if report.get("holdout", {}).get("coverage"):
+        errors.append(report["holdout"]["p99_relative_error"])
+
+    return float(max(errors))
+
+
+def validate_price_grid(pipeline, grid, holdout_df=None, n_samples=20000, random_state=42):
+    """Error of the interpolated grid against the real model, on random in-grid points and on holdout rows"""
+    rng = np.random.default_rng(random_state)
+    combination_codes = np.argwhere(grid["combination_index"] >= 0)
+    picked = combination_codes[rng.integers(0, len(combination_codes), n_samples)]
+    samples = pd.DataFrame({name: grid[f"vocab_{name}"][picked[:, i]] for i, name in enumerate(CATEGORICAL_AXES)})
+    for name in NUMERIC_AXES:
+        axis = grid[f"axis_{name}"]
+        samples[name] = rng.uniform(axis[0], axis[-1], n_samples)
+    samples["flat_age_years"] = samples["flat_age_years"].round()
+    samples["days_from_earliest_data"] = samples["days_from_earliest_data"].round()
+
+    report = {"grid_shape": list(grid["prices"].shape), "random_points": _error_summary(pipeline, grid, samples)}
+    if holdout_df is not None:
+        report["holdout"] = _error_summary(pipeline, grid, holdout_df.drop(columns=["resale_price"], errors="ignore"))
+
+    return report
+
+
+def save_price_grid(grid, report, grid_path, report_path):
+    """Write the grid with its validation error, which the app checks before serving from it, and the report"""
+    with open(grid_path, "wb") as file:
+        np.savez(file, **grid, validation_error=np.array(grid_error(report)))
+    with open(report_path, "w") as file:
+        json.dump(report, file, indent=2)
+
+
+def _error_summary(pipeline, grid, df):
+    prices, found = lookup_prices(grid, df)
+    if not found.any():
+        return {"n_rows": len(df), "coverage": 0.0}
+
+    actual = pipeline.predict(df[found])
+    abs_error = np.abs(prices[found] - actual)
+    return {
+        "n_rows": len(df),
+        "coverage": float(found.mean()),
+        "mae": float(abs_error.mean()),
+        "rmse": float(np.sqrt((abs_error ** 2).mean())),
+        "p50_abs_error": float(np.percentile(abs_error, 50)),
+        "p95_abs_error": float(np.percentile(abs_error, 95)),
+        "p99_abs_error": float(np.percentile(abs_error, 99)),
+        "max_abs_error": float(abs_error.max()),
+        "p99_relative_error": float(np.percentile(abs_error / np.abs(actual), 99)),
+        "max_relative_error": float((abs_error / np.abs(actual)).max()),
+    }
@@ -0,0 +1,80 @@
+import io
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+try:
+    from modelling.common.storage import ObjectNotFound, as_storage, get_bytes
+except ModuleNotFoundError:  # Inside the Lambda package modelling/common is copied to ./common
+    from common.storage import ObjectNotFound, as_storage, get_bytes
+
+# Fixed schema of the processed datasets: dictionary-encoded categoricals and the narrowest numeric types that
+# hold the data exactly. Whole-dollar prices are exact in float32 (below 2**24), 1 decimal floor areas are not
+# (67.1 is 67.09999847 in float32), so they stay float64 and the model sees the same inputs as from the CSV
+CATEGORY_TYPE = pa.dictionary(pa.int16(), pa.string())
+COLUMN_TYPES = {
+    "month": pa.timestamp("ms"),  # Only in the month partitions of incremental processing
+    "town": CATEGORY_TYPE,
+    "flat_type": CATEGORY_TYPE,
+    "flat_model_revised": CATEGORY_TYPE,
+    "flat_age_years": pa.int16(),
+    "floor_area_sqm": pa.float64(),
+    "days_from_earliest_data": pa.int32(),
+    "storey_range_grouped": CATEGORY_TYPE,
+    "resale_price": pa.float32(),
+}
+PARQUET_COMPRESSION = "zstd"
+
+
+def to_processed_table(df):
+    """Arrow table of a processed DataFrame, cast to the fixed schema (raises if a value does not fit)"""
+    schema = pa.schema([(name, COLUMN_TYPES[name]) for name in df.columns])
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    # Categoricals are cast through plain strings so every file gets its own dictionary with the same index type
+    columns = [column.cast(pa.string()) if pa.types.is_dictionary(column.type) else column for column in table.columns]
+
+    return pa.Table.from_arrays(columns, names=table.column_names).cast(schema)
+
+
+def processed_to_parquet(df):
+    """Parquet bytes of a processed DataFrame"""
+    buffer = io.BytesIO()
+    pq.write_table(to_processed_table(df), buffer, compression=PARQUET_COMPRESSION)
+
+    return buffer.getvalue()
+
+
+def read_processed_parquet(source, columns=None):
+    """DataFrame from Parquet bytes or a path, only decoding `columns` if given. Categoricals come back as category"""
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+
+    return pq.read_table(source, columns=columns).to_pandas()
+
+
+def write_processed(storage, name, df, formats=("parquet",)):
+    """Write a processed dataset (e.g. name="train") to a storage or an S3 bucket resource as name.parquet and/or
+    name.csv"""
+    storage = as_storage(storage)
+    if "parquet" in formats:
+        storage.put(f"{name}.parquet", processed_to_parquet(df))
+    if "csv" in formats:
+        storage.put(f"{name}.csv", df.to_csv(index=False))
+
+
+def read_processed(storage, name, columns=None):
+    """Read a processed dataset from a storage (see storage.py) or an S3 bucket resource, the Parquet file if there is
+    one, else the CSV.
+
+    Goes through a low-level client, so several datasets can be read from threads at once.
+    """
+    storage = as_storage(storage)
+    try:
+        body = get_bytes(storage, f"{name}.parquet")
+    except ObjectNotFound:
+        print(f"No {name}.parquet, reading {name}.csv")
+        return pd.read_csv(io.BytesIO(get_bytes(storage, f"{name}.csv")), usecols=columns)
+
+    return read_processed_parquet(body, columns)
@@ -0,0 +1,38 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.config import Config
+
+# Objects downloaded at the same time, S3 latency rather than bandwidth dominates for our object sizes
+FETCH_CONCURRENCY = int(os.getenv("S3_FETCH_CONCURRENCY", "16"))
+
+
+def s3_config(concurrency=None):
+    """botocore Config with a connection pool big enough for `concurrency` parallel requests"""
+    return Config(max_pool_connections=max(10, concurrency or FETCH_CONCURRENCY),
+                  retries={"max_attempts": 5, "mode": "standard"})
+
+
+def map_concurrently(fn, items, concurrency=None):
+    """fn(item) for every item on a thread pool, results in the order of items. The first exception is raised"""
+    items = list(items)
+    concurrency = min(concurrency or FETCH_CONCURRENCY, len(items))
+    if concurrency <= 1:
+        return [fn(item) for item in items]
+
+    with ThreadPoolExecutor(concurrency, thread_name_prefix="s3-fetch") as pool:
+        return list(pool.map(fn, items))
+
+
+def fetch_objects(bucket, keys, parse=None, concurrency=None):
+    """Download objects of a boto3 Bucket resource in parallel, returning parse(key, data) (or the bytes) per key.
+
+    Requests go through the bucket's low-level client, which unlike the resource is safe to share between threads.
+    """
+    client = bucket.meta.client
+
+    def fetch(key):
+        data = client.get_object(Bucket=bucket.name, Key=key)["Body"].read()
+        return parse(key, data) if parse else data
+
+    return map_concurrently(fetch, keys, concurrency)
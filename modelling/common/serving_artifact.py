@@ -0,0 +1,110 @@
+import numpy as np
+
+# Bump when the layout of the arrays below changes, app/fastapi_app/fast_inference.py checks it on load
+SERVING_ARTIFACT_FORMAT_VERSION = 1
+
+
+def round_down_to_float32(threshold):
+    """Largest float32 <= each float64 threshold.
+
+    Trees compare float32 inputs against float64 thresholds, so for any float32 x
+    `x <= threshold` and `x <= round_down_to_float32(threshold)` always agree.
+    """
+    threshold_32 = threshold.astype(np.float32)
+    too_high = threshold_32.astype(np.float64) > threshold
+    threshold_32[too_high] = np.nextafter(threshold_32[too_high], np.float32(-np.inf))
+
+    return threshold_32
+
+
+def pipeline_to_arrays(pipeline, leaf_dtype=np.float64):
+    """Flatten a fitted Pipeline(preprocessor=ColumnTransformer, reg=forest regressor) into plain numpy arrays.
+
+    This is the only flattening of the champion: the serving artifact is these arrays as written, and
+    app/fastapi_app/fast_inference.py compiles a joblib Pipeline through this function too.
+    """
+    preprocessor = pipeline.named_steps["preprocessor"]
+    regressor = pipeline.named_steps["reg"]
+    arrays = {}
+
+    # Scaler parameters and the output column of every numeric feature
+    numeric_features, numeric_columns, scaler_mean, scaler_scale = [], [], [], []
+    categorical_features, category_offsets = [], []
+    for name, transformer, columns in preprocessor.transformers_:
+        if transformer == "drop" or len(columns) == 0:
+            continue
+        step = _single_step(transformer)
+        start = preprocessor.output_indices_[name].start
+        if type(step).__name__ == "StandardScaler":
+            numeric_features += list(columns)
+            numeric_columns += list(range(start, start + len(columns)))
+            scaler_mean += list(step.mean_ if step.mean_ is not None else np.zeros(len(columns)))
+            scaler_scale += list(step.scale_ if step.scale_ is not None else np.ones(len(columns)))
+        elif type(step).__name__ == "OneHotEncoder":
+            if step.drop is not None or step._infrequent_enabled or step.handle_unknown != "ignore":
+                raise ValueError("Only OneHotEncoder(handle_unknown='ignore') without drop/infrequent categories is supported")
+            # Encoder vocabularies, each category maps to column category_offsets[i] + its position
+            for column, categories in zip(columns, step.categories_):
+                arrays[f"categories_{len(categorical_features)}"] = np.asarray(categories, dtype=str)
+                categorical_features.append(column)
+                category_offsets.append(start)
+                start += len(categories)
+        else:
+            raise ValueError(f"Unsupported transformer in step '{name}': {type(step).__name__}")
+
+    if not hasattr(regressor, "estimators_") or regressor.n_outputs_ != 1:
+        raise ValueError(f"Unsupported regressor: {type(regressor).__name__}")
+
+    arrays.update({
+        "format_version": np.array(SERVING_ARTIFACT_FORMAT_VERSION),
+        "numeric_features": np.asarray(numeric_features, dtype=str),
+        "numeric_columns": np.asarray(numeric_columns, dtype=np.int32),
+        "scaler_mean": np.asarray(scaler_mean, dtype=np.float64),
+        "scaler_scale": np.asarray(scaler_scale, dtype=np.float64),
+        "categorical_features": np.asarray(categorical_features, dtype=str),
+        "category_offsets": np.asarray(category_offsets, dtype=np.int32),
+        "n_features": np.array(max(indices.stop for indices in preprocessor.output_indices_.values())),
+    })
+    arrays.update(_flatten_trees([tree.tree_ for tree in regressor.estimators_], leaf_dtype))
+
+    return arrays
+
+
+def export_serving_artifact(pipeline, path, leaf_dtype=np.float64, compress=False):
+    """Write the serving artifact (.npz) that the FastAPI app loads without sklearn, zip-compressed if compress"""
+    arrays = pipeline_to_arrays(pipeline, leaf_dtype)
+    with open(path, "wb") as file:
+        (np.savez_compressed if compress else np.savez)(file, **arrays)
+
+    return path
+
+
+def _single_step(transformer):
+    # ColumnTransformer steps are single-step Pipelines in hyperparam_search.define_pipeline
+    if hasattr(transformer, "steps"):
+        if len(transformer.steps) != 1:
+            raise ValueError("Only single-step transformer pipelines are supported")
+        return transformer.steps[0][1]
+    return transformer
+
+
+def _flatten_trees(trees, leaf_dtype):
+    # Concatenate the node arrays of all trees, children point at global node ids and leaves point at themselves
+    sizes = np.array([tree.node_count for tree in trees])
+    roots = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    node_ids = np.arange(sizes.sum())
+
+    children_left = np.concatenate([tree.children_left for tree in trees])
+    children_right = np.concatenate([tree.children_right for tree in trees])
+    is_leaf = children_left == -1
+    offsets = np.repeat(roots, sizes)
+
+    return {
+        "feature": np.where(is_leaf, 0, np.concatenate([tree.feature for tree in trees])).astype(np.int32),
+        "threshold": round_down_to_float32(np.concatenate([tree.threshold for tree in trees])),
+        "children_left": np.where(is_leaf, node_ids, children_left + offsets).astype(np.int32),
+        "children_right": np.where(is_leaf, node_ids, children_right + offsets).astype(np.int32),
+        "leaf_value": np.concatenate([tree.value[:, 0, 0] for tree in trees]).astype(leaf_dtype),
+        "roots": roots.astype(np.int32),
+        "max_depth": np.array(max(tree.max_depth for tree in trees)),
+    }
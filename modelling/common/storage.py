@@ -0,0 +1,248 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+import boto3
+from botocore.exceptions import ClientError
+
+try:
+    from modelling.common.s3_fetch import s3_config
+except ModuleNotFoundError:  # Inside the Lambda package modelling/common is copied to ./common
+    from common.s3_fetch import s3_config
+
+# "s3", or "local" to read and write buckets as directories under LOCAL_STORAGE_DIR for offline development
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "s3")
+LOCAL_STORAGE_DIR = os.getenv("LOCAL_STORAGE_DIR", "./local_storage")
+
+# Downloaded objects are kept here and revalidated by ETag on every read, so jobs sharing a machine (or a warm Lambda
+# container's /tmp) only download what changed. The default size leaves room in Lambda's 512 MB of /tmp, 0 turns
+# the cache off
+ARTIFACT_CACHE_DIR = os.getenv("ARTIFACT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "hdb-artifact-cache"))
+ARTIFACT_CACHE_MAX_BYTES = int(float(os.getenv("ARTIFACT_CACHE_MAX_GB", "0.25")) * 1024 ** 3)
+
+COPY_BUFFER_BYTES = 1024 * 1024
+
+
+class ObjectNotFound(Exception):
+    pass
+
+
+class S3Storage:
+    """Objects of one S3 bucket"""
+
+    def __init__(self, bucket_name, client=None):
+        self.name = bucket_name
+        # Low-level clients, unlike resources, can be shared between threads
+        self.client = client or boto3.client("s3", region_name="ap-southeast-1", config=s3_config())
+
+    def get(self, key, if_none_match=None):
+        """(streaming body, ETag) of an object, with a None body if its ETag is still if_none_match"""
+        try:
+            response = self.client.get_object(Bucket=self.name, Key=key, **({"IfNoneMatch": if_none_match}
+                                                                           if if_none_match else {}))
+        except self.client.exceptions.NoSuchKey as error:
+            raise ObjectNotFound(f"s3://{self.name}/{key}") from error
+        except ClientError as error:
+            code = error.response["Error"]["Code"]
+            if code in ("304", "NotModified"):
+                return None, if_none_match
+            if code == "404":
+                raise ObjectNotFound(f"s3://{self.name}/{key}") from error
+            raise
+
+        return response["Body"], response["ETag"]
+
+    def put(self, key, body):
+        return self.client.put_object(Bucket=self.name, Key=key, Body=body)["ETag"]
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.name, Key=key)
+
+    def list(self, prefix=""):
+        """Keys of the objects under a prefix"""
+        pages = self.client.get_paginator("list_objects_v2").paginate(Bucket=self.name, Prefix=prefix)
+        return sorted(obj["Key"] for page in pages for obj in page.get("Contents", []))
+
+
+class LocalStorage:
+    """Objects as files under a directory, with S3-style ETags (MD5 of the content)"""
+
+    def __init__(self, directory):
+        self.name = os.path.basename(os.path.normpath(directory))
+        self.directory = directory
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def etag(self, key):
+        hasher = hashlib.md5()
+        with open(self.path(key), "rb") as file:
+            for block in iter(lambda: file.read(COPY_BUFFER_BYTES), b""):
+                hasher.update(block)
+
+        return f'"{hasher.hexdigest()}"'
+
+    def get(self, key, if_none_match=None):
+        try:
+            etag = self.etag(key)
+        except FileNotFoundError as error:
+            raise ObjectNotFound(self.path(key)) from error
+        if etag == if_none_match:
+            return None, etag
+
+        return open(self.path(key), "rb"), etag
+
+    def put(self, key, body):
+        os.makedirs(os.path.dirname(self.path(key)), exist_ok=True)
+        with open(self.path(key), "wb") as file:
+            file.write(body.encode() if isinstance(body, str) else body)
+
+        return self.etag(key)
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def list(self, prefix=""):
+        keys = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                key = os.path.relpath(os.path.join(root, name), self.directory).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    keys.append(key)
+
+        return sorted(keys)
+
+
+class CachedStorage:
+    """Read-through local disk cache in front of a storage backend.
+
+    Each read of a cached object is a conditional GET on its ETag, so only changed objects are downloaded. The least
+    recently used objects are evicted once the cache is bigger than max_bytes.
+    """
+
+    def __init__(self, backend, cache_dir=ARTIFACT_CACHE_DIR, max_bytes=ARTIFACT_CACHE_MAX_BYTES):
+        self.backend = backend
+        self.name = backend.name
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "downloaded_bytes": 0, "evictions": 0}
+        self.lock = threading.Lock()
+
+    def cache_path(self, key):
+        return os.path.join(self.cache_dir, self.backend.name, key)
+
+    def path(self, key):
+        """Local path of an up to date copy of an object"""
+        path = self.cache_path(key)
+        try:
+            with open(path + ".etag") as file:
+                cached_etag = file.read() if os.path.exists(path) else None
+        except FileNotFoundError:
+            cached_etag = None
+
+        body, etag = self.backend.get(key, if_none_match=cached_etag)
+        if body is None:
+            try:
+                os.utime(path)  # Recently used, for eviction
+                self.count(hits=1)
+                return path
+            except FileNotFoundError:  # Evicted by another reader since its ETag was read, download it again
+                body, etag = self.backend.get(key)
+
+        # Written next to the final path and renamed, so other readers never see a partial file
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with body, tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as file:
+            shutil.copyfileobj(body, file, COPY_BUFFER_BYTES)
+        os.replace(file.name, path)
+        with open(path + ".etag", "w") as file:
+            file.write(etag)
+        self.count(misses=1, downloaded_bytes=os.path.getsize(path))
+        self.evict(keep=path)
+
+        return path
+
+    def get_bytes(self, key):
+        with open(self.path(key), "rb") as file:
+            return file.read()
+
+    def put(self, key, body):
+        return self.backend.put(key, body)
+
+    def delete(self, key):
+        self.backend.delete(key)
+        for path in (self.cache_path(key) + ".etag", self.cache_path(key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def list(self, prefix=""):
+        return self.backend.list(prefix)
+
+    def count(self, **increments):
+        with self.lock:
+            for name, increment in increments.items():
+                self.stats[name] += increment
+
+    def evict(self, keep=None):
+        # Least recently used objects first, until the cache fits in max_bytes
+        cached = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                if not name.endswith(".etag") and os.path.exists(path + ".etag"):
+                    stat = os.stat(path)
+                    cached.append((stat.st_mtime, stat.st_size, path))
+
+        total_bytes = sum(size for _, size, _ in cached)
+        for _, size, path in sorted(cached):
+            if total_bytes <= self.max_bytes:
+                break
+            if path != keep:
+                for stale_path in (path + ".etag", path):
+                    try:
+                        os.remove(stale_path)
+                    except FileNotFoundError:  # Already evicted by another reader
+                        pass
+                total_bytes -= size
+                self.count(evictions=1)
+
+
+def as_storage(bucket):
+    """Storage of a boto3 Bucket resource, or the storage itself"""
+    if isinstance(bucket, (S3Storage, LocalStorage, CachedStorage)):
+        return bucket
+
+    return S3Storage(bucket.name, bucket.meta.client)
+
+
+def get_bytes(storage, key):
+    """Content of an object in any storage"""
+    if isinstance(storage, CachedStorage):
+        return storage.get_bytes(key)
+
+    body, _ = storage.get(key)
+    with body:
+        return body.read()
+
+
+def print_cache_stats(*storages):
+    for storage in storages:
+        if isinstance(storage, CachedStorage):
+            print(f"Artifact cache for {storage.name}: {storage.stats}")
+
+
+def open_storage(bucket_name, cached=True):
+    """Storage of a bucket for the configured backend, behind the local cache unless cached=False"""
+    if STORAGE_BACKEND == "local":
+        return LocalStorage(os.path.join(LOCAL_STORAGE_DIR, bucket_name))
+    if STORAGE_BACKEND != "s3":
+        raise ValueError(f"Unknown storage backend: {STORAGE_BACKEND}")
+
+    storage = S3Storage(bucket_name)
+    return CachedStorage(storage) if cached and ARTIFACT_CACHE_MAX_BYTES > 0 else storage
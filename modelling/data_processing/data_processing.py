@@ -1,36 +1,85 @@
+import functools
+import hashlib
+import io
+import json
+import os
+
 import pandas as pd
 import boto3
 
+try:
+    from modelling.common.processed_data import processed_to_parquet, read_processed_parquet, write_processed
+    from modelling.common.s3_fetch import fetch_objects, map_concurrently, s3_config
+    from modelling.data_processing.stage_cache import StageCache, input_fingerprint, run_stages
+except ModuleNotFoundError:  # Inside the Lambda package modelling/common is copied to ./common
+    from common.processed_data import processed_to_parquet, read_processed_parquet, write_processed
+    from common.s3_fetch import fetch_objects, map_concurrently, s3_config
+    from stage_cache import StageCache, input_fingerprint, run_stages
+
+PROCESSED_BUCKET = 'hdb-resale-pred-processed'
+
+# "pandas" or "polars" (needs polars installed), both give identical outputs
+PROCESSING_ENGINE = os.getenv("PROCESSING_ENGINE", "pandas")
+
+# Rows per chunk when streaming the raw files in full mode with the pandas engine, 0 reads each file whole
+INGEST_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", "100000"))
+
+# "on" keeps the output of every full mode stage in the processed bucket, so a rerun on unchanged raw files and code
+# starts from the last stage it has cached. "off" always processes from scratch
+STAGE_CACHE = os.getenv("STAGE_CACHE", "on")
+
+# Formats of train/test/retrain_test, "parquet,csv" also writes the CSVs for anything still reading them
+OUTPUT_FORMATS = os.getenv("PROCESSED_OUTPUT_FORMATS", "parquet").split(",")
+
+# Incremental mode keeps one processed Parquet file per month under this prefix, with a manifest of what they were
+# built from. Bump the manifest version when the partition layout changes, older stores are then rebuilt
+PARTITION_PREFIX = 'partitions/'
+MANIFEST_KEY = PARTITION_PREFIX + 'manifest.json'
+MANIFEST_VERSION = 3
+
+RAW_COLUMNS = {"month", "town", "flat_type", "block", "street_name", "storey_range", "flat_model", "lease_commence_date", "floor_area_sqm", "remaining_lease", "resale_price"}
+OUTPUT_COLUMNS = ['month', 'town', 'flat_type', 'flat_model_revised', 'flat_age_years', 'floor_area_sqm',
+                  'days_from_earliest_data', 'storey_range_grouped', 'resale_price']
+CATEGORICAL_COLUMNS = ['town', 'flat_type', 'flat_model_revised']
+
 
 def connect_to_s3():
     # Setting up AWS connection
-    s3_input = boto3.resource('s3', region_name='ap-southeast-1')
+    s3_input = boto3.resource('s3', region_name='ap-southeast-1', config=s3_config())
     input_bucket = s3_input.Bucket('hdb-resale-pred-raw')
     
     return input_bucket
 
-def load_concat_df(input_bucket):
-    # Load data
-    df_list = []
-    for obj in input_bucket.objects.all():
-        body = obj.get()['Body']
+def raw_objects(input_bucket):
+    # Raw CSVs: the historical files and the per-month objects the puller writes (not its manifest)
+    return [obj for obj in input_bucket.objects.all() if obj.key.endswith('.csv')]
 
-        df = pd.read_csv(body, dtype=str)
-        df_list.append(df)
+def load_concat_df(input_bucket):
+    # Load data, downloading and parsing the files in parallel
+    keys = [obj.key for obj in raw_objects(input_bucket)]
+    df_list = fetch_objects(input_bucket, keys, parse=lambda key, data: pd.read_csv(io.BytesIO(data), dtype=str))
         
     print(len(df_list), "files loaded from S3")
 
     # Combine dataframes into a single dataframe
     df_all = pd.concat(df_list, ignore_index=True, sort=False)
+    check_raw_df(df_all)
     
+    return df_all 
+
+def check_raw_df(df_all):
     # Check that the variables are consistent with previous runs
-    assert set(df_all.columns) == {"month", "town", "flat_type", "block", "street_name", "storey_range", "flat_model", "lease_commence_date", "floor_area_sqm", "remaining_lease", "resale_price"}, "Different columns in freshly pulled data"
-    
+    assert set(df_all.columns) == RAW_COLUMNS, "Different columns in freshly pulled data"
+    check_raw_part(df_all)
+
+def check_raw_part(df):
+    # Checks that hold for every file or chunk on its own. Not every file has every column (the 2012-2014 data has
+    # no remaining_lease), so the full column set is only checked on the combined data
+    assert set(df.columns) <= RAW_COLUMNS, "Unexpected columns in freshly pulled data"
+
     # Check no missing values in key columns
     key_cols = ['month', 'town', 'flat_type', 'storey_range', 'flat_model', 'lease_commence_date', 'floor_area_sqm', 'resale_price']
-    assert df_all[key_cols].isnull().sum().sum() == 0, "Missing values in key columns"
-    
-    return df_all 
+    assert df[key_cols].isnull().sum().sum() == 0, "Missing values in key columns"
 
 def convert_variable_type(df_all):
     # Convert variables to appropriate types
@@ -60,12 +109,21 @@ def clean_flat_model(df_all):
 
 
 def categorise_stories(df_all):
+    df_all = group_storeys(df_all)
+    print_storey_summary(df_all)
+
+    return df_all
+
+def group_storeys(df_all):
     # group every 15 storeys since a part of the data groups every 5 floors, while another groups every 3 floors
     df_all['storey_max'] = df_all['storey_range'].str.slice(-2, None).astype(int)
     df_all['storey_range_grouped'] = pd.cut(df_all['storey_max'], 
                                             bins=[0, 15, 30, 99], 
                                             labels=["1-15", "16-30", "31+"])
 
+    return df_all
+
+def print_storey_summary(df_all):
     # Group by storey_range_grouped to check the results
     storey_summary = df_all.groupby('storey_range_grouped')['storey_max'].agg([
         ('min_storey', 'min'),
@@ -74,8 +132,6 @@ def categorise_stories(df_all):
     ]).reset_index().sort_values('storey_range_grouped')
     print("Min max storeys in storey group:", storey_summary)
 
-    return df_all
-
 
 def convert_to_title_case(df_all):
     # Convert to title case for town, flat type and flat model
@@ -87,22 +143,82 @@ def convert_to_title_case(df_all):
 
 # TODO: Other factors to KIV: Distance from MRT/amenities, lease years left, supply and demand of surrounding areas
 
+def load_engine(name):
+    # Polars is only imported when selected, so the pandas engine does not need it installed
+    if name == "pandas":
+        return None
+    if name == "polars":
+        try:
+            from modelling.data_processing import polars_engine
+        except ModuleNotFoundError:  # Inside the Lambda package the module sits next to this one
+            import polars_engine
+        return polars_engine
+    raise ValueError(f"Unknown processing engine: {name}")
+
+def process_raw_df(df_all):
+    # Full processing chain from raw strings to model features
+    df_all = convert_variable_type(df_all)
+    df_all = calculate_time_variables(df_all)
+    df_all = clean_flat_model(df_all)
+    df_all = categorise_stories(df_all)
+    df_all = convert_to_title_case(df_all)
+
+    return df_all
+
+def load_process_streaming(input_bucket, chunk_rows=INGEST_CHUNK_ROWS):
+    """Read, check and process the raw files chunk by chunk, keeping only a compact copy of each processed chunk.
+
+    Every transformation is row by row, so the result has the same rows and values as processing the whole history
+    at once, while peak memory is bounded by the chunk size and the compact output rather than the raw files.
+    """
+    def process_object(key):
+        chunks, columns = [], set()
+        body = input_bucket.meta.client.get_object(Bucket=input_bucket.name, Key=key)['Body']
+        for chunk in pd.read_csv(body, dtype=str, chunksize=chunk_rows):
+            check_raw_part(chunk)
+            columns |= set(chunk.columns)
+            chunk = convert_variable_type(chunk)
+            chunk = calculate_time_variables(chunk)
+            chunk = clean_flat_model(chunk)
+            chunk = group_storeys(chunk)
+            chunk = convert_to_title_case(chunk)
+            chunks.append(compact_chunk(chunk))
+        return chunks, columns
+
+    # Files are streamed in parallel, so peak memory grows with the fetch concurrency times the chunk size
+    keys = [obj.key for obj in raw_objects(input_bucket)]
+    results = map_concurrently(process_object, keys)
+
+    print(len(keys), "files loaded from S3")
+    assert set().union(*(columns for _, columns in results)) == RAW_COLUMNS, "Different columns in freshly pulled data"
+    df_all = concat_compact([chunk for chunks, _ in results for chunk in chunks])
+    print_storey_summary(df_all)
+
+    return df_all
+
+def compact_chunk(df):
+    # Only the output columns, with strings as categoricals (a small integer code per row instead of a Python string)
+    df = df[OUTPUT_COLUMNS + ['storey_max']].copy()
+    df[CATEGORICAL_COLUMNS] = df[CATEGORICAL_COLUMNS].astype('category')
+    df['storey_max'] = df['storey_max'].astype('int8')
+
+    return df
+
+def concat_compact(chunks):
+    # Categoricals only stay categoricals through concat when every chunk has the same categories
+    for column in CATEGORICAL_COLUMNS:
+        categories = sorted(set().union(*(chunk[column].cat.categories for chunk in chunks)))
+        for chunk in chunks:
+            chunk[column] = chunk[column].cat.set_categories(categories)
+
+    return pd.concat(chunks, ignore_index=True, sort=False)
+
 def split_dataset(df_all):
     # Keep relevant columns
-    df_output = df_all[[
-        'month',
-        'town',
-        'flat_type',
-        'flat_model_revised',
-        'flat_age_years',
-        'floor_area_sqm',
-        'days_from_earliest_data',
-        'storey_range_grouped',
-        'resale_price'
-    ]]
+    df_output = df_all[OUTPUT_COLUMNS]
     
-    # Sort values by month
-    df_output = df_output.sort_values(by='month', ascending=True).reset_index(drop=True)
+    # Sort values by month, stable so rows keep their file order within a month
+    df_output = df_output.sort_values(by='month', ascending=True, kind='stable').reset_index(drop=True)
 
     # Split into train (anything before the latest month) and test (latest month available) sets
     latest_month = df_output['month'].max()
@@ -121,24 +237,169 @@ def print_missing_counts(df_list):
         missing_counts = df.isnull().sum(axis=0)
         print(f"DataFrame {df_list_names[i]} missing value counts:\n{missing_counts}\n")
 
+def connect_to_output_s3():
+    s3_output = boto3.resource('s3', region_name='ap-southeast-1', config=s3_config())
+    return s3_output.Bucket(PROCESSED_BUCKET)
+
 # Output to AWS S3
-def output_to_s3(train, test, retrain_test):
-    s3_output = boto3.resource('s3', region_name='ap-southeast-1')
-    output_bucket = s3_output.Bucket('hdb-resale-pred-processed')
-    output_bucket.put_object(Key='train.csv', Body=train.to_csv(index=False))
-    output_bucket.put_object(Key='test.csv', Body=test.to_csv(index=False))
-    output_bucket.put_object(Key='retrain_test.csv', Body=retrain_test.to_csv(index=False))
+def output_to_s3(train, test, retrain_test, output_bucket=None):
+    output_bucket = output_bucket or connect_to_output_s3()
+    write_processed(output_bucket, 'train', train, OUTPUT_FORMATS)
+    write_processed(output_bucket, 'test', test, OUTPUT_FORMATS)
+    write_processed(output_bucket, 'retrain_test', retrain_test, OUTPUT_FORMATS)
+
+# Incremental mode: only months that are new, or whose raw rows changed, are processed again
+def load_manifest(output_bucket):
+    # Raw object ETags seen on the last run, and for each processed month the hash of its raw rows per source object
+    try:
+        manifest = json.loads(output_bucket.Object(MANIFEST_KEY).get()['Body'].read())
+    except output_bucket.meta.client.exceptions.NoSuchKey:
+        manifest = {}
+
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {"version": MANIFEST_VERSION, "sources": {}, "months": {}}
+    return manifest
+
+def hash_raw_rows(df):
+    return hashlib.sha256(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes()).hexdigest()
+
+def partition_key(month):
+    return f"{PARTITION_PREFIX}month={month}.parquet"
+
+def read_raw_months(input_bucket, key):
+    # Raw rows of one source object, grouped by their month string (e.g. "2024-05")
+    body = input_bucket.meta.client.get_object(Bucket=input_bucket.name, Key=key)['Body']
+    df = pd.read_csv(body, dtype=str)
+    check_raw_part(df)
+
+    return {month: rows for month, rows in df.groupby('month', sort=True)}
+
+def read_raw_objects(input_bucket, keys):
+    # {key: raw rows by month} of several source objects, downloaded in parallel
+    return dict(zip(keys, map_concurrently(lambda key: read_raw_months(input_bucket, key), keys)))
+
+def find_dirty_months(manifest, source_etags, raw_months):
+    # A month is dirty if any changed or removed source object no longer has the same rows for it
+    changed_sources = {key for key, etag in source_etags.items() if manifest["sources"].get(key) != etag}
+    changed_sources |= set(manifest["sources"]) - set(source_etags)
+
+    dirty = set()
+    for month, info in manifest["months"].items():
+        for key, row_hash in info["sources"].items():
+            if key in changed_sources and (month not in raw_months.get(key, {}) or
+                                           hash_raw_rows(raw_months[key][month]) != row_hash):
+                dirty.add(month)
+    for key, months in raw_months.items():
+        for month, rows in months.items():
+            if manifest["months"].get(month, {}).get("sources", {}).get(key) != hash_raw_rows(rows):
+                dirty.add(month)
+
+    return dirty
+
+def update_partitions(input_bucket, output_bucket, manifest, engine="pandas"):
+    """Process the months that changed since the last run into their partitions.
+
+    Returns the updated manifest and the sorted list of months that were processed or removed.
+    """
+    source_etags = {obj.key: obj.e_tag for obj in raw_objects(input_bucket)}
+    changed_sources = [key for key, etag in source_etags.items() if manifest["sources"].get(key) != etag]
+    print(len(changed_sources), "of", len(source_etags), "raw files changed since the last run")
+    raw_months = read_raw_objects(input_bucket, changed_sources)
+    dirty = find_dirty_months(manifest, source_etags, raw_months)
+
+    # Dirty months also present in an unchanged source need its rows too (the raw files rarely share months)
+    unchanged_sources = {key for month in dirty for key in manifest["months"].get(month, {}).get("sources", {})
+                         if key in source_etags and key not in raw_months}
+    raw_months.update(read_raw_objects(input_bucket, sorted(unchanged_sources)))
+
+    months = {month: {"sources": {}, "rows": 0} for month in dirty}
+    dirty_rows = []
+    for key in sorted(raw_months):
+        for month, rows in raw_months[key].items():
+            if month in dirty:
+                months[month]["sources"][key] = hash_raw_rows(rows)
+                months[month]["rows"] += len(rows)
+                dirty_rows.append(rows)
+
+    if dirty_rows:
+        df_dirty = pd.concat(dirty_rows, ignore_index=True, sort=False)
+        polars_engine = load_engine(engine)
+        df_dirty = polars_engine.process_raw_pandas(df_dirty) if polars_engine else process_raw_df(df_dirty)
+        partitions = df_dirty.groupby(df_dirty['month'].dt.strftime('%Y-%m'))
+        map_concurrently(lambda partition: output_bucket.meta.client.put_object(
+            Bucket=output_bucket.name, Key=partition_key(partition[0]),
+            Body=processed_to_parquet(partition[1][OUTPUT_COLUMNS])), partitions)
+
+    # Months whose rows are all gone from the raw files are dropped
+    for month in dirty:
+        if months[month]["rows"] == 0:
+            output_bucket.Object(partition_key(month)).delete()
+            manifest["months"].pop(month, None)
+        else:
+            manifest["months"][month] = months[month]
+    manifest["sources"] = source_etags
+
+    # Partitions are written before the manifest, so an interrupted run is redone on the next one
+    output_bucket.put_object(Key=MANIFEST_KEY, Body=json.dumps(manifest, indent=2, sort_keys=True))
+    print(f"{len(dirty)} months processed, {len(manifest['months'])} months in the partition store")
+
+    return manifest, sorted(dirty)
+
+def load_partitions(output_bucket, manifest):
+    # Processed rows of every month in the manifest, in month order, downloaded in parallel
+    keys = [partition_key(month) for month in sorted(manifest["months"])]
+    df_list = fetch_objects(output_bucket, keys, parse=lambda key, data: read_processed_parquet(data))
+
+    return pd.concat(df_list, ignore_index=True, sort=False)
+
+def run_incremental(input_bucket, output_bucket, engine="pandas"):
+    manifest, processed_months = update_partitions(input_bucket, output_bucket, load_manifest(output_bucket), engine)
+    if not processed_months:
+        print("No new or changed months, outputs are up to date.")
+        return
+
+    train, test, retrain_test = split_dataset(load_partitions(output_bucket, manifest))
+
+    assert min(train.shape[0], test.shape[0], retrain_test.shape[0]) > 0, "One of the datasets is empty!"
+
+    print_missing_counts([train, test, retrain_test])
+    output_to_s3(train, test, retrain_test, output_bucket)
+
+def full_stages(engine="pandas", chunk_rows=INGEST_CHUNK_ROWS):
+    # (name, function) stages of full mode, the first takes the input bucket and each later one the previous output
+    polars_engine = load_engine(engine)
+    if polars_engine:
+        return [("polars_run_full", functools.partial(polars_engine.run_full, raw_columns=RAW_COLUMNS))]
+
+    if chunk_rows:
+        return [("load_process_streaming", functools.partial(load_process_streaming, chunk_rows=chunk_rows)),
+                ("split_dataset", split_dataset)]
+
+    return [(fn.__name__, fn) for fn in [load_concat_df, convert_variable_type, calculate_time_variables,
+                                         clean_flat_model, categorise_stories, convert_to_title_case, split_dataset]]
+
+def process_full(input_bucket, engine="pandas", chunk_rows=INGEST_CHUNK_ROWS, cache=None):
+    # Whole history from the raw files to the train/test/retrain_test split, from the last cached stage if given a
+    # StageCache
+    input_key = input_fingerprint(raw_objects(input_bucket)) if cache else None
+
+    return run_stages(full_stages(engine, chunk_rows), input_bucket, cache, input_key)
 
 # These should be under "def lambda_handler(event, context)" if using AWS Lambda
 def lambda_handler(event, context):
+    # "full" reprocesses the whole history, "incremental" only new or changed months
+    mode = (event or {}).get("mode") or os.getenv("PROCESSING_MODE", "full")
+    engine = (event or {}).get("engine") or PROCESSING_ENGINE
     input_bucket = connect_to_s3()
-    df_all = load_concat_df(input_bucket)
-    df_all = convert_variable_type(df_all)
-    df_all = calculate_time_variables(df_all)
-    df_all = clean_flat_model(df_all)
-    df_all = categorise_stories(df_all)
-    df_all = convert_to_title_case(df_all)
-    train, test, retrain_test = split_dataset(df_all)
+
+    if mode == "incremental":
+        run_incremental(input_bucket, connect_to_output_s3(), engine)
+        print("Data processing complete.")
+        return
+
+    stage_cache = (event or {}).get("stage_cache") or STAGE_CACHE
+    cache = StageCache(connect_to_output_s3()) if stage_cache == "on" else None
+    train, test, retrain_test = process_full(input_bucket, engine, cache=cache)
     
     assert min(train.shape[0], test.shape[0], retrain_test.shape[0]) > 0, "One of the datasets is empty!"
 
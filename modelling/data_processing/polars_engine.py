@@ -0,0 +1,125 @@
+import polars as pl
+
+try:
+    from modelling.common.s3_fetch import fetch_objects
+except ModuleNotFoundError:  # Inside the Lambda package modelling/common is copied to ./common
+    from common.s3_fetch import fetch_objects
+
+# Strings pandas.read_csv reads as missing by default, so both engines see the same nulls
+PANDAS_NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>',
+                    'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+NUMERIC_COLUMNS = ['resale_price', 'lease_commence_date', 'floor_area_sqm']
+TITLE_CASE_COLUMNS = ['town', 'flat_type', 'flat_model_revised']
+STOREY_GROUPS = pl.Enum(["1-15", "16-30", "31+"])
+OUTPUT_COLUMNS = ['month', 'town', 'flat_type', 'flat_model_revised', 'flat_age_years', 'floor_area_sqm',
+                  'days_from_earliest_data', 'storey_range_grouped', 'resale_price']
+
+
+def scan_raw_objects(input_bucket):
+    # Raw files as all-string frames, like pd.read_csv(dtype=str), combined lazily by column name so columns that
+    # are not needed (block, street_name, remaining_lease) are never parsed. Only CSVs, as in raw_objects
+    keys = [obj.key for obj in input_bucket.objects.all() if obj.key.endswith('.csv')]
+    frames = [pl.scan_csv(data, infer_schema=False, null_values=PANDAS_NA_VALUES)
+              for data in fetch_objects(input_bucket, keys)]
+    print(len(frames), "files loaded from S3")
+
+    return pl.concat(frames, how="diagonal")
+
+def process_raw_lazy(raw):
+    """Same transformations as the pandas engine, as one lazy query"""
+    earliest_date = pl.date(2012, 3, 1)
+    storey_max = pl.col('storey_range').str.slice(-2).cast(pl.Int64)
+
+    return raw.with_columns(
+        [pl.col(name).cast(pl.Float64, strict=False) for name in NUMERIC_COLUMNS] +
+        [pl.col('month').str.to_date('%Y-%m'),
+         pl.when(pl.col('flat_model').str.contains('Maisonette', literal=True))
+           .then(pl.lit('Maisonette')).otherwise(pl.col('flat_model')).alias('flat_model_revised'),
+         storey_max.alias('storey_max')]
+    ).with_columns(
+        flat_age_years=pl.col('month').dt.year() - pl.col('lease_commence_date'),
+        days_from_earliest_data=(pl.col('month') - earliest_date).dt.total_days(),
+        # Same bins as pd.cut(bins=[0, 15, 30, 99]), anything outside them is null
+        storey_range_grouped=pl.when(pl.col('storey_max').is_between(1, 15)).then(pl.lit('1-15'))
+                               .when(pl.col('storey_max').is_between(16, 30)).then(pl.lit('16-30'))
+                               .when(pl.col('storey_max').is_between(31, 99)).then(pl.lit('31+'))
+                               .cast(STOREY_GROUPS),
+    )
+
+def integer_flags(raw):
+    # pd.to_numeric only returns integers when every value parses as one, mirror that per column
+    return raw.select([pl.col(name).str.to_integer(strict=False).is_not_null().all().alias(name)
+                       for name in NUMERIC_COLUMNS])
+
+def finalise_types(df, flags):
+    # Title case with Python's str.title (as pandas does) on the few unique values rather than polars' own rules
+    df = df.with_columns([
+        pl.col(name).replace_strict({value: value.title() for value in df[name].unique().drop_nulls()},
+                                    default=None)
+        for name in TITLE_CASE_COLUMNS
+    ])
+
+    casts = {name: pl.Int64 for name in ['resale_price', 'floor_area_sqm'] if flags[name]}
+    if flags['lease_commence_date']:
+        casts['flat_age_years'] = pl.Int64
+    return df.with_columns([pl.col(name).cast(dtype) for name, dtype in casts.items()]).with_columns(
+        pl.col('month').cast(pl.Datetime('ns'))
+    )
+
+def print_storey_summary(df):
+    storey_summary = df.group_by('storey_range_grouped').agg(
+        pl.col('storey_max').min().alias('min_storey'),
+        pl.col('storey_max').max().alias('max_storey'),
+        pl.col('storey_max').count().alias('counts')
+    ).sort('storey_range_grouped')
+    print("Min max storeys in storey group:", storey_summary)
+
+def process_raw(raw, raw_columns):
+    """Processed rows (OUTPUT_COLUMNS) of a lazy raw frame, with the pandas engine's dtypes.
+
+    Runs the same checks as check_raw_df in the pandas engine, in the same pass over the data.
+    """
+    assert set(raw.collect_schema().names()) == raw_columns, "Different columns in freshly pulled data"
+    key_cols = ['month', 'town', 'flat_type', 'storey_range', 'flat_model', 'lease_commence_date', 'floor_area_sqm', 'resale_price']
+
+    # The streaming engine parses the raw files in batches rather than all at once
+    processed, flags, null_counts = pl.collect_all([process_raw_lazy(raw).select(OUTPUT_COLUMNS + ['storey_max']),
+                                                    integer_flags(raw),
+                                                    raw.select(pl.col(key_cols).null_count())], engine="streaming")
+    assert null_counts.sum_horizontal().item() == 0, "Missing values in key columns"
+    print_storey_summary(processed)
+
+    return finalise_types(processed.drop('storey_max'), flags.row(0, named=True))
+
+def process_raw_pandas(df_raw):
+    """Polars processing of an all-string pandas frame of raw rows, for the incremental mode"""
+    raw = pl.from_pandas(df_raw.astype(object).where(df_raw.notna(), None)).lazy()
+
+    return to_pandas(process_raw(raw, set(df_raw.columns)))
+
+def split_dataset(df_output):
+    """Month-based train/test/retrain_test split of the pandas engine, as pandas frames"""
+    # Sort values by month, keeping the file order within a month like the pandas engine's stable sort
+    df_output = df_output.sort('month', maintain_order=True)
+
+    # Split into train (anything before the latest month) and test (latest month available) sets
+    latest_month, month_before_latest_month = df_output.select(
+        pl.col('month').max(), pl.col('month').max().dt.offset_by('-1mo').alias('month_before')
+    ).row(0)
+    print("Month before latest month:", month_before_latest_month)
+    train = df_output.filter(pl.col('month') < month_before_latest_month).drop('month')
+    test = df_output.filter(pl.col('month') == month_before_latest_month).drop('month')
+    retrain_test = df_output.filter(pl.col('month') == latest_month).drop('month')
+    print(f"Train set: {train.shape}, Test set: {test.shape}, Retrain test set: {retrain_test.shape}")
+
+    return tuple(to_pandas(df) for df in (train, test, retrain_test))
+
+def to_pandas(df):
+    # pd.cut gives an ordered categorical, the Enum converts to an unordered one
+    df = df.to_pandas()
+    df['storey_range_grouped'] = df['storey_range_grouped'].cat.as_ordered()
+
+    return df
+
+def run_full(input_bucket, raw_columns):
+    return split_dataset(process_raw(scan_raw_objects(input_bucket), raw_columns))
@@ -0,0 +1,193 @@
+import functools
+import hashlib
+import inspect
+import io
+import json
+import os
+import time
+import types
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+try:
+    from modelling.common.s3_fetch import fetch_objects
+except ModuleNotFoundError:  # Inside the Lambda package modelling/common is copied to ./common
+    from common.s3_fetch import fetch_objects
+
+# Outputs of the full mode processing stages are kept in the processed bucket under this prefix, keyed on a hash of
+# the raw objects' ETags and the code of every stage up to and including that one. Entries are evicted once they
+# have not been used for STAGE_CACHE_MAX_AGE_DAYS, and least recently used first beyond STAGE_CACHE_MAX_GB
+CACHE_PREFIX = os.getenv("STAGE_CACHE_PREFIX", "stage-cache/")
+MAX_BYTES = int(float(os.getenv("STAGE_CACHE_MAX_GB", "2")) * 1024 ** 3)
+MAX_AGE_DAYS = float(os.getenv("STAGE_CACHE_MAX_AGE_DAYS", "14"))
+
+# Bump when the stored layout changes, every existing entry then misses
+CACHE_VERSION = 1
+# Arrow IPC with LZ4 is much faster to write and read back than Parquet, at a slightly larger size
+IPC_OPTIONS = pa.ipc.IpcWriteOptions(compression="lz4")
+
+
+def to_json(value):
+    # Deterministic JSON of constants and arguments, sets sorted (their order changes between interpreters)
+    return json.dumps(value, sort_keys=True, default=lambda v: sorted(v) if isinstance(v, (set, frozenset)) else repr(v))
+
+def referenced_names(code):
+    # Global names used by a code object and the functions, lambdas and comprehensions nested in it
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= referenced_names(const)
+
+    return names
+
+def code_version(fn):
+    """Hash of the source of a stage function, the functions of its module it calls (directly or not) and the module
+    constants they read. A functools.partial also hashes its arguments"""
+    parts = []
+    if isinstance(fn, functools.partial):
+        parts.append(to_json([fn.args, fn.keywords]))
+        fn = fn.func
+
+    seen, pending = set(), [fn]
+    while pending:
+        function = pending.pop()
+        if function.__name__ in seen:
+            continue
+        seen.add(function.__name__)
+        parts.append(inspect.getsource(function))
+        for name in sorted(referenced_names(function.__code__)):
+            value = function.__globals__.get(name)
+            if isinstance(value, types.FunctionType) and value.__module__ == fn.__module__:
+                pending.append(value)
+            elif isinstance(value, (str, int, float, list, tuple, set, dict)) and name.isupper():
+                parts.append(f"{name}={to_json(value)}")
+
+    return hashlib.sha256("\n".join(sorted(parts)).encode()).hexdigest()
+
+def input_fingerprint(objects):
+    # The raw objects (boto3 ObjectSummary) by their ETags, which change whenever an object's content does
+    sources = sorted((obj.key, obj.e_tag) for obj in objects)
+
+    return hashlib.sha256(json.dumps([CACHE_VERSION, pd.__version__, sources]).encode()).hexdigest()
+
+def stage_keys(input_key, stages):
+    # Each key chains on the previous one, so a changed stage also invalidates every stage after it
+    keys = []
+    for name, fn in stages:
+        input_key = hashlib.sha256(f"{input_key}:{name}:{code_version(fn)}".encode()).hexdigest()
+        keys.append(input_key)
+
+    return keys
+
+def frame_to_ipc(df):
+    table = pa.Table.from_pandas(df)
+    buffer = io.BytesIO()
+    with pa.ipc.new_file(buffer, table.schema, options=IPC_OPTIONS) as writer:
+        writer.write_table(table)
+
+    return buffer.getvalue()
+
+def ipc_to_frame(data):
+    df = pa.ipc.open_file(pa.BufferReader(data)).read_all().to_pandas()
+    # Missing strings come back from Arrow as None, restore the NaN pandas itself reads them as
+    for column in df.columns[df.dtypes == object]:
+        if df[column].isna().any():
+            df[column] = df[column].where(df[column].notna(), np.nan)
+
+    return df
+
+
+class StageCache:
+    """Content-addressed store of stage outputs (a DataFrame or a tuple of them) in an S3 bucket resource"""
+
+    def __init__(self, bucket, prefix=CACHE_PREFIX, max_bytes=MAX_BYTES, max_age_days=MAX_AGE_DAYS):
+        self.bucket = bucket
+        self.client = bucket.meta.client
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+
+    def entry_prefix(self, name, key):
+        return f"{self.prefix}{name}/{key}/"
+
+    def get(self, name, key):
+        """Cached output of a stage, or None if there is none"""
+        entry = self.entry_prefix(name, key)
+        try:
+            info = json.loads(self.client.get_object(Bucket=self.bucket.name, Key=entry + "entry.json")["Body"].read())
+        except self.client.exceptions.NoSuchKey:
+            return None
+
+        frames = fetch_objects(self.bucket, [f"{entry}{part}.arrow" for part in range(info["parts"])],
+                               parse=lambda part_key, data: ipc_to_frame(data))
+        # Rewriting the marker is what marks the entry as recently used for eviction
+        self.client.put_object(Bucket=self.bucket.name, Key=entry + "entry.json", Body=json.dumps(info))
+
+        return tuple(frames) if info["tuple"] else frames[0]
+
+    def put(self, name, key, output):
+        """Store the output of a stage. The marker goes last, so a partly written entry is never read"""
+        entry = self.entry_prefix(name, key)
+        frames = output if isinstance(output, tuple) else (output,)
+        for part, df in enumerate(frames):
+            self.client.put_object(Bucket=self.bucket.name, Key=f"{entry}{part}.arrow", Body=frame_to_ipc(df))
+        info = {"parts": len(frames), "tuple": isinstance(output, tuple)}
+        self.client.put_object(Bucket=self.bucket.name, Key=entry + "entry.json", Body=json.dumps(info))
+
+    def evict(self, now=None):
+        """Delete entries not used for max_age_days, then the least recently used ones beyond max_bytes.
+
+        Returns the prefixes of the deleted entries.
+        """
+        now = now or time.time()
+        entries = {}
+        for obj in self.bucket.objects.filter(Prefix=self.prefix):
+            entry = obj.key.rsplit("/", 1)[0] + "/"
+            keys, size, last_used = entries.get(entry, ([], 0, 0))
+            if obj.key.endswith("entry.json"):
+                last_used = obj.last_modified.timestamp()
+            entries[entry] = (keys + [obj.key], size + obj.size, last_used)
+
+        evicted, total_bytes = [], sum(size for _, size, _ in entries.values())
+        for entry, (keys, size, last_used) in sorted(entries.items(), key=lambda item: item[1][2]):
+            # Entries without a marker (an interrupted write) sort first and go with the expired ones
+            if now - last_used > self.max_age_days * 86400 or total_bytes > self.max_bytes:
+                for key in keys:
+                    self.bucket.Object(key).delete()
+                evicted.append(entry)
+                total_bytes -= size
+
+        return evicted
+
+
+def run_stages(stages, data, cache=None, input_key=None):
+    """Run (name, fn) stages in order on data, each on the previous one's output.
+
+    With a cache, the run starts from the output of the last stage that is cached for input_key and the current code
+    of the stages, and stores the output of every stage it runs.
+    """
+    if cache is None:
+        for _, fn in stages:
+            data = fn(data)
+        return data
+
+    keys = stage_keys(input_key, stages)
+    start = 0
+    for position in reversed(range(len(stages))):
+        output = cache.get(stages[position][0], keys[position])
+        if output is not None:
+            print(f"Stage cache hit for {stages[position][0]}, skipping {position + 1} of {len(stages)} stages")
+            data, start = output, position + 1
+            break
+
+    for (name, fn), key in zip(stages[start:], keys[start:]):
+        data = fn(data)
+        cache.put(name, key, data)
+
+    evicted = cache.evict()
+    if evicted:
+        print(len(evicted), "stage cache entries evicted")
+
+    return data
@@ -1,8 +1,34 @@
+import base64
+import collections
+import csv
+import hashlib
+import itertools
 import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
 import boto3
 import urllib3
 import urllib.request
 
+# "delta" only writes the months that changed as their own objects, "stream" pipes the whole download straight into
+# a multipart S3 upload, "tmp" stages the whole file in /tmp first
+INGEST_MODE = os.getenv("INGEST_MODE", "delta")
+
+# Multipart parts (S3 needs at least 5 MiB for all but the last one), at most UPLOAD_CONCURRENCY + 1 are in memory
+PART_BYTES = int(os.getenv("UPLOAD_PART_MB", "8")) * 1024 * 1024
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "2"))
+READ_CHUNK_BYTES = 256 * 1024
+# Times an interrupted download is resumed from where it stopped before giving up
+MAX_RESUMES = int(os.getenv("DOWNLOAD_MAX_RESUMES", "5"))
+
+# Delta mode keeps the dataset as one CSV per month under this prefix, replacing the single FromJan2017onwards.csv,
+# with a manifest of the source version and each month's hash. Month objects are small, so many go up at once
+DELTA_PREFIX = "FromJan2017onwards/"
+DELTA_MANIFEST_KEY = DELTA_PREFIX + "manifest.json"
+MONTH_UPLOAD_CONCURRENCY = 16
+
 def connect_to_hdb_s3():
     dataset_id = "d_8b84c4ee58e3cfc0ece0d773c8ca6abc"
     url = f"https://api-open.data.gov.sg/v1/public/api/datasets/{dataset_id}/initiate-download"
@@ -54,13 +80,253 @@ def upload_data_to_s3(bucket_name, file_key):
     
     print("File uploaded successfully.")
 
+class ResumableDownload:
+    """Iterates over the chunks of the file at download_url, resuming an interrupted transfer with a Range request
+    from the last byte received"""
+
+    def __init__(self, download_url, http=None, max_resumes=MAX_RESUMES):
+        self.download_url = download_url
+        self.http = http or urllib3.PoolManager()
+        self.max_resumes = max_resumes
+        self.received = 0
+        self.total = None
+        self.etag = None
+        self.last_modified = None
+
+    def __iter__(self):
+        resumes = 0
+        while True:
+            # If-Range makes the server send the whole file again (200) rather than the rest of a changed one
+            headers = {"Range": f"bytes={self.received}-", "If-Range": self.etag} if self.received else {}
+            response = self.http.request("GET", self.download_url, headers=headers, preload_content=False)
+            try:
+                if self.received and response.status != 206:
+                    raise RuntimeError(f"Cannot resume the download at byte {self.received}, status {response.status}")
+                if response.status not in (200, 206):
+                    raise RuntimeError(f"Download failed with status {response.status}")
+                if response.status == 200:
+                    length = response.headers.get("Content-Length")
+                    self.total = int(length) if length else None
+                    self.etag = response.headers.get("ETag")
+                    self.last_modified = response.headers.get("Last-Modified")
+                for chunk in response.stream(READ_CHUNK_BYTES):
+                    self.received += len(chunk)
+                    yield chunk
+            except (urllib3.exceptions.ProtocolError, urllib3.exceptions.ReadTimeoutError) as e:
+                resumes += 1
+                # Without an ETag there is no way to tell the rest of the file from the rest of a changed one
+                if resumes > self.max_resumes or self.etag is None:
+                    print("Error occurred while downloading the file:", e)
+                    raise
+                print(f"Download interrupted at byte {self.received}, resuming ({resumes} of {self.max_resumes}):", e)
+                continue
+            except GeneratorExit:  # Stopped reading early, the rest of the body is never read
+                response.close()
+                raise
+            finally:
+                response.release_conn()
+
+            if self.total is not None and self.received != self.total:
+                raise RuntimeError(f"Downloaded {self.received} bytes, expected {self.total}")
+            return
+
+def stream_to_s3(download_url, bucket_name, file_key, s3=None, http=None, part_bytes=PART_BYTES,
+                 max_resumes=MAX_RESUMES):
+    """Download a file straight into a multipart S3 upload, without staging it on disk.
+
+    S3 checks every part against its MD5, the completed object's ETag is checked against the one expected from the
+    parts, and the whole file against the source's ETag when that is a plain MD5. Returns a summary of the transfer.
+    """
+    s3 = s3 or boto3.client('s3')
+    upload_id = s3.create_multipart_upload(Bucket=bucket_name, Key=file_key)["UploadId"]
+
+    def upload_part(number, data):
+        md5 = hashlib.md5(data).digest()
+        response = s3.upload_part(Bucket=bucket_name, Key=file_key, UploadId=upload_id, PartNumber=number, Body=data,
+                                  ContentMD5=base64.b64encode(md5).decode())
+        return {"PartNumber": number, "ETag": response["ETag"]}, md5
+
+    print("Streaming file from source bucket to destination bucket...")
+    try:
+        download = ResumableDownload(download_url, http, max_resumes)
+        file_md5, buffer, pending, parts = hashlib.md5(), bytearray(), [], []
+        with ThreadPoolExecutor(UPLOAD_CONCURRENCY) as pool:
+            for chunk in download:
+                file_md5.update(chunk)
+                buffer += chunk
+                # The last part may be smaller (or empty for an empty file), every other one is exactly part_bytes
+                while len(buffer) >= part_bytes:
+                    if len(pending) >= UPLOAD_CONCURRENCY:
+                        parts.append(pending.pop(0).result())
+                    pending.append(pool.submit(upload_part, len(parts) + len(pending) + 1, bytes(buffer[:part_bytes])))
+                    del buffer[:part_bytes]
+            if buffer or not (parts or pending):
+                pending.append(pool.submit(upload_part, len(parts) + len(pending) + 1, bytes(buffer)))
+            parts += [future.result() for future in pending]
+
+        response = s3.complete_multipart_upload(Bucket=bucket_name, Key=file_key, UploadId=upload_id,
+                                                MultipartUpload={"Parts": [part for part, _ in parts]})
+    except Exception as e:
+        print("Error occurred while streaming the file:", e)
+        s3.abort_multipart_upload(Bucket=bucket_name, Key=file_key, UploadId=upload_id)
+        raise
+
+    # Multipart ETags are the MD5 of the parts' MD5s, followed by the number of parts
+    expected_etag = f'"{hashlib.md5(b"".join(md5 for _, md5 in parts)).hexdigest()}-{len(parts)}"'
+    if response["ETag"] != expected_etag:
+        raise RuntimeError(f"Uploaded object ETag {response['ETag']} does not match the parts sent {expected_etag}")
+    if download.etag and re.fullmatch(r'"?[0-9a-f]{32}"?', download.etag) and \
+            download.etag.strip('"') != file_md5.hexdigest():
+        raise RuntimeError(f"Downloaded file MD5 {file_md5.hexdigest()} does not match the source ETag {download.etag}")
+
+    print(f"File streamed successfully: {download.received} bytes in {len(parts)} parts.")
+    return {"bytes": download.received, "parts": len(parts), "md5": file_md5.hexdigest(), "etag": response["ETag"]}
+
+def month_key(month):
+    return f"{DELTA_PREFIX}month={month}.csv"
+
+def split_lines(chunks):
+    # Lines of a byte stream, each ending in a newline
+    rest = b""
+    for chunk in chunks:
+        *lines, rest = (rest + chunk).split(b"\n")
+        yield from (line + b"\n" for line in lines)
+    if rest:
+        yield rest + b"\n"
+
+def month_runs(chunks):
+    """Header line and an iterator of the (month, lines) runs of a CSV byte stream, a run ending where the month
+    changes, keeping the source's bytes and row order. The dataset is sorted by month, so a month is normally one run"""
+    lines = split_lines(chunks)
+    header = next(lines, b"")
+    month_index = next(csv.reader([header.decode("utf-8-sig")]), ["month"]).index("month")
+
+    def runs():
+        month, run = None, []
+        for line in lines:
+            if not line.strip():
+                continue
+            line_month = next(csv.reader([line.decode()]))[month_index]
+            if line_month != month and run:
+                yield month, run
+                run = []
+            month = line_month
+            run.append(line)
+        if run:
+            yield month, run
+
+    return header, runs()
+
+def load_delta_manifest(s3, bucket_name):
+    try:
+        return json.loads(s3.get_object(Bucket=bucket_name, Key=DELTA_MANIFEST_KEY)["Body"].read())
+    except s3.exceptions.NoSuchKey:
+        return {"source": {}, "months": {}}
+
+def update_deltas(download_url, bucket_name, s3=None, http=None):
+    """Write the months of the dataset that are new or changed since the last run as month objects.
+
+    Nothing is read past the response headers if the source's ETag or Last-Modified is the one recorded last time,
+    nor written if the content hash is. Months gone from the dataset are deleted. Returns the months written and
+    deleted.
+    """
+    s3 = s3 or boto3.client('s3')
+    manifest = load_delta_manifest(s3, bucket_name)
+    download = ResumableDownload(download_url, http)
+    chunks = iter(download)
+    first_chunk = next(chunks, b"")
+    source = {"etag": download.etag, "last_modified": download.last_modified}
+    recorded = manifest["source"]
+    if (source["etag"] and source["etag"] == recorded.get("etag")) or \
+            (source["last_modified"] and source["last_modified"] == recorded.get("last_modified")):
+        chunks.close()
+        print("Dataset unchanged since the last run (same ETag or Last-Modified), nothing to do.")
+        return {"written": [], "deleted": []}
+
+    file_hash = hashlib.sha256()
+    def hashed(chunks):
+        for chunk in chunks:
+            file_hash.update(chunk)
+            yield chunk
+    # Each month is uploaded (if changed) as soon as its rows end, so only one month and the uploads in flight are
+    # held in memory rather than the whole file
+    print("Downloading file from source bucket...")
+    header, runs = month_runs(hashed(itertools.chain([first_chunk], chunks)))
+    month_hashes, month_rows, uploads, in_flight = {}, {}, {}, collections.deque()
+    def put_month(month, body):
+        s3.put_object(Bucket=bucket_name, Key=month_key(month), Body=body)
+    with ThreadPoolExecutor(MONTH_UPLOAD_CONCURRENCY) as pool:
+        for month, lines in runs:
+            reopened = month in month_hashes
+            if reopened:
+                # More rows of a month seen earlier in the file, whose object holds the earlier rows by now
+                if month in uploads:
+                    uploads[month].result()
+                body = s3.get_object(Bucket=bucket_name, Key=month_key(month))["Body"].read() + b"".join(lines)
+            else:
+                month_hashes[month] = hashlib.sha256(header)
+                body = header + b"".join(lines)
+            month_hashes[month].update(b"".join(lines))
+            month_rows[month] = month_rows.get(month, 0) + len(lines)
+
+            if reopened or month_hashes[month].hexdigest() != manifest["months"].get(month, {}).get("sha256"):
+                while len(in_flight) >= MONTH_UPLOAD_CONCURRENCY:
+                    in_flight.popleft().result()
+                uploads[month] = pool.submit(put_month, month, body)
+                in_flight.append(uploads[month])
+        for upload in uploads.values():
+            upload.result()
+    source["sha256"] = file_hash.hexdigest()
+
+    month_hashes = {month: month_hash.hexdigest() for month, month_hash in month_hashes.items()}
+    written = sorted(month for month, month_hash in month_hashes.items()
+                     if manifest["months"].get(month, {}).get("sha256") != month_hash)
+    deleted = sorted(set(manifest["months"]) - set(month_hashes))
+    print(f"{len(written)} new or changed months, {len(deleted)} removed, of {len(month_hashes)} months in the dataset")
+
+    with ThreadPoolExecutor(MONTH_UPLOAD_CONCURRENCY) as pool:
+        list(pool.map(lambda month: s3.delete_object(Bucket=bucket_name, Key=month_key(month)), deleted))
+    # The month objects replace the full file, which would otherwise be processed twice
+    s3.delete_object(Bucket=bucket_name, Key="FromJan2017onwards.csv")
+
+    # Written last, so an interrupted run writes the same months again next time
+    manifest = {"source": source,
+                "months": {month: {"sha256": month_hash, "rows": month_rows[month]}
+                           for month, month_hash in sorted(month_hashes.items())}}
+    s3.put_object(Bucket=bucket_name, Key=DELTA_MANIFEST_KEY, Body=json.dumps(manifest, indent=2))
+    print("Month objects uploaded successfully.")
+
+    return {"written": written, "deleted": deleted}
+
+def remove_deltas(bucket_name, s3=None):
+    """Delete the month objects and manifest of delta mode, once the single full file replaces them. Returns the
+    keys deleted"""
+    s3 = s3 or boto3.client('s3')
+    # Listed rather than read from the manifest, so months of a run interrupted before it wrote one go too
+    pages = s3.get_paginator("list_objects_v2").paginate(Bucket=bucket_name, Prefix=DELTA_PREFIX)
+    keys = sorted(obj["Key"] for page in pages for obj in page.get("Contents", []))
+    with ThreadPoolExecutor(MONTH_UPLOAD_CONCURRENCY) as pool:
+        list(pool.map(lambda key: s3.delete_object(Bucket=bucket_name, Key=key), keys))
+    if keys:
+        print(f"Deleted {len(keys)} objects of delta mode, replaced by the full file")
+
+    return keys
+
 def lambda_handler(event, context):
     bucket_name = "hdb-resale-pred-raw"
     file_key = "FromJan2017onwards.csv"
+    mode = (event or {}).get("ingest_mode") or INGEST_MODE
     
     response = connect_to_hdb_s3()
     download_url = get_hdb_s3_link(response)
-    get_data_from_hdb_url(download_url)
-    upload_data_to_s3(bucket_name, file_key)
+    if mode == "delta":
+        return update_deltas(download_url, bucket_name)
+    if mode == "stream":
+        stream_to_s3(download_url, bucket_name, file_key)
+    else:
+        get_data_from_hdb_url(download_url)
+        upload_data_to_s3(bucket_name, file_key)
+    # Data processing reads every CSV in the bucket, month objects left by delta mode would duplicate the full file
+    remove_deltas(bucket_name)
     
  
\ No newline at end of file
@@ -1,75 +1,63 @@
-import pandas as pd
-import boto3
-import numpy as np
+import json
 
-def connect_to_s3():
-    # Setting up AWS connection
-    s3_input = boto3.resource('s3', region_name='ap-southeast-1')
-    input_bucket = s3_input.Bucket('hdb-resale-pred-processed')
-    
-    return input_bucket
+import boto3
 
-# Load train and test data from s3
-def load_data_from_s3(input_bucket):
-    print("Loading training data...")
-    train_df = pd.read_csv(input_bucket.Object('train.csv').get()['Body'])
-    test_df = pd.read_csv(input_bucket.Object('test.csv').get()['Body'])
-    
-    return train_df, test_df
+try:
+    from modelling.common.drift import (CATEGORICAL_FEATURES, NUMERIC_FEATURES, REFERENCE_PROFILE_KEY, build_reference,
+                                       drift_report)
+    from modelling.common.processed_data import read_processed
+    from modelling.common.storage import ObjectNotFound, get_bytes, open_storage, print_cache_stats
+except ModuleNotFoundError:  # Inside the Lambda package modelling/common is copied to ./common
+    from common.drift import (CATEGORICAL_FEATURES, NUMERIC_FEATURES, REFERENCE_PROFILE_KEY, build_reference,
+                              drift_report)
+    from common.processed_data import read_processed
+    from common.storage import ObjectNotFound, get_bytes, open_storage, print_cache_stats
 
-# Check if distribution in numerical values are not too different using PSI
-def calculate_psi(expected_array, actual_array, buckets=10):
-    breakpoints = np.arange(0, buckets + 1) / (buckets) * 100
-    breakpoints = np.percentile(expected_array, breakpoints)
+# Only the columns checked for drift are decoded
+VALIDATION_COLUMNS = CATEGORICAL_FEATURES + NUMERIC_FEATURES
 
-    expected_percents = np.histogram(expected_array, breakpoints)[0] / len(expected_array)
-    actual_percents = np.histogram(actual_array, breakpoints)[0] / len(actual_array)
-    print(actual_percents)
+def connect_to_s3():
+    # Setting up AWS connection, reads are served from the local artifact cache when unchanged
+    return open_storage('hdb-resale-pred-processed'), open_storage('hdb-resale-best-model')
 
-    psi_value = np.sum((expected_percents - actual_percents) * np.log(expected_percents / actual_percents))
+# Load the reference profile of the champion's training data (written by training next to the model) and the test data
+def load_data_from_s3(input_bucket, model_bucket):
+    print("Loading reference profile and test data...")
+    test_df = read_processed(input_bucket, 'test', VALIDATION_COLUMNS)
+    try:
+        reference = json.loads(get_bytes(model_bucket, REFERENCE_PROFILE_KEY))
+    except ObjectNotFound:
+        # Models trained before profiles were saved, the training data is profiled here instead
+        print(f"No {REFERENCE_PROFILE_KEY}, profiling the training data")
+        reference = build_reference(read_processed(input_bucket, 'train', VALIDATION_COLUMNS))
+    print_cache_stats(input_bucket, model_bucket)
 
-    return psi_value
+    return reference, test_df
 
-def check_numerical_distribution(train_df, test_df):
-    print("Checking numerical distribution differences using PSI...")
-    numerical_cols = ["flat_age_years", "floor_area_sqm"]
-    trigger_training = 0
-    for col in numerical_cols:
-        psi_value = calculate_psi(train_df[col], test_df[col])
-        if psi_value > 0.2:
-            print(f"Warning: Significant distribution difference in column '{col}' with PSI value: {psi_value}")
-            trigger_training += 1
+# Compare the new month against the reference for every feature at once
+def check_drift(reference, test_df):
+    print("Checking distribution drift of the test set against the training data...")
+    report = drift_report(reference, test_df)
+    for col, feature in report["features"].items():
+        if feature["drift"]:
+            status = "Warning: Significant distribution difference"
+        elif feature.get("psi_shift"):
+            status = "Distribution shift (reported only, not a retraining trigger)"
         else:
-            print(f"Column '{col}' has acceptable distribution difference with PSI value: {psi_value}")
-    
-    return trigger_training
+            status = "Acceptable difference"
+        unseen = f", unseen categories: {feature['unseen']}" if feature.get("unseen") else ""
+        print(f"{status} in column '{col}' with PSI value: {feature['psi']:.4f}{unseen}")
 
-# Check if categorical values in test set are present in train set
-def check_categorical_values(train_df, test_df):
-    print("Checking categorical values in test set against training set...")
-    categorical_cols = train_df.select_dtypes(include=['object', 'category']).columns.tolist()
-    trigger_training = 0
-    for col in categorical_cols:
-        train_unique = set(train_df[col].unique())
-        test_unique = set(test_df[col].unique())
-        if not test_unique.issubset(train_unique):
-            print(f"Warning: Test set contains unseen categories in column '{col}'")
-            unseen_categories = test_unique - train_unique
-            print(f"Unseen categories: {unseen_categories}")
-            trigger_training += 1
-        else:
-            print(f"All categories in column '{col}' are present in the training set.")
-    
-    return trigger_training
+    return report
 
 def lambda_handler(event, context):
     print("Starting data validation process...")
-    input_bucket = connect_to_s3()
-    train_df, test_df = load_data_from_s3(input_bucket)
-    trigger_training_cat = check_categorical_values(train_df, test_df)
-    trigger_training_num = check_numerical_distribution(train_df, test_df)
-    if trigger_training_cat + trigger_training_num > 0:
-        print("At least one data validation check failed. Triggering model retraining.")
+    input_bucket, model_bucket = connect_to_s3()
+    reference, test_df = load_data_from_s3(input_bucket, model_bucket)
+    report = check_drift(reference, test_df)
+    input_bucket.put('drift_report.json', json.dumps(report, indent=2))
+    if report["drifted"]:
+        print(f"Drift in {report['drifted']}. Triggering model retraining.")
         lambda_client = boto3.client('lambda', region_name='ap-southeast-1')
         response = lambda_client.invoke(
             FunctionName='hdb-resale-retraining',
@@ -1,3 +1,6 @@
+import json
+
+import numpy as np
 import pandas as pd
 
 from sklearn.pipeline import Pipeline
@@ -6,12 +9,23 @@ from sklearn.preprocessing import OneHotEncoder, StandardScaler
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.model_selection import GridSearchCV, TimeSeriesSplit
 from sklearn.inspection import permutation_importance
+from sklearn.metrics import root_mean_squared_error
 
-import joblib
 import matplotlib.pyplot as plt
 import seaborn as sns
 import boto3
 
+from modelling.common.design_matrix import DESIGN_MATRIX_CACHE, DesignMatrixStore
+from modelling.common.drift import REFERENCE_PROFILE_KEY, build_reference, save_reference
+from modelling.common.model_compaction import (MODEL_COMPACTION_REPORT, MODEL_COMPACTION_REPORT_KEY, compact_pipeline,
+                                               compaction_report, save_model)
+from modelling.common.processed_data import read_processed
+from modelling.common.s3_fetch import map_concurrently
+from modelling.common.storage import open_storage, print_cache_stats
+from modelling.common.price_grid import (PRICE_GRID_MAX_ERROR, build_price_grid, grid_error, save_price_grid,
+                                        validate_price_grid)
+from modelling.common.serving_artifact import export_serving_artifact
+
 
 # Initialisation
 OUTPUT_BEST_MODEL = True
@@ -34,8 +48,8 @@ PARAM_DICT = {
 # create sklearn pipeline with pre-processing of numerical and categorical features
 def define_pipeline(df):
     """Create a machine learning pipeline with preprocessing and model"""
-    numeric_features = df.drop("resale_price", axis=1).select_dtypes(include=['int64', 'float64']).columns.tolist()
-    categorical_features = df.select_dtypes(include=['object']).columns.tolist()
+    numeric_features = df.drop("resale_price", axis=1).select_dtypes(include=['number']).columns.tolist()
+    categorical_features = df.select_dtypes(include=['object', 'category']).columns.tolist()
     print(f"Numeric features: {numeric_features}")
     print(f"Categorical features: {categorical_features}")
 
@@ -63,9 +77,24 @@ def define_pipeline(df):
 
 
 # train model
-def train_model(pipeline, df):
-    """Train the model using cross-validation"""
+def train_model(pipeline, df, design=None):
+    """Train the model using cross-validation, on the cached encoded rows of df if design (its DesignMatrix) is given"""
     print("Training model")
+    if design is not None:
+        # Only the regressor is searched, the rows are encoded already. The preprocessor saw every fold rather than
+        # only the training folds, which makes no difference to trees: scaling does not move their splits, and a
+        # category a training fold lacks is an all-zero column either way
+        grid_search = GridSearchCV(pipeline.named_steps['reg'],
+                        cv=TimeSeriesSplit(n_splits=K_FOLDS),
+                        param_grid={name.removeprefix('reg__'): values for name, values in PARAM_DICT.items()},
+                        scoring='neg_root_mean_squared_error',
+                        refit=True,
+                        verbose=2,
+                        n_jobs=-1,
+                        )
+
+        return grid_search.fit(design.training_matrix(), design.y)
+
     X = df.drop(columns=['resale_price'])
     y = df['resale_price']
 
@@ -86,9 +115,8 @@ def train_model(pipeline, df):
     return trained_pipeline
 
 # Log feature importance on best model
-def get_feature_importance(trained_grid_search, test_df):
+def get_feature_importance(best_pipeline, test_df):
     """Get feature importance using permutation importance"""
-    best_pipeline = trained_grid_search.best_estimator_
     r = permutation_importance(best_pipeline, test_df.drop(columns=['resale_price']), test_df['resale_price'],
                                 n_repeats=10,
                                 random_state=RANDOM_STATE)
@@ -96,7 +124,7 @@ def get_feature_importance(trained_grid_search, test_df):
     # Soring permutation importance results
     sorted_idx = r.importances_mean.argsort()[::-1]
     importance_df = pd.DataFrame({
-        'feature': trained_grid_search.feature_names_in_[sorted_idx],
+        'feature': best_pipeline.feature_names_in_[sorted_idx],
         'importance_mean': r.importances_mean[sorted_idx],
         'importance_std': r.importances_std[sorted_idx]
     })
@@ -124,44 +152,74 @@ def plot_feature_importance(importance_df):
 if __name__ == "__main__":
     # Setting up AWS connection
     print("Setting up AWS connection...")
-    s3_input = boto3.resource('s3', region_name='ap-southeast-1')
-    input_bucket = s3_input.Bucket('hdb-resale-pred-processed')
+    input_bucket = open_storage('hdb-resale-pred-processed')
 
     # Load data
     print("Loading training data...")
-    train_df = pd.read_csv(input_bucket.Object('train.csv').get()['Body'])
-    test_df = pd.read_csv(input_bucket.Object('test.csv').get()['Body'])
+    train_df, test_df = map_concurrently(lambda name: read_processed(input_bucket, name), ['train', 'test'])
+    print_cache_stats(input_bucket)
 
-    # Training model with the pipeline
+    # Training model with the pipeline, on the cached encoded rows of the training data unless turned off
     print("Training model with the pipeline...")
-    trained_grid_search = train_model(pipeline=define_pipeline(train_df), df=train_df)
+    pipeline = define_pipeline(train_df)
+    design = None
+    if DESIGN_MATRIX_CACHE == "on":
+        design = DesignMatrixStore(input_bucket).update(train_df, pipeline.named_steps['preprocessor'])
+    trained_grid_search = train_model(pipeline=pipeline, df=train_df, design=design)
     cv_results = trained_grid_search.cv_results_
+    if design is None:
+        best_pipeline, best_params = trained_grid_search.best_estimator_, trained_grid_search.best_params_
+    else:
+        best_pipeline = design.pipeline(trained_grid_search.best_estimator_)
+        best_params = {f"reg__{name}": value for name, value in trained_grid_search.best_params_.items()}
 
     # Plot feature importances
     print("Plotting feature importances...")
-    fi_plot = plot_feature_importance(get_feature_importance(trained_grid_search, test_df))
+    fi_plot = plot_feature_importance(get_feature_importance(best_pipeline, test_df))
         
     # Calculate test score
     print("Calculating test score...")
-    test_score = trained_grid_search.score(test_df.drop(columns=['resale_price']), test_df['resale_price'])
+    test_rmse = root_mean_squared_error(test_df['resale_price'],
+                                        best_pipeline.predict(test_df.drop(columns=['resale_price'])))
 
     # Output for CML
     with open("train_metrics.txt", "w") as outfile:
         outfile.write(str(round(trained_grid_search.best_score_, 3)) + "\n")
     
     with open("test_metrics.txt", "w") as outfile:
-        outfile.write(str(round(-test_score, 3)) + "\n")
+        outfile.write(str(round(test_rmse, 3)) + "\n")
         
     with open("hyperparams_tried.txt", "w") as outfile:
         outfile.write(str(PARAM_DICT) + "\n")
 
     with open("best_hyperparams.txt", "w") as outfile:
-        outfile.write(str(trained_grid_search.best_params_) + "\n")
+        outfile.write(str(best_params) + "\n")
 
     if OUTPUT_BEST_MODEL:
-        # Output champion model
+        # Output champion model, compacted (float32 trees), with a report of its size and prediction drift if asked
         print("Saving champion model...")
-        joblib.dump(trained_grid_search.best_estimator_, '/tmp/champion_model.joblib')
+        champion_model = compact_pipeline(best_pipeline, train_df)
+        save_model(champion_model, '/tmp/champion_model.joblib')
+        if MODEL_COMPACTION_REPORT:
+            model_compaction_report = compaction_report(best_pipeline, champion_model, test_df,
+                                                        '/tmp/champion_model.joblib')
+            with open('/tmp/model_compaction_report.json', 'w') as outfile:
+                json.dump(model_compaction_report, outfile)
+            print("Model compaction: ", model_compaction_report)
+
+        # Serving artifact for the FastAPI app, loads faster and without sklearn. The compacted leaves are float32,
+        # and it is left uncompressed so the app's workers can memory-map it
+        export_serving_artifact(champion_model, '/tmp/champion_model.npz', leaf_dtype=np.float32)
+
+        # Precomputed price grid for the app's lookup path, with its interpolation error against the model
+        print("Building price lookup grid...")
+        price_grid = build_price_grid(champion_model, train_df)
+        price_grid_report = validate_price_grid(champion_model, price_grid, test_df)
+        save_price_grid(price_grid, price_grid_report, '/tmp/price_grid.npz', '/tmp/price_grid_report.json')
+        print("Price grid validation: ", price_grid_report)
+
+        # Distribution of the training data, data validation checks new months against it
+        save_reference(build_reference(train_df), '/tmp/reference_profile.json')
 
         # Output best model to s3
         s3_output = boto3.client('s3')
@@ -171,6 +229,28 @@ if __name__ == "__main__":
         s3_output.upload_file("/tmp/champion_model.joblib", 
                               'hdb-resale-best-model', 
                               'champion_model.joblib')
+        s3_output.upload_file("/tmp/champion_model.npz",
+                              'hdb-resale-best-model',
+                              'champion_model.npz')
+        # The app only serves from a grid close enough to the model, a grid built for an older champion is removed
+        if grid_error(price_grid_report) <= PRICE_GRID_MAX_ERROR:
+            s3_output.upload_file("/tmp/price_grid.npz",
+                                  'hdb-resale-best-model',
+                                  'price_grid.npz')
+        else:
+            print(f"Price grid not uploaded, its error {grid_error(price_grid_report):.4f} is above "
+                  f"{PRICE_GRID_MAX_ERROR}")
+            s3_output.delete_object(Bucket='hdb-resale-best-model', Key='price_grid.npz')
+        s3_output.upload_file("/tmp/price_grid_report.json",
+                              'hdb-resale-best-model',
+                              'price_grid_report.json')
+        s3_output.upload_file("/tmp/reference_profile.json",
+                              'hdb-resale-best-model',
+                              REFERENCE_PROFILE_KEY)
+        if MODEL_COMPACTION_REPORT:
+            s3_output.upload_file("/tmp/model_compaction_report.json",
+                                  'hdb-resale-best-model',
+                                  MODEL_COMPACTION_REPORT_KEY)
 
         print("Best model uploaded successfully.")
 
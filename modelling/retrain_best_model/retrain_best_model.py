@@ -1,36 +1,82 @@
+import io
+import json
+
+import numpy as np
 import pandas as pd
 import boto3
 import joblib
-from sklearn.metrics import root_mean_squared_error
-from copy import deepcopy
+
+try:
+    from modelling.common.design_matrix import DESIGN_MATRIX_CACHE, DesignMatrixStore, rows_hash
+    from modelling.common.drift import REFERENCE_PROFILE_KEY, build_reference, fold_into_reference, save_reference
+    from modelling.common.evaluation import EVALUATION_REPORT_KEY, EvaluationCache, evaluate, model_hash
+    from modelling.common.incremental_forest import RETRAIN_MODE, retrain
+    from modelling.common.model_compaction import (MODEL_COMPACTION_REPORT, MODEL_COMPACTION_REPORT_KEY,
+                                                   compact_pipeline, compaction_report, save_model)
+    from modelling.common.price_grid import (PRICE_GRID_MAX_ERROR, build_price_grid, grid_error, save_price_grid,
+                                            validate_price_grid)
+    from modelling.common.processed_data import read_processed
+    from modelling.common.s3_fetch import map_concurrently, s3_config
+    from modelling.common.serving_artifact import export_serving_artifact
+    from modelling.common.storage import ObjectNotFound, get_bytes, open_storage, print_cache_stats
+except ModuleNotFoundError:  # Inside the Lambda image modelling/common is copied to ./common
+    from common.design_matrix import DESIGN_MATRIX_CACHE, DesignMatrixStore, rows_hash
+    from common.drift import REFERENCE_PROFILE_KEY, build_reference, fold_into_reference, save_reference
+    from common.evaluation import EVALUATION_REPORT_KEY, EvaluationCache, evaluate, model_hash
+    from common.incremental_forest import RETRAIN_MODE, retrain
+    from common.model_compaction import (MODEL_COMPACTION_REPORT, MODEL_COMPACTION_REPORT_KEY, compact_pipeline,
+                                         compaction_report, save_model)
+    from common.price_grid import PRICE_GRID_MAX_ERROR, build_price_grid, grid_error, save_price_grid, validate_price_grid
+    from common.processed_data import read_processed
+    from common.s3_fetch import map_concurrently, s3_config
+    from common.serving_artifact import export_serving_artifact
+    from common.storage import ObjectNotFound, get_bytes, open_storage, print_cache_stats
 
 def lambda_handler(event, context):
     print("Starting retraining process...")
-    # Load train, test, retraining test data  and model from S3 - Save to tmp then load from there
-    s3 = boto3.client('s3', region_name='ap-southeast-1')
-    s3.download_file('hdb-resale-pred-processed', 'train.csv', '/tmp/train.csv')
-    s3.download_file('hdb-resale-pred-processed', 'test.csv', '/tmp/test.csv')
-    s3.download_file('hdb-resale-pred-processed', 'retrain_test.csv', '/tmp/retrain_test.csv')
-    s3.download_file('hdb-resale-best-model', 'champion_model.joblib', '/tmp/champion_model.joblib')
+    # Load train, test, retraining test data and model from S3, through the local artifact cache
+    s3 = boto3.client('s3', region_name='ap-southeast-1', config=s3_config())
+    processed_bucket = open_storage('hdb-resale-pred-processed')
+    model_bucket = open_storage('hdb-resale-best-model')
+
+    # Fetch the three datasets and the champion model at the same time
+    df_train, df_test, df_retrain_test, champ_model_bytes = map_concurrently(lambda load: load(), [
+        lambda: read_processed(processed_bucket, 'train'),
+        lambda: read_processed(processed_bucket, 'test'),
+        lambda: read_processed(processed_bucket, 'retrain_test'),
+        lambda: get_bytes(model_bucket, 'champion_model.joblib'),
+    ])
+    print_cache_stats(processed_bucket, model_bucket)
 
     # Combine train and test data --> New training data
-    df_train = pd.read_csv('/tmp/train.csv')
-    df_test = pd.read_csv('/tmp/test.csv')
     df_combined = pd.concat([df_train, df_test], axis=0)
-    df_retrain_test = pd.read_csv('/tmp/retrain_test.csv')
-    champ_model = joblib.load('/tmp/champion_model.joblib')
+    champ_model = joblib.load(io.BytesIO(champ_model_bytes))
+
+    # Encoded rows of the combined data kept between runs. retrain only encodes or reads the months it fits on, and
+    # only the months not encoded by an earlier run are encoded
+    design_store = None
+    if ((event or {}).get("design_matrix_cache") or DESIGN_MATRIX_CACHE) == "on":
+        design_store = DesignMatrixStore(processed_bucket)
 
-    # Retrain best model on combined data
-    challenger_model = deepcopy(champ_model)
-    challenger_model.fit(df_combined.drop(columns=['resale_price']), df_combined['resale_price'])
+    # Retrain best model on combined data: replace the champion's oldest trees with ones fit on the latest months, or
+    # refit it on all of them
+    retrained_model = retrain(champ_model, df_combined, mode=(event or {}).get("retrain_mode") or RETRAIN_MODE,
+                              store=design_store)
+    # Compacted as it would be saved (float32 trees, pruned if MODEL_PRUNE_TOLERANCE is set), so the model scored
+    # below is exactly the one promoted
+    challenger_model = compact_pipeline(retrained_model, df_combined)
 
-    # Test on retraining test data
-    challenger_pred = challenger_model.predict(df_retrain_test.drop(columns=['resale_price']))
-    champ_pred = champ_model.predict(df_retrain_test.drop(columns=['resale_price']))
+    # Test on retraining test data, both models at once. The champion's predictions are cached for its saved bytes
+    # and the retrain_test rows, so a rerun on the same data only scores the challenger
+    evaluation_cache = EvaluationCache(model_bucket)
+    models = {"champion": champ_model, "challenger": challenger_model}
+    evaluation_report, predictions = evaluate(models, df_retrain_test, cache=evaluation_cache,
+                                              model_keys={"champion": model_hash(champ_model_bytes)})
+    model_bucket.put(EVALUATION_REPORT_KEY, json.dumps(evaluation_report))
 
     # Check if have 5% difference in RMSE
-    challenger_rmse = root_mean_squared_error(df_retrain_test['resale_price'], challenger_pred)
-    champion_rmse = root_mean_squared_error(df_retrain_test['resale_price'], champ_pred)
+    challenger_rmse = evaluation_report["challenger"]["rmse"]
+    champion_rmse = evaluation_report["champion"]["rmse"]
 
     print("Challenger RMSE: ", challenger_rmse)
     print("Champion RMSE: ", champion_rmse)
@@ -38,8 +84,54 @@ def lambda_handler(event, context):
     if challenger_rmse < champion_rmse * 0.95:
         print("Challenger model is better with score of: ", challenger_rmse, " vs ", champion_rmse)
         # Save challenger model and metrics to S3
-        joblib.dump(challenger_model, '/tmp/challenger_model.joblib')
+        save_model(challenger_model, '/tmp/challenger_model.joblib')
+        with open('/tmp/challenger_model.joblib', 'rb') as file:
+            challenger_key = model_hash(file.read())
         s3.upload_file("/tmp/challenger_model.joblib", 
                       'hdb-resale-best-model', 
                       'champion_model.joblib')
+        if MODEL_COMPACTION_REPORT:
+            model_compaction_report = compaction_report(retrained_model, challenger_model, df_retrain_test,
+                                                        '/tmp/challenger_model.joblib')
+            model_bucket.put(MODEL_COMPACTION_REPORT_KEY, json.dumps(model_compaction_report))
+            print("Model compaction: ", model_compaction_report)
+
+        # Serving artifact for the FastAPI app, loads faster and without sklearn. The compacted leaves are float32,
+        # and it is left uncompressed so the app's workers can memory-map it
+        export_serving_artifact(challenger_model, '/tmp/challenger_model.npz', leaf_dtype=np.float32)
+        s3.upload_file("/tmp/challenger_model.npz",
+                      'hdb-resale-best-model',
+                      'champion_model.npz')
+
+        # Fold the months the challenger was trained on beyond the champion's into its reference profile
+        try:
+            reference = fold_into_reference(json.loads(get_bytes(model_bucket, REFERENCE_PROFILE_KEY)), df_combined)
+        except ObjectNotFound:
+            reference = build_reference(df_combined)
+        save_reference(reference, '/tmp/reference_profile.json')
+        s3.upload_file("/tmp/reference_profile.json",
+                      'hdb-resale-best-model',
+                      REFERENCE_PROFILE_KEY)
+
+        # Rebuild the app's price lookup grid so it always matches the champion
+        price_grid = build_price_grid(challenger_model, df_combined)
+        price_grid_report = validate_price_grid(challenger_model, price_grid, df_retrain_test)
+        save_price_grid(price_grid, price_grid_report, '/tmp/price_grid.npz', '/tmp/price_grid_report.json')
+        print("Price grid validation: ", price_grid_report)
+        # The app only serves from a grid close enough to the model, the previous champion's grid is removed
+        if grid_error(price_grid_report) <= PRICE_GRID_MAX_ERROR:
+            s3.upload_file("/tmp/price_grid.npz",
+                          'hdb-resale-best-model',
+                          'price_grid.npz')
+        else:
+            print(f"Price grid not uploaded, its error {grid_error(price_grid_report):.4f} is above "
+                  f"{PRICE_GRID_MAX_ERROR}")
+            model_bucket.delete('price_grid.npz')
+        s3.upload_file("/tmp/price_grid_report.json",
+                      'hdb-resale-best-model',
+                      'price_grid_report.json')
+
+        # The new champion has been scored on retrain_test already, the next run reads it from the cache
+        evaluation_cache.put(challenger_key, rows_hash(df_retrain_test.drop(columns=['resale_price'])),
+                             predictions["challenger"])
         print("Challenger model uploaded and updated successfully.")
\ No newline at end of file
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+# Shared test data: one raw request to the app, and synthetic processed rows with a small pipeline fit on them
+sample_json = {"town": "Ang Mo Kio",
+               "flat_type": "2 Room",
+               "flat_model_revised": "Improved",
+               "flat_age_years": 46,
+               "floor_area_sqm": 44.0,
+               "days_from_earliest_data": 4323,
+               "storey_range_grouped": "1-15"}
+
+CATEGORICAL_FEATURES = ("town", "flat_type")
+
+
+def history(n_months, rows_per_month=40, towns=("Ang Mo Kio", "Bedok", "Clementi"), first_month=0, seed=0):
+    """Processed rows of consecutive months, priced by floor area and a steady market trend"""
+    rng = np.random.default_rng(seed)
+    n_rows = n_months * rows_per_month
+    df = pd.DataFrame({"town": rng.choice(towns, n_rows),
+                       "floor_area_sqm": rng.uniform(40, 150, n_rows),
+                       "days_from_earliest_data": np.repeat(np.arange(first_month, first_month + n_months) * 31,
+                                                            rows_per_month)})
+    df["resale_price"] = df["floor_area_sqm"] * 4000 + df["days_from_earliest_data"] * 50
+
+    return df
+
+
+def processed_rows(n_rows, seed=0):
+    """Processed rows of random months in the first two years, with noisy prices that differ by town"""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({"town": rng.choice(["Ang Mo Kio", "Bedok", "Clementi"], n_rows),
+                       "flat_type": rng.choice(["3 Room", "4 Room"], n_rows),
+                       "floor_area_sqm": rng.uniform(40, 150, n_rows).round(1),
+                       "days_from_earliest_data": rng.integers(0, 24, n_rows) * 31})
+    df["resale_price"] = (df["floor_area_sqm"] * 4000 + df["days_from_earliest_data"] * 50
+                          + (df["town"] == "Bedok") * 50000 + rng.normal(0, 5000, n_rows))
+
+    return df
+
+
+def preprocessor(categorical_features=("town",)):
+    return ColumnTransformer([("num", StandardScaler(), ["floor_area_sqm", "days_from_earliest_data"]),
+                              ("cat", OneHotEncoder(handle_unknown="ignore"), list(categorical_features))])
+
+
+def fitted_pipeline(df, n_estimators=10, max_depth=6):
+    """Pipeline(preprocessor, reg=RandomForestRegressor) fit on processed rows, encoding their categorical columns"""
+    categorical_features = [column for column in CATEGORICAL_FEATURES if column in df]
+    pipeline = Pipeline([("preprocessor", preprocessor(categorical_features)),
+                         ("reg", RandomForestRegressor(n_estimators=n_estimators, max_depth=max_depth,
+                                                       random_state=0))])
+
+    return pipeline.fit(df.drop(columns=["resale_price"]), df["resale_price"])
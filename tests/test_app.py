@@ -1,15 +1,14 @@
-from app.fastapi_app.main import app, loaded_model
+from app.fastapi_app.main import app, loaded_model, scoring_backend
+import json
+import os
+import shutil
+import subprocess
+import sys
 from fastapi.testclient import TestClient
 import numpy as np
 import pandas as pd
 
-sample_json = {"town":"Ang Mo Kio",
-                "flat_type":"2 Room",
-                "flat_model_revised":"Improved",
-                "flat_age_years":46,
-                "floor_area_sqm":44.0,
-                "days_from_earliest_data":4323,
-                "storey_range_grouped":"1-15"}
+from tests.conftest import sample_json
 
 def test_prediction():
     # Load data
@@ -36,4 +35,136 @@ def test_app_prediction():
         json=sample_json,
     )
     assert response.status_code == 200
-    assert response.json() == {"Prediction": response.json()["Prediction"]}
\ No newline at end of file
+    assert response.json() == {"Prediction": response.json()["Prediction"]}
+
+def test_app_batch_prediction():
+    client = TestClient(app)
+    response = client.post(
+        "/predict/batch",
+        json=[sample_json, sample_json],
+    )
+    expected = loaded_model.predict(pd.DataFrame([sample_json, sample_json]))
+
+    assert response.status_code == 200
+    assert response.json()["n_rows"] == 2
+    assert np.allclose(response.json()["Predictions"], expected)
+
+def test_app_prediction_without_micro_batching(monkeypatch):
+    monkeypatch.setattr("app.fastapi_app.main.micro_batcher", None)
+    client = TestClient(app)
+    response = client.post("/predict", json=dict(sample_json, flat_age_years=49))
+    expected = loaded_model.predict(pd.DataFrame([dict(sample_json, flat_age_years=49)]))
+
+    assert response.status_code == 200
+    assert np.isclose(response.json()["Prediction"], expected[0])
+
+def test_app_batch_prediction_columnar():
+    client = TestClient(app)
+    columnar_json = {key: [value, value, value] for key, value in sample_json.items()}
+    response = client.post(
+        "/predict/batch",
+        json=columnar_json,
+    )
+
+    assert response.status_code == 200
+    assert len(response.json()["Predictions"]) == 3
+
+    # Columns of different lengths are rejected
+    columnar_json["town"] = ["Ang Mo Kio"]
+    response = client.post("/predict/batch", json=columnar_json)
+    assert response.status_code == 422
+
+def test_app_batch_prediction_streamed():
+    client = TestClient(app)
+    response = client.post(
+        "/predict/batch?stream=true",
+        json=[sample_json] * 3,
+    )
+    lines = [json.loads(line) for line in response.text.splitlines()]
+
+    assert response.status_code == 200
+    assert len(lines[0]["Predictions"]) == 3
+    assert lines[-1]["n_rows"] == 3
+
+def test_app_prediction_cache():
+    client = TestClient(app)
+    first = client.post("/predict", json=sample_json).json()
+    hits_before = client.get("/cache/stats").json()["hits"]
+    second = client.post("/predict", json=sample_json).json()
+    stats = client.get("/cache/stats").json()
+
+    assert first == second
+    assert stats["hits"] == hits_before + 1
+    assert stats["size"] >= 1
+
+def test_app_model_reload(monkeypatch):
+    client = TestClient(app)
+    version = client.get("/admin/model").json()["version"]
+
+    # Disabled without a configured token
+    monkeypatch.setattr("app.fastapi_app.main.ADMIN_TOKEN", None)
+    assert client.post("/admin/reload").status_code == 403
+
+    monkeypatch.setattr("app.fastapi_app.main.ADMIN_TOKEN", "secret")
+    assert client.post("/admin/reload", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    response = client.post("/admin/reload", headers={"X-Admin-Token": "secret"})
+
+    # Reloading an unchanged artifact keeps the same model version
+    assert response.status_code == 200
+    assert response.json()["version"] == version
+
+def test_app_backend_stats():
+    client = TestClient(app)
+    response = client.get("/backend/stats")
+
+    assert response.status_code == 200
+    assert {"workers", "queue_depth", "utilization"} <= set(response.json())
+
+def test_app_metrics():
+    client = TestClient(app)
+    client.post("/predict", json=dict(sample_json, flat_age_years=47))
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    for stage in ["parse", "transform", "predict", "serialize"]:
+        assert f'hdb_prediction_stage_seconds_count{{stage="{stage}"}}' in response.text
+    assert 'hdb_http_requests_total{path="/predict",status="200"}' in response.text
+    assert "hdb_model_info{" in response.text
+
+def test_app_prediction_error(monkeypatch):
+    def failing_predict(model, records):
+        raise RuntimeError("Scoring failed")
+
+    monkeypatch.setattr(scoring_backend, "predict", failing_predict)
+    client = TestClient(app)
+    response = client.post("/predict", json=dict(sample_json, flat_age_years=48))
+    metrics = client.get("/metrics").text
+
+    assert response.status_code == 500
+    assert 'hdb_prediction_errors_total{endpoint="/predict"}' in metrics
+    assert 'hdb_http_requests_total{path="/predict",status="500"}' in metrics
+
+def test_main_imports_from_container_layout(tmp_path):
+    # The files the Dockerfile copies, laid out as in the image's WORKDIR
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with open(os.path.join(repo, "app", "fastapi_app", "Dockerfile")) as dockerfile:
+        copies = [line.split()[1:] for line in dockerfile if line.startswith("COPY ")]
+    for source, target in copies:
+        source, target = os.path.join(repo, source.lstrip("/")), tmp_path / target
+        if os.path.isdir(source):
+            shutil.copytree(source, target, ignore=shutil.ignore_patterns("__pycache__"))
+        else:
+            os.makedirs(target.parent, exist_ok=True)
+            shutil.copy(source, target)
+
+    # As fastapi run does: the nearest parent of main.py that is not a package goes on sys.path
+    package_root, module = tmp_path / "app" / "fastapi_app", ["main"]
+    while (package_root / "__init__.py").exists():
+        module.insert(0, package_root.name)
+        package_root = package_root.parent
+    script = f"import sys; sys.path[0] = {str(package_root)!r}; import {'.'.join(module)}"
+    env = {key: value for key, value in os.environ.items() if key != "PYTHONPATH"}
+    result = subprocess.run([sys.executable, "-c", script], cwd=tmp_path, env=env, capture_output=True, text=True)
+
+    assert result.returncode == 0, result.stderr
@@ -1,8 +1,18 @@
+import json
+import time
+
+import boto3
 import pandas as pd
+from moto import mock_aws
 from pandas.api.types import is_numeric_dtype
 import pytest
 
 from modelling.data_processing.data_processing import connect_to_s3, load_concat_df, convert_variable_type, calculate_time_variables, clean_flat_model, categorise_stories, convert_to_title_case, split_dataset, print_missing_counts, output_to_s3
+from modelling.data_processing.data_processing import MANIFEST_KEY, partition_key, process_full, process_raw_df, run_incremental, update_partitions, load_manifest
+from modelling.data_processing.data_processing import full_stages
+from modelling.data_pulling.get_s3_data import month_key
+from modelling.data_processing.stage_cache import StageCache, input_fingerprint, run_stages, stage_keys
+from modelling.common.processed_data import processed_to_parquet, read_processed, read_processed_parquet
 
 @pytest.fixture
 def sample_raw_df():
@@ -80,4 +90,234 @@ def test_convert_to_title_case(sample_raw_df):
     assert proc_df['town'].iloc[0] == 'Ang Mo Kio', "town not converted to title case"
     assert proc_df['flat_type'].iloc[0] == '2 Room', "flat_type not converted to title case"
     assert proc_df['flat_model_revised'].iloc[0] == 'Improved', "flat_model_revised not converted to title case"
-    
+
+
+def raw_rows(months, rows_per_month=3):
+    return pd.DataFrame([{"month": month,
+                          "town": "ANG MO KIO",
+                          "flat_type": "4 ROOM",
+                          "block": str(100 + i),
+                          "street_name": "ANG MO KIO AVE 3",
+                          "storey_range": ["01 TO 03", "16 TO 18", "31 TO 33"][i % 3],
+                          "flat_model": ["Improved", "Model A-Maisonette"][i % 2],
+                          "lease_commence_date": str(1980 + i),
+                          "floor_area_sqm": str(80.0 + i),
+                          "remaining_lease": "60 years",
+                          "resale_price": str(400000 + 1000 * i)}
+                         for month in months for i in range(rows_per_month)])
+
+@pytest.fixture
+def s3_buckets():
+    with mock_aws():
+        s3 = boto3.resource("s3", region_name="ap-southeast-1")
+        config = {"LocationConstraint": "ap-southeast-1"}
+        input_bucket = s3.create_bucket(Bucket="hdb-resale-pred-raw", CreateBucketConfiguration=config)
+        output_bucket = s3.create_bucket(Bucket="hdb-resale-pred-processed", CreateBucketConfiguration=config)
+        input_bucket.put_object(Key="2015to2016.csv", Body=raw_rows(["2015-12", "2016-01"]).to_csv(index=False))
+        input_bucket.put_object(Key="FromJan2017onwards.csv",
+                                Body=raw_rows(["2017-01", "2017-02", "2017-03"]).to_csv(index=False))
+        yield input_bucket, output_bucket
+
+def sorted_rows(df):
+    df = df.astype({column: str for column in df.select_dtypes(include=["category"]).columns})
+    return df.sort_values(list(df.columns)).reset_index(drop=True)
+
+def test_incremental_matches_full(s3_buckets):
+    input_bucket, output_bucket = s3_buckets
+    run_incremental(input_bucket, output_bucket)
+
+    expected = split_dataset(process_raw_df(load_concat_df(input_bucket)))
+    for name, expected_df in zip(["train", "test", "retrain_test"], expected):
+        pd.testing.assert_frame_equal(sorted_rows(read_processed(output_bucket, name)),
+                                      sorted_rows(read_processed_parquet(processed_to_parquet(expected_df))))
+
+def test_incremental_processes_only_changed_months(s3_buckets):
+    input_bucket, output_bucket = s3_buckets
+    _, processed = update_partitions(input_bucket, output_bucket, load_manifest(output_bucket))
+    assert processed == ["2015-12", "2016-01", "2017-01", "2017-02", "2017-03"]
+
+    # Nothing changed: no month is processed again
+    _, processed = update_partitions(input_bucket, output_bucket, load_manifest(output_bucket))
+    assert processed == []
+
+    # A new month and a correction to the latest one, with earlier months in the same file untouched
+    latest = raw_rows(["2017-01", "2017-02", "2017-03", "2017-04"])
+    latest.loc[latest["month"] == "2017-03", "resale_price"] = "500000"
+    input_bucket.put_object(Key="FromJan2017onwards.csv", Body=latest.to_csv(index=False))
+    manifest, processed = update_partitions(input_bucket, output_bucket, load_manifest(output_bucket))
+
+    assert processed == ["2017-03", "2017-04"]
+    assert manifest["months"]["2017-04"]["rows"] == 3
+    partition = read_processed_parquet(output_bucket.Object(partition_key("2017-03")).get()["Body"].read())
+    assert (partition["resale_price"] == 500000).all()
+    assert json.loads(output_bucket.Object(MANIFEST_KEY).get()["Body"].read()) == manifest
+
+def test_incremental_drops_removed_months(s3_buckets):
+    input_bucket, output_bucket = s3_buckets
+    update_partitions(input_bucket, output_bucket, load_manifest(output_bucket))
+
+    input_bucket.Object("2015to2016.csv").delete()
+    manifest, processed = update_partitions(input_bucket, output_bucket, load_manifest(output_bucket))
+
+    assert processed == ["2015-12", "2016-01"]
+    assert sorted(manifest["months"]) == ["2017-01", "2017-02", "2017-03"]
+    assert partition_key("2016-01") not in {obj.key for obj in output_bucket.objects.all()}
+
+def test_polars_engine_matches_pandas(s3_buckets):
+    input_bucket, _ = s3_buckets
+    # Values that exercise the title casing, Maisonette grouping and pd.to_numeric's int/float choice
+    tricky = raw_rows(["2017-03"])
+    tricky.loc[0, ["town", "flat_model"]] = ["KALLANG/WHAMPOA", "Improved-Maisonette"]
+    tricky.loc[1, ["flat_type", "flat_model"]] = ["MULTI-GENERATION", "3Gen"]
+    tricky.loc[2, ["flat_model", "resale_price"]] = ["DBSS", "388000.50"]
+    input_bucket.put_object(Key="tricky.csv", Body=tricky.to_csv(index=False))
+
+    for pandas_df, polars_df in zip(process_full(input_bucket, "pandas", chunk_rows=0),
+                                    process_full(input_bucket, "polars")):
+        assert pandas_df.dtypes.to_dict() == polars_df.dtypes.to_dict()
+        assert pandas_df.to_csv(index=False) == polars_df.to_csv(index=False)
+        assert processed_to_parquet(pandas_df) == processed_to_parquet(polars_df)
+
+def test_polars_engine_incremental(s3_buckets):
+    input_bucket, output_bucket = s3_buckets
+    run_incremental(input_bucket, output_bucket, "pandas")
+    pandas_outputs = {obj.key: obj.get()["Body"].read() for obj in output_bucket.objects.all()}
+    for obj in output_bucket.objects.all():
+        obj.delete()
+
+    run_incremental(input_bucket, output_bucket, "polars")
+
+    assert {obj.key: obj.get()["Body"].read() for obj in output_bucket.objects.all()} == pandas_outputs
+
+def test_streaming_matches_whole_files(s3_buckets):
+    input_bucket, _ = s3_buckets
+    # The 2012-2014 raw file has no remaining_lease column
+    input_bucket.put_object(Key="2012to2014.csv",
+                            Body=raw_rows(["2014-11"]).drop(columns="remaining_lease").to_csv(index=False))
+
+    for whole_df, streamed_df in zip(process_full(input_bucket, chunk_rows=0), process_full(input_bucket, chunk_rows=2)):
+        assert whole_df.to_csv(index=False) == streamed_df.to_csv(index=False)
+        assert processed_to_parquet(whole_df) == processed_to_parquet(streamed_df)
+        assert (streamed_df.select_dtypes(include=["category"]).columns ==
+                ["town", "flat_type", "flat_model_revised", "storey_range_grouped"]).all()
+
+def test_streaming_checks_chunks(s3_buckets):
+    input_bucket, _ = s3_buckets
+    missing_price = raw_rows(["2017-04"])
+    missing_price.loc[2, "resale_price"] = None
+    input_bucket.put_object(Key="FromJan2017onwards.csv", Body=missing_price.to_csv(index=False))
+
+    with pytest.raises(AssertionError, match="Missing values in key columns"):
+        process_full(input_bucket, chunk_rows=2)
+
+def test_incremental_file_without_remaining_lease(s3_buckets):
+    input_bucket, output_bucket = s3_buckets
+    input_bucket.put_object(Key="2012to2014.csv",
+                            Body=raw_rows(["2014-11"]).drop(columns="remaining_lease").to_csv(index=False))
+
+    manifest, processed = update_partitions(input_bucket, output_bucket, load_manifest(output_bucket))
+
+    assert processed[0] == "2014-11" and manifest["months"]["2014-11"]["rows"] == 3
+
+@pytest.fixture
+def stage_cache(s3_buckets):
+    _, output_bucket = s3_buckets
+    return StageCache(output_bucket)
+
+def test_stage_cache_rerun(s3_buckets, stage_cache, capsys):
+    input_bucket, _ = s3_buckets
+    input_bucket.put_object(Key="2012to2014.csv",
+                            Body=raw_rows(["2014-11"]).drop(columns="remaining_lease").to_csv(index=False))
+    for chunk_rows in [0, 2]:
+        expected = process_full(input_bucket, chunk_rows=chunk_rows)
+        assert "Stage cache hit" not in capsys.readouterr().out
+        process_full(input_bucket, chunk_rows=chunk_rows, cache=stage_cache)
+        capsys.readouterr()
+
+        outputs = process_full(input_bucket, chunk_rows=chunk_rows, cache=stage_cache)
+
+        assert "Stage cache hit for split_dataset" in capsys.readouterr().out
+        for expected_df, df in zip(expected, outputs):
+            pd.testing.assert_frame_equal(df, expected_df)
+
+def test_stage_cache_round_trip(s3_buckets, stage_cache):
+    input_bucket, _ = s3_buckets
+    # Missing remaining_lease strings come back as NaN, as pandas reads them
+    input_bucket.put_object(Key="2012to2014.csv",
+                            Body=raw_rows(["2014-11"]).drop(columns="remaining_lease").to_csv(index=False))
+    df_raw = load_concat_df(input_bucket)
+    df_processed = process_raw_df(load_concat_df(input_bucket))
+
+    stage_cache.put("load_concat_df", "raw", df_raw)
+    stage_cache.put("process_raw_df", "processed", (df_processed, df_processed.iloc[:2]))
+
+    assert stage_cache.get("load_concat_df", "missing") is None
+    pd.testing.assert_frame_equal(stage_cache.get("load_concat_df", "raw"), df_raw)
+    cached_df, cached_head = stage_cache.get("process_raw_df", "processed")
+    pd.testing.assert_frame_equal(cached_df, df_processed)
+    pd.testing.assert_frame_equal(cached_head, df_processed.iloc[:2])
+
+def test_stage_cache_invalidation(s3_buckets, stage_cache, capsys):
+    input_bucket, _ = s3_buckets
+    stages = full_stages(chunk_rows=0)
+    process_full(input_bucket, chunk_rows=0, cache=stage_cache)
+
+    # A changed stage only reruns from that stage on
+    changed_stages = stages[:-1] + [("split_dataset", lambda df_all: split_dataset(df_all.copy()))]
+    input_key = input_fingerprint(input_bucket.objects.all())
+    assert stage_keys(input_key, changed_stages)[:-1] == stage_keys(input_key, stages)[:-1]
+    capsys.readouterr()
+    run_stages(changed_stages, input_bucket, stage_cache, input_key)
+    assert "Stage cache hit for convert_to_title_case, skipping 6 of 7 stages" in capsys.readouterr().out
+
+    # A changed raw file reruns everything
+    input_bucket.put_object(Key="FromJan2017onwards.csv", Body=raw_rows(["2017-01", "2017-04"]).to_csv(index=False))
+    assert input_fingerprint(input_bucket.objects.all()) != input_key
+    _, _, retrain_test = process_full(input_bucket, chunk_rows=0, cache=stage_cache)
+    assert "Stage cache hit" not in capsys.readouterr().out
+    assert len(retrain_test) == 3
+
+def test_stage_cache_eviction(s3_buckets, stage_cache):
+    input_bucket, _ = s3_buckets
+    df_raw = load_concat_df(input_bucket)
+    for key in ["oldest", "older", "newest"]:
+        time.sleep(1.1)  # S3 modification times are in whole seconds
+        stage_cache.put("load_concat_df", key, df_raw)
+
+    entry_bytes = sum(obj.size for obj in stage_cache.bucket.objects.filter(
+        Prefix=stage_cache.entry_prefix("load_concat_df", "newest")))
+    stage_cache.max_bytes = 2.5 * entry_bytes
+    assert stage_cache.evict() == [stage_cache.entry_prefix("load_concat_df", "oldest")]
+    assert stage_cache.get("load_concat_df", "oldest") is None
+
+    # Reading an entry counts as using it, so it outlives an entry written after it
+    time.sleep(1.1)
+    stage_cache.get("load_concat_df", "older")
+    stage_cache.max_bytes = 1.5 * entry_bytes
+    assert stage_cache.evict() == [stage_cache.entry_prefix("load_concat_df", "newest")]
+
+    assert stage_cache.evict(now=time.time() + 15 * 86400) == [stage_cache.entry_prefix("load_concat_df", "older")]
+
+def test_month_objects_from_delta_ingestion(s3_buckets, capsys):
+    input_bucket, output_bucket = s3_buckets
+    expected = process_full(input_bucket, chunk_rows=0)
+
+    # The puller's layout: one object per month of the latest dataset, and its manifest
+    latest = raw_rows(["2017-01", "2017-02", "2017-03"])
+    input_bucket.Object("FromJan2017onwards.csv").delete()
+    for month, rows in latest.groupby("month"):
+        input_bucket.put_object(Key=month_key(month), Body=rows.to_csv(index=False))
+    input_bucket.put_object(Key="FromJan2017onwards/manifest.json", Body="{}")
+
+    for chunk_rows in [0, 2]:
+        for expected_df, df in zip(expected, process_full(input_bucket, chunk_rows=chunk_rows)):
+            assert expected_df.to_csv(index=False) == df.to_csv(index=False)
+
+    # Incremental mode only reads the month objects that changed
+    update_partitions(input_bucket, output_bucket, load_manifest(output_bucket))
+    latest.loc[latest["month"] == "2017-03", "resale_price"] = "500000"
+    input_bucket.put_object(Key=month_key("2017-03"), Body=latest[latest["month"] == "2017-03"].to_csv(index=False))
+    capsys.readouterr()
+    _, processed = update_partitions(input_bucket, output_bucket, load_manifest(output_bucket))
+    assert processed == ["2017-03"]
+    assert "1 of 4 raw files changed since the last run" in capsys.readouterr().out
@@ -1,8 +1,17 @@
+import hashlib
 import pandas as pd
 import numpy as np
 import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import boto3
+import pytest
+import urllib3
+from moto import mock_aws
 
 from modelling.data_pulling.get_s3_data import connect_to_hdb_s3, get_hdb_s3_link, get_data_from_hdb_url, upload_data_to_s3
+from modelling.data_pulling.get_s3_data import DELTA_MANIFEST_KEY, lambda_handler, month_key, stream_to_s3, update_deltas
 
 def test_connect_to_hdb_s3():
     response = connect_to_hdb_s3()
@@ -18,4 +27,159 @@ def test_get_data_from_hdb_url():
     response = connect_to_hdb_s3()
     download_url = get_hdb_s3_link(response)
     get_data_from_hdb_url(download_url)
-    assert os.path.exists("/tmp/temp_file.csv")
\ No newline at end of file
+    assert os.path.exists("/tmp/temp_file.csv")
+
+class FileHandler(BaseHTTPRequestHandler):
+    """Serves self.server.data with Range and If-Range support, dropping the connection the first
+    self.server.drops times after self.server.drop_after bytes"""
+
+    def do_GET(self):
+        data, etag = self.server.data, '"' + hashlib.md5(self.server.data).hexdigest() + '"'
+        start, status = 0, 200
+        range_header = self.headers.get("Range")
+        if range_header and self.headers.get("If-Range") in (None, etag):
+            start, status = int(range_header.split("=")[1].rstrip("-")), 206
+        body = data[start:]
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        if self.server.drops:
+            self.server.drops -= 1
+            self.wfile.write(body[:self.server.drop_after])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def file_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FileHandler)
+    server.data, server.drops, server.drop_after = b"", 0, 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+
+@pytest.fixture
+def s3_client():
+    with mock_aws():
+        s3 = boto3.client("s3", region_name="ap-southeast-1")
+        s3.create_bucket(Bucket="hdb-resale-pred-raw", CreateBucketConfiguration={"LocationConstraint": "ap-southeast-1"})
+        yield s3
+
+def stream_file(file_server, s3_client, data, **kwargs):
+    file_server.data = data
+    url = f"http://127.0.0.1:{file_server.server_port}/FromJan2017onwards.csv"
+    summary = stream_to_s3(url, "hdb-resale-pred-raw", "FromJan2017onwards.csv", s3_client,
+                           part_bytes=5 * 1024 * 1024, **kwargs)
+    uploaded = s3_client.get_object(Bucket="hdb-resale-pred-raw", Key="FromJan2017onwards.csv")["Body"].read()
+    return summary, uploaded
+
+def test_stream_to_s3(file_server, s3_client):
+    data = os.urandom(12 * 1024 * 1024)
+
+    summary, uploaded = stream_file(file_server, s3_client, data)
+
+    assert uploaded == data
+    assert summary["parts"] == 3 and summary["bytes"] == len(data)
+    assert summary["md5"] == hashlib.md5(data).hexdigest()
+
+def test_stream_to_s3_small_and_empty_files(file_server, s3_client):
+    for data in [b"month,town\n2017-01,ANG MO KIO\n", b""]:
+        summary, uploaded = stream_file(file_server, s3_client, data)
+        assert uploaded == data and summary["parts"] == 1
+
+def test_stream_to_s3_resumes(file_server, s3_client):
+    data = os.urandom(6 * 1024 * 1024)
+    file_server.drops, file_server.drop_after = 2, 1024 * 1024
+
+    summary, uploaded = stream_file(file_server, s3_client, data)
+
+    assert uploaded == data and summary["bytes"] == len(data)
+    assert file_server.drops == 0
+
+def test_stream_to_s3_gives_up(file_server, s3_client):
+    file_server.drops, file_server.drop_after = 3, 1000
+
+    with pytest.raises(urllib3.exceptions.ProtocolError):
+        stream_file(file_server, s3_client, os.urandom(100000), max_resumes=2)
+
+    # The multipart upload is aborted rather than left behind
+    assert not s3_client.list_multipart_uploads(Bucket="hdb-resale-pred-raw").get("Uploads")
+
+def raw_csv(prices):
+    # {month: [resale prices]} as a raw CSV, months in file order
+    rows = [f"{month},ANG MO KIO,3 ROOM,{100 + i},ANG MO KIO AVE 3,01 TO 03,67,Improved,1980,60 years,{price}\n"
+            for month, month_prices in prices.items() for i, price in enumerate(month_prices)]
+    return ("month,town,flat_type,block,street_name,storey_range,floor_area_sqm,flat_model,lease_commence_date,"
+            "remaining_lease,resale_price\n" + "".join(rows)).encode()
+
+def month_objects(s3_client):
+    return {obj["Key"]: s3_client.get_object(Bucket="hdb-resale-pred-raw", Key=obj["Key"])["Body"].read()
+            for obj in s3_client.list_objects_v2(Bucket="hdb-resale-pred-raw")["Contents"]
+            if obj["Key"].endswith(".csv")}
+
+def test_update_deltas(file_server, s3_client):
+    url = f"http://127.0.0.1:{file_server.server_port}/FromJan2017onwards.csv"
+    s3_client.put_object(Bucket="hdb-resale-pred-raw", Key="FromJan2017onwards.csv", Body=b"full file")
+    file_server.data = raw_csv({"2017-01": [300000, 310000], "2017-02": [320000], "2017-03": [330000]})
+
+    assert update_deltas(url, "hdb-resale-pred-raw", s3_client) == {"written": ["2017-01", "2017-02", "2017-03"],
+                                                                    "deleted": []}
+    objects = month_objects(s3_client)
+    assert sorted(objects) == [month_key("2017-01"), month_key("2017-02"), month_key("2017-03")]
+    assert objects[month_key("2017-01")] == raw_csv({"2017-01": [300000, 310000]})
+
+    # Same source version: nothing is downloaded past the headers or written
+    assert update_deltas(url, "hdb-resale-pred-raw", s3_client) == {"written": [], "deleted": []}
+
+    # A corrected month, a new one, and one no longer in the dataset
+    file_server.data = raw_csv({"2017-02": [325000], "2017-03": [330000], "2017-04": [340000]})
+    assert update_deltas(url, "hdb-resale-pred-raw", s3_client) == {"written": ["2017-02", "2017-04"],
+                                                                    "deleted": ["2017-01"]}
+    assert month_objects(s3_client) == {month_key(month): raw_csv({month: prices}) for month, prices in
+                                        {"2017-02": [325000], "2017-03": [330000], "2017-04": [340000]}.items()}
+
+def test_update_deltas_unchanged_content(file_server, s3_client):
+    url = f"http://127.0.0.1:{file_server.server_port}/FromJan2017onwards.csv"
+    file_server.data = raw_csv({"2017-01": [300000]})
+    update_deltas(url, "hdb-resale-pred-raw", s3_client)
+
+    # A new source version with the same rows (e.g. re-exported without a trailing newline) writes no month
+    file_server.data = file_server.data.rstrip(b"\n")
+    assert update_deltas(url, "hdb-resale-pred-raw", s3_client) == {"written": [], "deleted": []}
+
+def test_update_deltas_month_in_several_runs(file_server, s3_client):
+    url = f"http://127.0.0.1:{file_server.server_port}/FromJan2017onwards.csv"
+    lines = raw_csv({"2017-01": [300000, 310000], "2017-02": [320000]}).splitlines(keepends=True)
+    # A late 2017-01 sale after the 2017-02 ones, the month is uploaded again with all its rows
+    late_sale = lines[1].replace(b"300000", b"305000")
+    file_server.data = b"".join(lines) + late_sale
+
+    assert update_deltas(url, "hdb-resale-pred-raw", s3_client)["written"] == ["2017-01", "2017-02"]
+    assert month_objects(s3_client)[month_key("2017-01")] == b"".join(lines[:3]) + late_sale
+
+    # Unchanged rows under a new source version write nothing
+    file_server.data = file_server.data.rstrip(b"\n")
+    assert update_deltas(url, "hdb-resale-pred-raw", s3_client) == {"written": [], "deleted": []}
+    assert month_objects(s3_client)[month_key("2017-01")] == b"".join(lines[:3]) + late_sale
+
+def test_switching_ingest_modes(file_server, s3_client, monkeypatch):
+    url = f"http://127.0.0.1:{file_server.server_port}/FromJan2017onwards.csv"
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "ap-southeast-1")
+    monkeypatch.setattr("modelling.data_pulling.get_s3_data.connect_to_hdb_s3", lambda: None)
+    monkeypatch.setattr("modelling.data_pulling.get_s3_data.get_hdb_s3_link", lambda response: url)
+    file_server.data = raw_csv({"2017-01": [300000], "2017-02": [320000]})
+
+    # Each mode leaves only its own objects, so data processing never reads a month twice
+    lambda_handler({"ingest_mode": "delta"}, None)
+    assert sorted(month_objects(s3_client)) == [month_key("2017-01"), month_key("2017-02")]
+
+    lambda_handler({"ingest_mode": "stream"}, None)
+    assert month_objects(s3_client) == {"FromJan2017onwards.csv": file_server.data}
+    assert not s3_client.list_objects_v2(Bucket="hdb-resale-pred-raw", Prefix=DELTA_MANIFEST_KEY).get("Contents")
+
+    lambda_handler({"ingest_mode": "delta"}, None)
+    assert sorted(month_objects(s3_client)) == [month_key("2017-01"), month_key("2017-02")]
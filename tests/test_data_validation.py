@@ -0,0 +1,117 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from modelling.common.drift import (REFERENCE_PROFILE_KEY, build_reference, drift_report, fold_into_reference,
+                                    merge_references, psi)
+from modelling.common.processed_data import write_processed
+from modelling.common.storage import LocalStorage
+from modelling.data_validation.data_validation import check_drift, load_data_from_s3
+
+@pytest.fixture
+def train_df():
+    rng = np.random.default_rng(0)
+    n_rows = 20000
+    return pd.DataFrame({"town": pd.Categorical(rng.choice(["Ang Mo Kio", "Bedok", "Tampines"], n_rows)),
+                         "flat_type": rng.choice(["3 Room", "4 Room", "5 Room"], n_rows),
+                         "flat_model_revised": rng.choice(["Improved", "Model A"], n_rows),
+                         "storey_range_grouped": pd.Categorical(rng.choice(["1-15", "16-30"], n_rows),
+                                                                categories=["1-15", "16-30", "31+"]),
+                         "flat_age_years": rng.integers(0, 50, n_rows).astype(np.int16),
+                         "floor_area_sqm": rng.normal(95, 20, n_rows).astype(np.float32),
+                         "days_from_earliest_data": np.sort(rng.integers(0, 3000, n_rows)).astype(np.int32)})
+
+def test_no_drift_on_same_distribution(train_df):
+    report = drift_report(build_reference(train_df), train_df.sample(2000, random_state=1))
+
+    assert report["drifted"] == []
+    assert all(feature["psi"] < 0.05 for feature in report["features"].values())
+    assert report["features"]["storey_range_grouped"]["unseen"] == []  # Unused categories are not unseen
+    json.dumps(report)
+
+def test_numeric_drift(train_df):
+    test_df = train_df.sample(2000, random_state=1).assign(floor_area_sqm=lambda df: df["floor_area_sqm"] + 30)
+
+    report = drift_report(build_reference(train_df), test_df)
+
+    assert report["drifted"] == ["floor_area_sqm"]
+    assert report["features"]["floor_area_sqm"]["psi"] > 1
+
+def test_unseen_categories(train_df):
+    test_df = train_df.head(100).copy()
+    test_df["flat_type"] = test_df["flat_type"].where(test_df.index % 2 == 0, "Multi-Generation")
+
+    report = check_drift(build_reference(train_df), test_df)
+
+    assert report["features"]["flat_type"]["unseen"] == ["Multi-Generation"]
+    assert report["drifted"] == ["flat_type"]
+    assert report["features"]["flat_type"]["chi2"] > 0 and report["features"]["flat_type"]["dof"] == 3
+
+def test_categorical_shift_reported_only(train_df):
+    # Every sale of the month in one town: a large PSI, but of categories the model has seen
+    test_df = train_df.sample(2000, random_state=1).assign(town="Bedok")
+
+    report = check_drift(build_reference(train_df), test_df)
+
+    assert report["features"]["town"]["psi"] > 0.2 and report["features"]["town"]["psi_shift"]
+    assert not report["features"]["town"]["drift"]
+    assert report["drifted"] == []
+
+def test_empty_bins_are_smoothed():
+    # Ties in an integer column and a test set outside the training range leave bins empty on either side
+    reference = build_reference(pd.DataFrame({"flat_age_years": [5] * 50 + [6] * 50}), ["flat_age_years"], [])
+
+    report = drift_report(reference, pd.DataFrame({"flat_age_years": [60, 61]}))
+
+    assert np.isfinite(report["features"]["flat_age_years"]["psi"])
+    assert report["drifted"] == ["flat_age_years"]
+
+def test_psi_matches_definition():
+    expected, actual = np.array([[40, 30, 20, 10]]), np.array([[25, 25, 25, 25]])
+    expected_share, actual_share = expected / 100, actual / 100
+
+    assert psi(expected, actual)[0] == pytest.approx(
+        ((actual_share - expected_share) * np.log(actual_share / expected_share)).sum())
+
+def test_no_rows(train_df):
+    with pytest.raises(ValueError):
+        drift_report(build_reference(train_df), train_df.head(0))
+
+def test_merged_reference_matches_whole(train_df):
+    whole = build_reference(train_df)
+    edges = {column: profile["edges"] for column, profile in whole["numeric"].items()}
+    # The second half has a category the first does not
+    first, second = train_df.iloc[:10000], train_df.iloc[10000:].assign(flat_type="Multi-Generation")
+    whole = build_reference(pd.concat([first, second]), edges=edges)
+
+    merged = merge_references(build_reference(first, edges=edges), build_reference(second, edges=edges))
+
+    assert merged == whole
+    json.dumps(merged)
+
+def test_fold_only_adds_new_months(train_df):
+    trained_on = train_df[train_df["days_from_earliest_data"] < 2000]
+    reference = build_reference(trained_on)
+
+    folded = fold_into_reference(reference, train_df)
+
+    assert folded["rows"] == len(train_df) and folded["through_day"] == train_df["days_from_earliest_data"].max()
+    assert folded["numeric"]["floor_area_sqm"]["edges"] == reference["numeric"]["floor_area_sqm"]["edges"]
+    assert fold_into_reference(folded, train_df) == folded
+
+def test_validation_reads_profile_not_training_data(train_df, tmp_path):
+    processed, models = LocalStorage(str(tmp_path / "processed")), LocalStorage(str(tmp_path / "models"))
+    write_processed(processed, "test", train_df.head(500))
+
+    # No profile yet: the training data is profiled instead
+    write_processed(processed, "train", train_df)
+    reference, test_df = load_data_from_s3(processed, models)
+    assert reference == build_reference(train_df.drop(columns="days_from_earliest_data")) and len(test_df) == 500
+
+    os.remove(processed.path("train.parquet"))
+    models.put(REFERENCE_PROFILE_KEY, json.dumps(build_reference(train_df)))
+    reference, _ = load_data_from_s3(processed, models)
+    assert reference["rows"] == len(train_df)
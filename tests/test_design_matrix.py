@@ -0,0 +1,118 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.base import clone
+from sklearn.ensemble import RandomForestRegressor
+
+from modelling.common.design_matrix import DesignMatrixStore, rows_hash
+from modelling.common.incremental_forest import retrain
+from modelling.common.storage import LocalStorage
+from tests.conftest import fitted_pipeline, history, preprocessor
+
+
+@pytest.fixture
+def store(tmp_path):
+    return DesignMatrixStore(LocalStorage(str(tmp_path / "hdb-resale-pred-processed")))
+
+
+def test_update_encodes_only_new_months(store, capsys):
+    df = history(6)
+    design = store.update(df, preprocessor())
+
+    fitted = clone(preprocessor()).fit(df.drop(columns=["resale_price"]))
+    expected = fitted.transform(df.drop(columns=["resale_price"]))
+    assert np.allclose(design.X.toarray(), expected.astype(np.float32))
+    assert np.array_equal(design.y, df["resale_price"].to_numpy())
+    assert design.training_matrix().dtype == np.float32
+    assert "6 months encoded, 0 read" in capsys.readouterr().out
+
+    # A month later: the stored months are read back with the same preprocessor, only the new one is encoded
+    df = pd.concat([df, history(1, first_month=6, seed=1)], ignore_index=True)
+    design = store.update(df, preprocessor())
+    assert "1 months encoded, 6 read" in capsys.readouterr().out
+    assert np.allclose(design.X.toarray(), fitted.transform(df.drop(columns=["resale_price"])).astype(np.float32))
+    assert design.encoding == store.load_manifest()["encoding"]
+
+    # Only the latest months, e.g. to grow a forest on
+    assert design.latest(2).X.shape[0] == 80 and set(design.latest(2).days) == {5 * 31, 6 * 31}
+
+
+def test_update_reencodes_changed_months(store, capsys):
+    df = history(4)
+    store.update(df, preprocessor())
+    capsys.readouterr()
+
+    df.loc[df.index[-1], "resale_price"] += 1000  # A correction to the latest month
+    design = store.update(df, preprocessor())
+
+    assert "1 months encoded, 3 read" in capsys.readouterr().out
+    assert design.y[-1] == df["resale_price"].iloc[-1]
+
+
+def test_stale_vocabulary_rebuilds(store, tmp_path, capsys):
+    df = history(4)
+    first = store.update(df, preprocessor())
+    manifest = store.load_manifest()
+
+    df = pd.concat([df, history(1, towns=("Punggol",), first_month=4, seed=1)], ignore_index=True)
+    design = store.update(df, preprocessor())
+
+    assert "categories missing from the stored vocabularies {'town': ['Punggol']}" in capsys.readouterr().out
+    assert design.encoding != first.encoding
+    assert "Punggol" in store.load_manifest()["vocabulary"]["town"]
+    assert design.X.shape == (200, 6)
+    # The replaced store's blocks are deleted
+    assert not any(os.path.exists(store.storage.path(key)) for key in store.stored_keys(manifest))
+
+
+def test_changed_preprocessor_settings_rebuild(store, capsys):
+    df = history(3)
+    store.update(df, preprocessor())
+    store.update(df, preprocessor().set_params(cat__min_frequency=5))
+
+    assert "different preprocessor settings" in capsys.readouterr().out
+
+
+def test_rows_hash_ignores_string_dtype():
+    df = history(1)
+
+    assert rows_hash(df) == rows_hash(df.astype({"town": "category"}))
+    assert rows_hash(df) != rows_hash(df.iloc[::-1])
+
+
+def test_retrain_on_design_matrix(store, capsys):
+    df = history(24)
+    design = store.update(df, preprocessor())
+    forest = RandomForestRegressor(n_estimators=10, max_depth=6, random_state=0)
+    champion = design.pipeline(clone(forest).fit(design.training_matrix(), design.y))
+    assert store.encodes_like(champion, df)
+    capsys.readouterr()
+
+    # Growing reads only the window's months from the store, a refit all of them
+    grown = retrain(champion, df, mode="incremental", store=store)
+    assert "0 months encoded, 12 read" in capsys.readouterr().out
+    refit = retrain(champion, df, mode="full", store=store)
+    assert "0 months encoded, 24 read" in capsys.readouterr().out
+
+    X = df.drop(columns=["resale_price"]).tail(40)
+    assert len(grown.named_steps["reg"].estimators_) == 10
+    assert len(refit.named_steps["reg"].estimators_) == 10
+    assert np.allclose(refit.predict(X), champion.predict(X))
+
+
+def test_grow_skips_store_of_another_encoding(store, capsys):
+    df = history(24)
+    store.update(df.iloc[:-40], preprocessor())
+    champion = fitted_pipeline(df)
+    manifest = store.load_manifest()
+    capsys.readouterr()
+
+    assert not store.encodes_like(champion, df)
+    grown = retrain(champion, df, mode="incremental", store=store)
+
+    # Neither encoded nor read: the store is left as it was
+    assert "Design matrix" not in capsys.readouterr().out
+    assert store.load_manifest() == manifest
+    assert len(grown.named_steps["reg"].estimators_) == 10
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+from sklearn.dummy import DummyRegressor
+from sklearn.metrics import mean_absolute_error, root_mean_squared_error
+
+from modelling.common.evaluation import EvaluationCache, error_report, evaluate, model_hash, predict_all
+from modelling.common.incremental_forest import grow_forest
+from modelling.common.storage import LocalStorage
+from tests.conftest import fitted_pipeline, processed_rows
+
+
+@pytest.fixture
+def models():
+    train = processed_rows(600)
+    champion = fitted_pipeline(train)
+    return {"champion": champion,
+            "challenger": grow_forest(champion, train.tail(200), new_trees=5),
+            "refit": fitted_pipeline(train.tail(300), n_estimators=5),
+            "mean": DummyRegressor().fit(train.drop(columns=["resale_price"]), train["resale_price"])}
+
+
+def test_predict_all_matches_predict(models):
+    X = processed_rows(200, seed=1).drop(columns=["resale_price"])
+
+    predictions = predict_all(models, X)
+
+    for name, model in models.items():
+        assert np.allclose(predictions[name], model.predict(X), rtol=1e-12), name
+
+
+def test_error_report(models):
+    df = processed_rows(200, seed=1)
+    df.loc[df.index[0], "town"] = np.nan  # In no town segment
+    predictions = {name: model.predict(df.drop(columns=["resale_price"])) for name, model in models.items()}
+
+    report = error_report(df, predictions)
+
+    for name, prediction in predictions.items():
+        assert np.isclose(report[name]["rmse"], root_mean_squared_error(df["resale_price"], prediction))
+        assert np.isclose(report[name]["mae"], mean_absolute_error(df["resale_price"], prediction))
+        for column in ["town", "flat_type"]:
+            assert sum(segment["rows"] for segment in report[name]["segments"][column].values()) == \
+                   df[column].notna().sum()
+            for value, segment in report[name]["segments"][column].items():
+                rows = (df[column] == value).to_numpy()
+                assert np.isclose(segment["rmse"], root_mean_squared_error(df["resale_price"][rows], prediction[rows]))
+                assert np.isclose(segment["mae"], mean_absolute_error(df["resale_price"][rows], prediction[rows]))
+
+
+def test_evaluate_caches_keyed_predictions(models, tmp_path, capsys):
+    df = processed_rows(200, seed=1)
+    cache = EvaluationCache(LocalStorage(str(tmp_path / "hdb-resale-best-model")))
+    model_keys = {"champion": model_hash(b"champion model bytes")}
+
+    first, _ = evaluate(models, df, cache=cache, model_keys=model_keys)
+    assert "read from the cache" not in capsys.readouterr().out
+    second, predictions = evaluate(models, df, cache=cache, model_keys=model_keys)
+    assert "Predictions of champion read from the cache" in capsys.readouterr().out
+    assert first == second
+    assert np.allclose(predictions["champion"], models["champion"].predict(df.drop(columns=["resale_price"])))
+
+    # Other rows, or another champion, are scored again
+    evaluate(models, processed_rows(200, seed=2), cache=cache, model_keys=model_keys)
+    evaluate(models, df, cache=cache, model_keys={"champion": model_hash(b"another champion")})
+    assert "read from the cache" not in capsys.readouterr().out
+    # Only the latest entry is kept
+    [entry] = cache.storage.list(cache.prefix)
+    assert entry.startswith(cache.key(model_hash(b"another champion"), "").removesuffix(".npy"))
@@ -0,0 +1,70 @@
+from app.fastapi_app.main import loaded_model, fast_model
+from app.fastapi_app.fast_inference import CompiledPipeline
+from modelling.common.serving_artifact import export_serving_artifact, round_down_to_float32
+import numpy as np
+import pandas as pd
+import yaml
+
+with open("./config.yaml", "r") as file:
+    config = yaml.safe_load(file)
+
+def sample_rows(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({"town": rng.choice(config["data_towns"], n_rows),
+                         "flat_type": rng.choice(config["data_flat_types"], n_rows),
+                         "flat_model_revised": rng.choice(config["data_flat_models"], n_rows),
+                         "flat_age_years": rng.integers(0, 60, n_rows),
+                         "floor_area_sqm": rng.uniform(30, 200, n_rows).round(1),
+                         "days_from_earliest_data": rng.integers(0, 5000, n_rows),
+                         "storey_range_grouped": rng.choice(config["data_storey_range"], n_rows)})
+
+def test_fast_model_compiled():
+    assert fast_model is not None, "Champion pipeline could not be compiled"
+    assert isinstance(CompiledPipeline.from_pipeline(loaded_model), CompiledPipeline)
+
+def test_fast_model_parity():
+    sample_data = sample_rows(500)
+
+    expected = loaded_model.predict(sample_data)
+    actual = fast_model.predict_records(sample_data.to_dict(orient="records"))
+
+    assert np.allclose(actual, expected, rtol=1e-9), "Fast path predictions differ from the pipeline"
+
+def test_fast_model_single_row_parity():
+    row = sample_rows(1, seed=1).to_dict(orient="records")[0]
+
+    assert np.isclose(fast_model.predict_one(row), loaded_model.predict(pd.DataFrame([row]))[0], rtol=1e-9)
+
+def test_fast_model_unknown_category():
+    # Unknown categories are ignored by the one-hot encoder rather than raising
+    sample_data = sample_rows(5, seed=2)
+    sample_data["town"] = "ANG MO KIO"
+
+    assert np.allclose(fast_model.predict(sample_data), loaded_model.predict(sample_data), rtol=1e-9)
+
+def test_round_down_to_float32():
+    threshold = np.array([0.1, -0.1, 1.5, 44.05, 1e-8])
+    threshold_32 = round_down_to_float32(threshold)
+
+    # Never above the original threshold, and no float32 fits in between
+    assert threshold_32.dtype == np.float32
+    assert np.all(threshold_32.astype(np.float64) <= threshold)
+    assert np.all(np.nextafter(threshold_32, np.float32(np.inf)).astype(np.float64) > threshold)
+
+def test_serving_artifact_parity(tmp_path):
+    artifact_path = export_serving_artifact(loaded_model, tmp_path / "champion_model.npz")
+    artifact_model = CompiledPipeline.load(artifact_path)
+    sample_data = sample_rows(500, seed=3)
+
+    assert artifact_model.threshold.dtype == np.float32
+    assert np.allclose(artifact_model.predict(sample_data), loaded_model.predict(sample_data), rtol=1e-9)
+
+def test_compiled_pipeline_is_the_serving_artifact(tmp_path):
+    # Compiling the joblib Pipeline and loading the exported artifact give the same arrays
+    artifact_model = CompiledPipeline.load(export_serving_artifact(loaded_model, tmp_path / "champion_model.npz"))
+
+    for name in ["numeric_columns", "scaler_mean", "scaler_scale", "feature", "threshold", "children_left",
+                 "children_right", "leaf_value", "roots"]:
+        assert np.array_equal(getattr(fast_model, name), getattr(artifact_model, name)), name
+    assert fast_model.category_index == artifact_model.category_index
+    assert fast_model.max_depth == artifact_model.max_depth
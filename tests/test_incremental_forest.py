@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.metrics import root_mean_squared_error
+
+from modelling.common.design_matrix import unseen_categories, vocabulary
+from modelling.common.incremental_forest import grow_forest, latest_months, retrain
+from tests.conftest import fitted_pipeline, history
+
+
+def test_latest_months():
+    df = history(20)
+
+    assert sorted(latest_months(df, 3)["days_from_earliest_data"].unique()) == [17 * 31, 18 * 31, 19 * 31]
+    assert len(latest_months(df, 50)) == len(df)
+
+
+def test_grow_forest_replaces_oldest():
+    df = history(24)
+    champion = fitted_pipeline(df.iloc[:-120])
+    champion_trees = list(champion.named_steps["reg"].estimators_)
+
+    grown = grow_forest(champion, latest_months(df, 6), new_trees=4)
+    forest = grown.named_steps["reg"]
+
+    # The 4 oldest trees are replaced by 4 new ones, the forest keeps the champion's size and the champion itself
+    # is untouched
+    assert len(forest.estimators_) == forest.n_estimators == 10
+    assert [tree.tree_.node_count for tree in forest.estimators_[:6]] == \
+           [tree.tree_.node_count for tree in champion_trees[4:]]
+    assert len(champion.named_steps["reg"].estimators_) == 10
+    assert not forest.warm_start
+
+    # The preprocessor is reused as fitted
+    assert np.array_equal(grown.named_steps["preprocessor"].transformers_[0][1].mean_,
+                          champion.named_steps["preprocessor"].transformers_[0][1].mean_)
+    assert grown.predict(df.drop(columns=["resale_price"]).head()).shape == (5,)
+
+
+def test_retrain_incremental_is_promoted():
+    # A champion with the search's 125 trees that has gone 6 months without being replaced
+    df = history(37)
+    champion = fitted_pipeline(df[df["days_from_earliest_data"] < 30 * 31], n_estimators=125)
+    retrain_test = df[df["days_from_earliest_data"] == 36 * 31]
+
+    challenger = retrain(champion, df[df["days_from_earliest_data"] < 36 * 31], mode="incremental")
+
+    # Same size, and it beats the champion on the next month by the retraining Lambda's 5% promotion margin
+    assert len(challenger.named_steps["reg"].estimators_) == 125
+    X, y = retrain_test.drop(columns=["resale_price"]), retrain_test["resale_price"]
+    assert root_mean_squared_error(y, challenger.predict(X)) < root_mean_squared_error(y, champion.predict(X)) * 0.95
+
+
+def test_retrain_refits_on_unseen_categories():
+    champion = fitted_pipeline(history(12))
+    df = pd.concat([history(12), history(13, towns=("Punggol",), seed=1).iloc[-60:]])
+
+    assert unseen_categories(vocabulary(champion.named_steps["preprocessor"]), df) == {"town": ["Punggol"]}
+    challenger = retrain(champion, df, mode="incremental")
+
+    # Refit from scratch: the champion's tree count and an encoder that knows the new town
+    assert len(challenger.named_steps["reg"].estimators_) == 10
+    assert not unseen_categories(vocabulary(challenger.named_steps["preprocessor"]), df)
+
+
+def test_retrain_unknown_mode():
+    with pytest.raises(ValueError):
+        retrain(fitted_pipeline(history(3)), history(3), mode="partial")
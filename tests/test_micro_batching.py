@@ -0,0 +1,57 @@
+import asyncio
+
+from app.fastapi_app.micro_batching import MicroBatcher
+
+def test_concurrent_requests_are_coalesced():
+    calls = []
+
+    def predict_fn(records):
+        calls.append(len(records))
+        return [record["x"] * 2 for record in records]
+
+    async def run():
+        batcher = MicroBatcher(predict_fn, max_batch_size=64, max_wait_seconds=0.05)
+        return await asyncio.gather(*[batcher.submit({"x": i}) for i in range(10)])
+
+    results = asyncio.run(run())
+
+    # Every caller gets its own prediction back, from a single predict call
+    assert results == [i * 2 for i in range(10)]
+    assert calls == [10]
+
+def test_batches_are_capped_at_max_size():
+    calls = []
+
+    def predict_fn(records):
+        calls.append(len(records))
+        return [0.0] * len(records)
+
+    async def run():
+        batcher = MicroBatcher(predict_fn, max_batch_size=4, max_wait_seconds=0.05)
+        await asyncio.gather(*[batcher.submit({"x": i}) for i in range(10)])
+        return batcher.stats()
+
+    stats = asyncio.run(run())
+
+    assert max(calls) <= 4
+    assert sum(calls) == 10
+    assert stats["requests"] == 10
+
+def test_errors_are_returned_to_every_caller():
+    def predict_fn(records):
+        raise ValueError("bad batch")
+
+    async def run():
+        batcher = MicroBatcher(predict_fn, max_wait_seconds=0.01)
+        return await asyncio.gather(*[batcher.submit({"x": i}) for i in range(3)], return_exceptions=True)
+
+    results = asyncio.run(run())
+
+    assert all(isinstance(result, ValueError) for result in results)
+
+def test_batcher_restarts_on_new_event_loop():
+    batcher = MicroBatcher(lambda records: [1.0] * len(records), max_wait_seconds=0.001)
+
+    assert asyncio.run(batcher.submit({"x": 1})) == 1.0
+    assert asyncio.run(batcher.submit({"x": 2})) == 1.0
+    assert batcher.stats()["batches"] == 2
@@ -1,7 +1,10 @@
+import io
+
 import numpy as np
 import joblib
 import pandas as pd
-import boto3
+
+from modelling.common.storage import get_bytes, open_storage
 
 def test_prediction():
     # Load data
@@ -13,11 +16,9 @@ def test_prediction():
                                 "days_from_earliest_data":[4323],
                                 "storey_range_grouped":["1-15"]})
     
-    # Load model from s3 by downloading to tmp folder first
-    s3_input = boto3.resource('s3', region_name='ap-southeast-1')
-    input_bucket = s3_input.Bucket('hdb-resale-best-model')
-    input_bucket.download_file('champion_model.joblib', '/tmp/champion_model.joblib')
-    loaded_model = joblib.load('/tmp/champion_model.joblib')
+    # Load model from s3 through the local artifact cache (unless ARTIFACT_CACHE_MAX_GB=0), only downloaded again
+    # when it changed
+    loaded_model = joblib.load(io.BytesIO(get_bytes(open_storage('hdb-resale-best-model'), 'champion_model.joblib')))
 
     # Prediction
     pred = loaded_model.predict(sample_data)
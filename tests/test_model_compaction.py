@@ -0,0 +1,95 @@
+import io
+import os
+
+import joblib
+import numpy as np
+import pytest
+
+from app.fastapi_app.fast_inference import CompiledPipeline
+from modelling.common.incremental_forest import grow_forest
+from modelling.common.model_compaction import (STRIPPED_NODE_FIELDS, compact_pipeline, compaction_report, save_model,
+                                               select_trees)
+from modelling.common.serving_artifact import export_serving_artifact
+from tests.conftest import fitted_pipeline, processed_rows
+
+
+@pytest.fixture(scope="module")
+def pipeline():
+    return fitted_pipeline(processed_rows(2000), n_estimators=30, max_depth=8)
+
+
+def test_compact_pipeline_predicts_the_same(pipeline):
+    compacted = compact_pipeline(pipeline)
+    X = processed_rows(500, seed=1).drop(columns=["resale_price"])
+
+    # Only the float32 rounding of the leaf values moves predictions
+    assert np.allclose(compacted.predict(X), pipeline.predict(X), rtol=1e-7, atol=0)
+    for original, compact in zip(pipeline.named_steps["reg"].estimators_, compacted.named_steps["reg"].estimators_):
+        nodes = compact.tree_.__getstate__()["nodes"]
+        assert np.array_equal(compact.tree_.threshold, compact.tree_.threshold.astype(np.float32))
+        assert np.array_equal(compact.tree_.value, compact.tree_.value.astype(np.float32))
+        assert all(not nodes[field].any() for field in STRIPPED_NODE_FIELDS)
+        assert np.array_equal(compact.apply(X.pipe(pipeline.named_steps["preprocessor"].transform)),
+                              original.apply(X.pipe(pipeline.named_steps["preprocessor"].transform)))
+    # The original is left as it was
+    assert pipeline.named_steps["reg"].estimators_[0].tree_.n_node_samples.any()
+
+
+def test_compacted_model_is_smaller_and_loads(pipeline, tmp_path):
+    compacted = compact_pipeline(pipeline)
+    path = save_model(compacted, tmp_path / "champion_model.joblib")
+    df = processed_rows(300, seed=2)
+
+    report = compaction_report(pipeline, compacted, df, path)
+
+    assert report["compacted"]["bytes"] < report["original"]["bytes"] / 4
+    assert report["original"]["trees"] == report["compacted"]["trees"] == 30
+    assert report["prediction_drift"]["max_relative"] < 1e-7
+    assert abs(report["compacted"]["rmse"] - report["original"]["rmse"]) < 1
+    with open(path, "rb") as file:
+        loaded = joblib.load(io.BytesIO(file.read()))  # As the retraining Lambda loads the champion
+    assert np.array_equal(loaded.predict(df.drop(columns=["resale_price"])),
+                          compacted.predict(df.drop(columns=["resale_price"])))
+
+
+def test_compacted_model_serves_and_grows(pipeline, tmp_path):
+    compacted = compact_pipeline(pipeline)
+    X = processed_rows(200, seed=3).drop(columns=["resale_price"])
+
+    # Float32 leaves lose nothing in the serving artifact of a compacted model, compressed or not
+    for compress in (False, True):
+        path = export_serving_artifact(compacted, tmp_path / f"champion_model_{compress}.npz", leaf_dtype=np.float32,
+                                       compress=compress)
+        assert np.allclose(CompiledPipeline.load(path).predict(X), compacted.predict(X), rtol=1e-9)
+    assert os.path.getsize(tmp_path / "champion_model_True.npz") < os.path.getsize(tmp_path / "champion_model_False.npz")
+
+    grown = grow_forest(compacted, processed_rows(300, seed=4), new_trees=5)
+    assert len(grown.named_steps["reg"].estimators_) == 30
+
+
+def test_select_trees():
+    rng = np.random.default_rng(0)
+    # 20 trees close to the forest's mean and 5 far from it, which a small tolerance needs to keep balanced
+    tree_predictions = np.vstack([rng.normal(100, 1, (20, 50)), rng.normal(100, 30, (5, 50))])
+    target = tree_predictions.mean(axis=0)
+
+    for tolerance in (0.01, 0.05):
+        kept = select_trees(tree_predictions, tolerance)
+        assert kept == sorted(kept) and len(kept) < 25
+        drift = np.sqrt(np.mean((tree_predictions[kept].mean(axis=0) - target) ** 2))
+        assert drift <= tolerance * np.sqrt(np.mean(target ** 2))
+    assert len(select_trees(tree_predictions, 0.05)) <= len(select_trees(tree_predictions, 0.01))
+    assert select_trees(tree_predictions, 0) == list(range(25))
+
+
+def test_prune_keeps_predictions_within_tolerance(pipeline):
+    df = processed_rows(1000, seed=5)
+
+    pruned = compact_pipeline(pipeline, df, prune_tolerance=0.01)
+
+    X = df.drop(columns=["resale_price"])
+    original = pipeline.predict(X)
+    assert len(pruned.named_steps["reg"].estimators_) == pruned.named_steps["reg"].n_estimators < 30
+    assert np.sqrt(np.mean((pruned.predict(X) - original) ** 2)) <= 0.01 * np.sqrt(np.mean(original ** 2)) * 1.01
+    with pytest.raises(ValueError):
+        compact_pipeline(pipeline, prune_tolerance=0.01)
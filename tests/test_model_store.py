@@ -0,0 +1,86 @@
+import os
+import shutil
+import time
+from copy import deepcopy
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from app.fastapi_app.main import MODEL_PATH, loaded_model
+from app.fastapi_app.model_store import ModelStore, load_model
+from modelling.common.serving_artifact import export_serving_artifact
+from tests.conftest import sample_json
+
+def write_smaller_model(path):
+    # A different but valid champion: the same pipeline with only its first 10 trees
+    smaller_model = deepcopy(loaded_model)
+    smaller_model.named_steps["reg"].estimators_ = smaller_model.named_steps["reg"].estimators_[:10]
+    smaller_model.named_steps["reg"].n_estimators = 10
+    joblib.dump(smaller_model, str(path) + ".tmp")
+    os.replace(str(path) + ".tmp", path)
+    return smaller_model
+
+def test_load_model(tmp_path):
+    model_path = shutil.copy(MODEL_PATH, tmp_path / "champion_model.joblib")
+    model = load_model(model_path)
+
+    assert model.fast_model is not None
+    assert len(model.version) == 12
+    assert np.allclose(model.pipeline.predict(pd.DataFrame([sample_json])),
+                       loaded_model.predict(pd.DataFrame([sample_json])))
+
+def test_load_serving_artifact(tmp_path):
+    artifact_path = export_serving_artifact(loaded_model, tmp_path / "champion_model.npz")
+    model = load_model(artifact_path)
+
+    # Scored from the artifact alone, the pipeline slot holds the compiled model
+    assert model.pipeline is model.fast_model
+    assert np.allclose(model.pipeline.predict(pd.DataFrame([sample_json])),
+                       loaded_model.predict(pd.DataFrame([sample_json])))
+
+def test_serving_artifact_memory_mapped(tmp_path):
+    artifact_path = export_serving_artifact(loaded_model, tmp_path / "champion_model.npz")
+    mapped, read = load_model(artifact_path, "r"), load_model(artifact_path, None)
+
+    # The tree arrays are views of the file, shared by every process mapping it
+    for name in ["feature", "threshold", "children_left", "children_right", "leaf_value"]:
+        assert isinstance(getattr(mapped.fast_model, name), np.memmap)
+        assert not isinstance(getattr(read.fast_model, name), np.memmap)
+    assert mapped.version == read.version
+    assert np.isclose(mapped.fast_model.predict_one(sample_json), read.fast_model.predict_one(sample_json))
+
+    # A compressed artifact cannot be mapped and is read instead
+    compressed = load_model(export_serving_artifact(loaded_model, tmp_path / "compressed.npz", compress=True), "r")
+    assert not isinstance(compressed.fast_model.threshold, np.memmap)
+
+def test_reload_swaps_model(tmp_path):
+    model_path = shutil.copy(MODEL_PATH, tmp_path / "champion_model.joblib")
+    store = ModelStore(model_path)
+    old_model = store.current
+
+    smaller_model = write_smaller_model(model_path)
+    new_model = store.reload()
+
+    # The old model object is left untouched for requests still using it
+    assert new_model.version != old_model.version
+    assert store.current is new_model
+    assert store.status()["reloads"] == 1
+    assert np.isclose(new_model.fast_model.predict_one(sample_json),
+                      smaller_model.predict(pd.DataFrame([sample_json]))[0])
+    assert np.isclose(old_model.fast_model.predict_one(sample_json),
+                      loaded_model.predict(pd.DataFrame([sample_json]))[0])
+
+def test_watcher_picks_up_new_model(tmp_path):
+    model_path = shutil.copy(MODEL_PATH, tmp_path / "champion_model.joblib")
+    store = ModelStore(model_path)
+    old_version = store.current.version
+    store.start_watcher(0.05)
+
+    write_smaller_model(model_path)
+    for _ in range(100):
+        if store.current.version != old_version:
+            break
+        time.sleep(0.05)
+
+    assert store.current.version != old_version
@@ -0,0 +1,61 @@
+import time
+
+import pytest
+
+from app.fastapi_app.prediction_cache import PredictionCache
+from tests.conftest import sample_json
+
+record = sample_json
+
+def test_cache_hit_and_miss():
+    cache = PredictionCache(max_size=10)
+    assert cache.get(record, "v1") is None
+    cache.put(record, 250000.0, "v1")
+
+    # Same features in a different order and numeric type share a key
+    reordered = dict(reversed(list(record.items())), floor_area_sqm=44)
+    assert cache.get(reordered, "v1") == 250000.0
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+def test_cache_invalidated_on_model_change():
+    cache = PredictionCache(max_size=10)
+    cache.put(record, 250000.0, "v1")
+
+    assert cache.get(record, "v2") is None
+    assert cache.stats()["invalidations"] == 1
+    assert cache.stats()["size"] == 0
+
+def test_cache_lru_eviction():
+    cache = PredictionCache(max_size=2)
+    records = [dict(record, flat_age_years=age) for age in range(3)]
+    cache.put(records[0], 1.0, "v1")
+    cache.put(records[1], 2.0, "v1")
+    cache.get(records[0], "v1")  # records[1] is now the least recently used
+    cache.put(records[2], 3.0, "v1")
+
+    assert cache.get(records[1], "v1") is None
+    assert cache.get(records[0], "v1") == 1.0
+    assert cache.stats()["evictions"] == 1
+
+def test_cache_fifo_eviction():
+    cache = PredictionCache(max_size=2, eviction="fifo")
+    records = [dict(record, flat_age_years=age) for age in range(3)]
+    cache.put(records[0], 1.0, "v1")
+    cache.put(records[1], 2.0, "v1")
+    cache.get(records[0], "v1")
+    cache.put(records[2], 3.0, "v1")
+
+    assert cache.get(records[0], "v1") is None
+
+def test_cache_ttl_expiry():
+    cache = PredictionCache(max_size=10, ttl_seconds=0.01)
+    cache.put(record, 250000.0, "v1")
+    time.sleep(0.02)
+
+    assert cache.get(record, "v1") is None
+    assert cache.stats()["expirations"] == 1
+
+def test_cache_unknown_eviction_policy():
+    with pytest.raises(ValueError):
+        PredictionCache(eviction="random")
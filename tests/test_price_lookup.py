@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from app.fastapi_app.main import loaded_model
+from app.fastapi_app.model_store import load_model
+from app.fastapi_app.price_lookup import PriceLookupTable
+from modelling.common.price_grid import build_price_grid, grid_error, lookup_prices, save_price_grid, validate_price_grid
+from tests.test_fast_inference import sample_rows
+
+# Small grid so the tests build it quickly
+axes = {"floor_area_sqm": np.array([40.0, 80.0, 120.0]),
+        "flat_age_years": np.array([0.0, 20.0, 40.0]),
+        "days_from_earliest_data": np.array([3000.0, 4000.0])}
+train_df = sample_rows(30, seed=3)
+grid = build_price_grid(loaded_model, train_df, axes)
+
+def test_grid_nodes_match_model():
+    nodes = train_df.drop(columns=["floor_area_sqm", "flat_age_years", "days_from_earliest_data"])
+    nodes = nodes.assign(floor_area_sqm=80.0, flat_age_years=20.0, days_from_earliest_data=4000.0)
+
+    prices, found = lookup_prices(grid, nodes)
+
+    assert found.all()
+    assert np.allclose(prices, loaded_model.predict(nodes), rtol=1e-6)
+
+def test_outside_grid_not_found():
+    rows = train_df.head(3).copy()
+    rows.loc[rows.index[0], "floor_area_sqm"] = 200.0
+    rows.loc[rows.index[1], "town"] = "Not A Town"
+    rows.loc[rows.index[2], "days_from_earliest_data"] = 100
+
+    _, found = lookup_prices(grid, rows)
+
+    assert not found.any()
+
+# Validation report of a grid accurate enough to be served
+accurate_report = {"random_points": {"p99_relative_error": 0.001}}
+
+def test_dates_after_training_priced_at_axis_end():
+    # The app always asks for today's date, after the last training month the days axis ends at
+    rows = train_df.assign(floor_area_sqm=80.0, flat_age_years=20.0, days_from_earliest_data=4000)
+    later = rows.assign(days_from_earliest_data=4000 + 365)
+
+    prices, found = lookup_prices(grid, rows)
+    later_prices, later_found = lookup_prices(grid, later)
+
+    assert later_found.all() and found.all()
+    assert np.array_equal(later_prices, prices)
+    # Which is what the forest does past its last split on days
+    far_future = [later.assign(days_from_earliest_data=days) for days in (10 ** 5, 10 ** 6)]
+    assert np.array_equal(loaded_model.predict(far_future[0]), loaded_model.predict(far_future[1]))
+
+def test_app_lookup_matches_builder(tmp_path):
+    save_price_grid(grid, accurate_report, tmp_path / "price_grid.npz", tmp_path / "price_grid_report.json")
+    table = PriceLookupTable.load(tmp_path / "price_grid.npz")
+    rows = train_df.assign(floor_area_sqm=np.linspace(40, 120, len(train_df)).round(1),
+                           flat_age_years=np.arange(len(train_df)) % 41,
+                           days_from_earliest_data=3500)
+
+    expected, expected_found = lookup_prices(grid, rows)
+    actual, found = table.lookup_records(rows.to_dict(orient="records"))
+
+    assert (found == expected_found).all() and found.all()
+    assert np.allclose(actual, expected)
+
+def test_inaccurate_grid_refused(tmp_path):
+    report = validate_price_grid(loaded_model, grid, train_df, n_samples=200)
+    assert grid_error(report) == max(report["random_points"]["p99_relative_error"],
+                                      report["holdout"]["p99_relative_error"])
+    save_price_grid(grid, {"random_points": {"p99_relative_error": 0.5}}, tmp_path / "price_grid.npz",
+                    tmp_path / "price_grid_report.json")
+
+    with pytest.raises(ValueError):
+        PriceLookupTable.load(tmp_path / "price_grid.npz")
+    assert PriceLookupTable.load(tmp_path / "price_grid.npz", max_error=0.6) is not None
+    # The app keeps serving, from the model alone
+    model_path = "./app/fastapi_app/champion_model/champion_model.joblib"
+    assert load_model(model_path, None, str(tmp_path / "price_grid.npz")).price_lookup is None
+
+def test_price_lookup_loaded_with_model(tmp_path):
+    save_price_grid(grid, accurate_report, tmp_path / "price_grid.npz", tmp_path / "price_grid_report.json")
+    model_path = "./app/fastapi_app/champion_model/champion_model.joblib"
+
+    with_lookup = load_model(model_path, None, str(tmp_path / "price_grid.npz"))
+
+    assert isinstance(with_lookup.price_lookup, PriceLookupTable)
+    assert load_model(model_path, None).price_lookup is None
+    assert with_lookup.version != load_model(model_path, None).version, "The grid is part of the model version"
@@ -0,0 +1,61 @@
+import boto3
+import pandas as pd
+import pyarrow as pa
+import pytest
+from moto import mock_aws
+
+from modelling.common.processed_data import (COLUMN_TYPES, processed_to_parquet, read_processed,
+                                             read_processed_parquet, to_processed_table, write_processed)
+
+@pytest.fixture
+def processed_df():
+    return pd.DataFrame({"town": ["Ang Mo Kio", "Bedok", "Bedok"],
+                         "flat_type": ["2 Room", "3 Room", "4 Room"],
+                         "flat_model_revised": ["Improved", "Model A", "Maisonette"],
+                         "flat_age_years": [39, 10, 25],
+                         "floor_area_sqm": [44.1, 67.1, 104.5],
+                         "days_from_earliest_data": [4170, 100, 3500],
+                         "storey_range_grouped": pd.Categorical(["1-15", "16-30", "31+"]),
+                         "resale_price": [250000, 400000.0, 1288888]})
+
+@pytest.fixture
+def processed_bucket():
+    with mock_aws():
+        s3 = boto3.resource("s3", region_name="ap-southeast-1")
+        yield s3.create_bucket(Bucket="hdb-resale-pred-processed",
+                               CreateBucketConfiguration={"LocationConstraint": "ap-southeast-1"})
+
+def test_fixed_schema(processed_df):
+    table = to_processed_table(processed_df)
+
+    assert table.schema == pa.schema([(name, COLUMN_TYPES[name]) for name in processed_df.columns])
+
+def test_parquet_round_trip(processed_df):
+    df = read_processed_parquet(processed_to_parquet(processed_df))
+
+    assert (df.select_dtypes(include=["category"]).columns ==
+            ["town", "flat_type", "flat_model_revised", "storey_range_grouped"]).all()
+    assert df["flat_age_years"].dtype == "int16" and df["floor_area_sqm"].dtype == "float64"
+    # Values are exact after narrowing
+    assert df["resale_price"].tolist() == processed_df["resale_price"].tolist()
+    assert df["floor_area_sqm"].tolist() == processed_df["floor_area_sqm"].tolist()
+    assert df["town"].astype(str).tolist() == processed_df["town"].tolist()
+
+def test_value_out_of_range(processed_df):
+    with pytest.raises(pa.ArrowInvalid):
+        to_processed_table(processed_df.assign(flat_age_years=[39, 10, 40000]))
+
+def test_read_processed_columns(processed_bucket, processed_df):
+    write_processed(processed_bucket, "train", processed_df)
+
+    df = read_processed(processed_bucket, "train", ["town", "floor_area_sqm"])
+
+    assert list(df.columns) == ["town", "floor_area_sqm"]
+    assert len(df) == len(processed_df)
+
+def test_read_processed_csv_fallback(processed_bucket, processed_df):
+    write_processed(processed_bucket, "test", processed_df, formats=("csv",))
+
+    df = read_processed(processed_bucket, "test", ["town", "resale_price"])
+
+    assert df.equals(processed_df[["town", "resale_price"]].astype({"resale_price": float}))
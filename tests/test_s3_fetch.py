@@ -0,0 +1,45 @@
+import threading
+import time
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from modelling.common.s3_fetch import fetch_objects, map_concurrently, s3_config
+
+@pytest.fixture
+def bucket():
+    with mock_aws():
+        s3 = boto3.resource("s3", region_name="ap-southeast-1", config=s3_config())
+        bucket = s3.create_bucket(Bucket="hdb-resale-pred-processed",
+                                  CreateBucketConfiguration={"LocationConstraint": "ap-southeast-1"})
+        for number in range(20):
+            bucket.put_object(Key=f"partitions/month=2024-{number:02d}.parquet", Body=f"rows {number}".encode())
+        yield bucket
+
+def test_fetch_objects_keeps_key_order(bucket):
+    keys = [f"partitions/month=2024-{number:02d}.parquet" for number in reversed(range(20))]
+
+    assert fetch_objects(bucket, keys) == [f"rows {number}".encode() for number in reversed(range(20))]
+
+def test_fetch_objects_parse(bucket):
+    keys = ["partitions/month=2024-03.parquet", "partitions/month=2024-07.parquet"]
+
+    assert fetch_objects(bucket, keys, parse=lambda key, data: (key, len(data))) == [(keys[0], 6), (keys[1], 6)]
+
+def test_fetch_objects_missing_key(bucket):
+    with pytest.raises(bucket.meta.client.exceptions.NoSuchKey):
+        fetch_objects(bucket, ["partitions/month=2024-00.parquet", "partitions/month=1999-01.parquet"])
+
+def test_map_concurrently_runs_in_parallel():
+    start = time.perf_counter()
+    threads = map_concurrently(lambda item: time.sleep(0.1) or threading.current_thread().name, range(8),
+                               concurrency=8)
+
+    assert time.perf_counter() - start < 0.5
+    assert len(set(threads)) == 8
+
+def test_map_concurrently_sequential():
+    assert map_concurrently(lambda item: threading.current_thread().name, range(3), concurrency=1) == \
+           [threading.current_thread().name] * 3
+    assert map_concurrently(str, []) == []
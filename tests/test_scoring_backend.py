@@ -0,0 +1,77 @@
+import shutil
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.fastapi_app.main import MODEL_PATH, model_store, loaded_model
+from app.fastapi_app.model_store import load_model
+from app.fastapi_app.scoring_backend import InlineBackend, ProcessPoolBackend, make_backend
+from tests.conftest import sample_json
+from tests.test_model_store import write_smaller_model
+
+records = [dict(sample_json, flat_age_years=age, floor_area_sqm=40.0 + age) for age in range(20)]
+
+def test_inline_backend():
+    backend = InlineBackend()
+    predictions = backend.predict(model_store.current, records)
+
+    assert np.allclose(predictions, loaded_model.predict(pd.DataFrame(records)))
+    assert backend.stats()["tasks_completed"] == 1
+    assert backend.stats()["in_flight"] == 0
+
+def test_process_pool_backend():
+    backend = ProcessPoolBackend(n_workers=2)
+    try:
+        predictions = [backend.predict(model_store.current, records[i:i + 5]) for i in range(0, 20, 5)]
+        stats = backend.stats()
+    finally:
+        backend.shutdown()
+
+    assert np.allclose(np.concatenate(predictions), loaded_model.predict(pd.DataFrame(records)))
+    assert stats["workers"] == 2
+    assert stats["tasks_completed"] == 4
+    assert stats["queue_depth"] == 0
+
+def test_process_pool_loads_swapped_model(tmp_path):
+    model_path = shutil.copy(MODEL_PATH, tmp_path / "champion_model.joblib")
+    backend = ProcessPoolBackend(n_workers=1)
+    try:
+        first = backend.predict(load_model(model_path), records)
+        # Workers load the new champion from its path rather than receiving it from this process
+        smaller_model = write_smaller_model(model_path)
+        second = backend.predict(load_model(model_path), records)
+    finally:
+        backend.shutdown()
+
+    assert np.allclose(first, loaded_model.predict(pd.DataFrame(records)))
+    assert np.allclose(second, smaller_model.predict(pd.DataFrame(records)))
+
+def test_backends_score_frames():
+    input_df = pd.DataFrame(records)
+    backends = [InlineBackend(), ProcessPoolBackend(n_workers=2)]
+    try:
+        predictions = [backend.predict_frame(model_store.current, input_df) for backend in backends]
+    finally:
+        backends[1].shutdown()
+
+    # The pool splits the rows between its workers and puts them back in order
+    for backend_predictions in predictions:
+        assert np.allclose(backend_predictions, loaded_model.predict(input_df))
+    assert backends[1].stats()["tasks_completed"] == 1
+
+def test_process_pool_refuses_changed_model(tmp_path):
+    model_path = shutil.copy(MODEL_PATH, tmp_path / "champion_model.joblib")
+    model = load_model(model_path)
+    write_smaller_model(model_path)  # Changed on disk after the live model was loaded
+    backend = ProcessPoolBackend(n_workers=1)
+    try:
+        with pytest.raises(BrokenProcessPool):
+            backend.predict(model, records)
+    finally:
+        backend.shutdown()
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        make_backend("gpu")
@@ -0,0 +1,105 @@
+import os
+
+import boto3
+import pandas as pd
+import pytest
+from moto import mock_aws
+
+from modelling.common.processed_data import read_processed, write_processed
+from modelling.common.storage import CachedStorage, LocalStorage, ObjectNotFound, S3Storage, get_bytes
+
+@pytest.fixture
+def s3_storage():
+    with mock_aws():
+        client = boto3.client("s3", region_name="ap-southeast-1")
+        client.create_bucket(Bucket="hdb-resale-best-model",
+                             CreateBucketConfiguration={"LocationConstraint": "ap-southeast-1"})
+        yield S3Storage("hdb-resale-best-model", client)
+
+@pytest.fixture(params=["s3", "local"])
+def backend(request, tmp_path):
+    if request.param == "local":
+        return LocalStorage(str(tmp_path / "hdb-resale-best-model"))
+    return request.getfixturevalue("s3_storage")
+
+def test_cache_revalidates_by_etag(backend, tmp_path):
+    backend.put("champion_model.joblib", b"champion 1")
+    storage = CachedStorage(backend, str(tmp_path / "cache"))
+
+    assert get_bytes(storage, "champion_model.joblib") == b"champion 1"
+    assert get_bytes(storage, "champion_model.joblib") == b"champion 1"
+    assert storage.stats == {"hits": 1, "misses": 1, "downloaded_bytes": 10, "evictions": 0}
+
+    backend.put("champion_model.joblib", b"champion 2!")
+    assert get_bytes(storage, "champion_model.joblib") == b"champion 2!"
+    assert storage.stats["misses"] == 2 and storage.stats["downloaded_bytes"] == 21
+
+    # Another job on the same machine starts with the objects already cached
+    assert get_bytes(CachedStorage(backend, str(tmp_path / "cache")), "champion_model.joblib") == b"champion 2!"
+
+def test_missing_object(backend, tmp_path):
+    with pytest.raises(ObjectNotFound):
+        get_bytes(backend, "champion_model.joblib")
+    with pytest.raises(ObjectNotFound):
+        CachedStorage(backend, str(tmp_path / "cache")).path("champion_model.joblib")
+
+def test_delete(backend, tmp_path):
+    storage = CachedStorage(backend, str(tmp_path / "cache"))
+    storage.put("champion_model.joblib", b"champion")
+    cached_path = storage.path("champion_model.joblib")
+
+    storage.delete("champion_model.joblib")
+    storage.delete("champion_model.joblib")  # Deleting a missing object is not an error, as in S3
+
+    assert not os.path.exists(cached_path)
+    with pytest.raises(ObjectNotFound):
+        get_bytes(storage, "champion_model.joblib")
+
+def test_list(backend, tmp_path):
+    for key in ["prediction-cache/a/1.npy", "prediction-cache/b/2.npy", "champion_model.joblib"]:
+        backend.put(key, b"x")
+
+    assert backend.list("prediction-cache/") == ["prediction-cache/a/1.npy", "prediction-cache/b/2.npy"]
+    assert CachedStorage(backend, str(tmp_path / "cache")).list() == sorted(backend.list("prediction-cache/")
+                                                                           + ["champion_model.joblib"])
+
+def test_cache_eviction(s3_storage, tmp_path):
+    storage = CachedStorage(s3_storage, str(tmp_path / "cache"), max_bytes=250)
+    for key in ["train.parquet", "test.parquet", "retrain_test.parquet"]:
+        s3_storage.put(key, b"x" * 100)
+    paths = [storage.path(key) for key in ["train.parquet", "test.parquet"]]
+    os.utime(paths[0], (0, 0))  # Least recently used
+
+    storage.path("retrain_test.parquet")
+
+    assert storage.stats["evictions"] == 1
+    assert not os.path.exists(paths[0]) and os.path.exists(paths[1])
+    assert get_bytes(storage, "train.parquet") == b"x" * 100
+
+def test_cache_hit_evicted_concurrently(backend, tmp_path):
+    storage = CachedStorage(backend, str(tmp_path / "cache"))
+    backend.put("champion_model.joblib", b"champion")
+    cached_path = storage.path("champion_model.joblib")
+    revalidate = backend.get
+
+    def get_then_evict(key, if_none_match=None):
+        # Another reader evicts the object between its revalidation and this reader touching it
+        result = revalidate(key, if_none_match=if_none_match)
+        if if_none_match:
+            os.remove(cached_path)
+        return result
+
+    backend.get = get_then_evict
+
+    assert get_bytes(storage, "champion_model.joblib") == b"champion"
+    assert storage.stats["misses"] == 2 and storage.stats["hits"] == 0
+
+def test_read_processed_through_cache(s3_storage, tmp_path):
+    df = pd.DataFrame({"town": ["Bedok", "Tampines"], "floor_area_sqm": [67.0, 104.5]})
+    write_processed(s3_storage, "train", df, formats=("csv",))
+    storage = CachedStorage(s3_storage, str(tmp_path / "cache"))
+
+    for _ in range(2):
+        pd.testing.assert_frame_equal(read_processed(storage, "train"), df)
+
+    assert storage.stats["hits"] == 1
@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+from fastapi.testclient import TestClient
+
+from app.fastapi_app.main import ColumnarInputData, app, loaded_model
+from app.streamlit.sweep import SWEEP_FEATURES, build_sweep, sweep_values
+
+payload = {"flat_age_years": 10,
+           "floor_area_sqm": 90.0,
+           "days_from_earliest_data": 4323,
+           "flat_type": "4 Room",
+           "flat_model_revised": "Improved",
+           "town": "Ang Mo Kio",
+           "storey_range_grouped": "1-15"}
+
+def test_sweep_values():
+    assert np.array_equal(sweep_values("floor_area_sqm", 90.0, 3), [60.0, 90.0, 120.0])
+    # Never below the lowest sensible value, and whole years without repeats
+    ages = sweep_values("flat_age_years", 5, 50)
+    assert ages[0] == 0 and len(ages) == len(np.unique(ages)) == 41
+    assert ages.dtype.kind == "i"
+
+def test_build_sweep_columns():
+    columns, curves = build_sweep(payload, list(SWEEP_FEATURES), 5)
+
+    assert [feature for feature, _ in curves] == list(SWEEP_FEATURES)
+    assert set(columns) == set(payload)
+    n_rows = sum(len(values) for _, values in curves)
+    assert {len(values) for values in columns.values()} == {n_rows}
+
+    # Each curve's rows vary only its feature, the rest are the input
+    start = 0
+    for feature, values in curves:
+        rows = pd.DataFrame(columns).iloc[start:start + len(values)]
+        assert rows[feature].tolist() == values.tolist()
+        for name in payload.keys() - {feature}:
+            assert (rows[name] == payload[name]).all()
+        start += len(values)
+
+def test_sweep_scored_in_one_batch():
+    columns, curves = build_sweep(payload, ["floor_area_sqm"], 7)
+    ColumnarInputData(**columns)  # Valid as the batch endpoint's columnar body
+
+    response = TestClient(app).post("/predict/batch", json=columns)
+
+    assert response.status_code == 200
+    assert np.allclose(response.json()["Predictions"], loaded_model.predict(pd.DataFrame(columns)))